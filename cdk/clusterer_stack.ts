@@ -124,7 +124,9 @@ export class ClustererStack extends cdk.Stack {
     // Grant Lambda permissions to be triggered by the queue
     lambdaFunction.addEventSource(
       new lambdaEventSources.SqsEventSource(props.coreStack.clustererSQSQueue, {
-        batchSize: 1, // Process one message at a time
+        batchSize: 10, // Up to 10 messages per invocation
+        maxBatchingWindow: cdk.Duration.seconds(5),
+        reportBatchItemFailures: true, // Only failed messages are retried
       })
     );
   }
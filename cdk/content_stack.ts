@@ -70,7 +70,9 @@ export class ContentStack extends cdk.Stack {
     // Grant Lambda permissions to be triggered by the queue
     lambdaFunction.addEventSource(
       new lambdaEventSources.SqsEventSource(props.coreStack.contentSQSQueue, {
-        batchSize: 1, // Process one message at a time
+        batchSize: 5, // Up to 5 messages per invocation
+        maxBatchingWindow: cdk.Duration.seconds(5),
+        reportBatchItemFailures: true, // Only failed messages are retried
       })
     );
   }
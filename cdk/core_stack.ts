@@ -20,7 +20,34 @@ export class CoreStack extends cdk.Stack {
       blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
       removalPolicy: cdk.RemovalPolicy.DESTROY,
       autoDeleteObjects: true,
-      notificationsSkipDestinationValidation: true
+      notificationsSkipDestinationValidation: true,
+      lifecycleRules: [
+        {
+          // Idempotency ledger entries only matter while a message can still be redelivered
+          prefix: 'ledger/',
+          expiration: cdk.Duration.days(14),
+        },
+        {
+          // TTS clip cache, hits refresh a clip so this evicts the least recently used ones
+          prefix: 'tts-cache/',
+          expiration: cdk.Duration.days(30),
+        },
+        {
+          // Shared episodes only matter for the week they were generated in
+          prefix: 'episodes/',
+          expiration: cdk.Duration.days(14),
+        },
+        {
+          // Cached podcast segments, articles stop being recommended well before this
+          prefix: 'segments/',
+          expiration: cdk.Duration.days(30),
+        },
+        {
+          // Cached research notes, a document stays in the scrapers' lookback for 7 days
+          prefix: 'research/',
+          expiration: cdk.Duration.days(14),
+        },
+      ],
     });
 
     // Create bucket for scraper
@@ -47,9 +74,9 @@ export class CoreStack extends cdk.Stack {
 
     // Create Clusterer queue
     this.clustererSQSQueue = new sqs.Queue(this, 'clustererSQSQueue', {
-        visibilityTimeout: cdk.Duration.seconds(60*15), // 15 minutes
+        visibilityTimeout: cdk.Duration.seconds(60*90), // 6x the 15 minute function timeout, as AWS recommends for Lambda event sources
         deadLetterQueue: {
-            maxReceiveCount: 2,
+            maxReceiveCount: 5, // Records the dispatcher runs out of time for are requeued, these are real failures
             queue: new sqs.Queue(this, 'custererDLQ', {
                 queueName: 'clustererSQSQueue_DLQ',
                 retentionPeriod: cdk.Duration.days(14), // Retain messages in DLQ for 14 days
@@ -58,9 +85,9 @@ export class CoreStack extends cdk.Stack {
     });
 
     this.contentSQSQueue = new sqs.Queue(this, 'contentSQSQueue', {
-        visibilityTimeout: cdk.Duration.seconds(60*15), // 15 minutes
+        visibilityTimeout: cdk.Duration.seconds(60*90), // 6x the 15 minute function timeout, as AWS recommends for Lambda event sources
         deadLetterQueue: {
-            maxReceiveCount: 2,
+            maxReceiveCount: 5, // Records the dispatcher runs out of time for are requeued, these are real failures
             queue: new sqs.Queue(this, 'contentDLQ', {
                 queueName: 'contentSQSQueue_DLQ',
                 retentionPeriod: cdk.Duration.days(14), // Retain messages in DLQ for 14 days
@@ -29,7 +29,7 @@ export class ScraperStack extends cdk.Stack {
 
     // Create Scraper queue
     this.scraperSQSQueue = new sqs.Queue(this, 'ScraperSqsQueue', {
-        visibilityTimeout: cdk.Duration.seconds(60*30),     // 15 minutes
+        visibilityTimeout: cdk.Duration.seconds(60*90), // 6x the 15 minute function timeout, as AWS recommends for Lambda event sources
         deadLetterQueue: {
             maxReceiveCount: 5,
             queue: new sqs.Queue(this, 'scraper_DLQ', {
@@ -206,7 +206,9 @@ export class ScraperStack extends cdk.Stack {
     // Grant Lambda permissions to be triggered by the queue
     lambdaFunction.addEventSource(
         new lambdaEventSources.SqsEventSource(this.scraperSQSQueue, {
-        batchSize: 1, // Process 1 message at a time
+        batchSize: 5, // Up to 5 messages per invocation
+        maxBatchingWindow: cdk.Duration.seconds(5),
+        reportBatchItemFailures: true, // Only failed messages are retried
         })
     );
 
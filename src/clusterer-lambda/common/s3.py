@@ -1,10 +1,458 @@
 import boto3
-import pickle
+import io
+import json
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+
+from common import serialization
 
 bucket_name = os.getenv("ASTRA_BUCKET_NAME")
 print(f"Astra Bucket name is {bucket_name}")
 
+# "s3" (default) or "local" to run the pipeline and its benchmarks offline against a directory
+STORAGE_BACKEND = os.getenv("ASTRA_STORAGE", "s3")
+LOCAL_STORAGE_DIR = os.getenv("ASTRA_LOCAL_STORAGE_DIR", "/tmp/astra-bucket")
+
+# Multipart settings for file transfers (podcast MP3s)
+MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+MULTIPART_CHUNKSIZE_MB = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8"))
+MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "10"))
+
+
+class NotFound(Exception):
+    """Raised by a storage backend when a key does not exist"""
+
+
+class _timed:
+    """
+    Logs the latency of a storage operation
+    """
+    def __init__(self, backend, op, key):
+        self.label = f"{backend} {op} {key}"
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        status = "" if exc_type is None else f" ({exc_type.__name__})"
+        print(f"{self.label} took {elapsed_ms:.1f} ms{status}")
+        return False
+
+
+def _write_atomic(f_path, stream):
+    """
+    Write a stream to f_path through a temporary file so readers never see a partial file
+    """
+    os.makedirs(os.path.dirname(f_path) or ".", exist_ok=True)
+    part_path = f"{f_path}.part"
+    with open(part_path, 'wb') as f:
+        shutil.copyfileobj(stream, f)
+    os.replace(part_path, f_path)
+
+
+class _MultipartWriter:
+    """
+    Writable stream into an S3 multipart upload. Every full part is uploaded on a background
+    thread as soon as it is written, so the upload overlaps with whatever produces the data.
+    Objects smaller than one part are sent with a single put on close.
+    """
+    def __init__(self, storage, key, content_type=None):
+        self.storage = storage
+        self.key = key
+        self.content_type = content_type
+        # S3 requires every part but the last to be at least 5 MB
+        self.part_size = max(5, MULTIPART_CHUNKSIZE_MB) * 1024 * 1024
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+        self._reset()
+
+    def _reset(self):
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.started = time.perf_counter()
+
+    def _upload_part(self, part_number, data):
+        response = self.storage.client.upload_part(
+            Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _submit(self, data):
+        if self.upload_id is None:
+            extra = {'ContentType': self.content_type} if self.content_type else {}
+            response = self.storage.client.create_multipart_upload(Bucket=self.storage.bucket, Key=self.key, **extra)
+            self.upload_id = response['UploadId']
+        self.parts.append(self.executor.submit(self._upload_part, len(self.parts) + 1, data))
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._submit(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def close(self):
+        try:
+            if self.upload_id is None:
+                self.storage.put_bytes(self.key, bytes(self.buffer), content_type=self.content_type)
+                return
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+            parts = [part.result() for part in self.parts]
+            self.storage.client.complete_multipart_upload(
+                Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': parts}
+            )
+            elapsed_ms = (time.perf_counter() - self.started) * 1000
+            print(f"{self.storage.name} multipart {self.key} took {elapsed_ms:.1f} ms ({len(parts)} parts)")
+        except Exception:
+            self._abort()
+            raise
+        finally:
+            self.executor.shutdown()
+
+    def discard(self):
+        """
+        Throw away everything written so far and start over
+        """
+        self._abort()
+        self._reset()
+
+    def _abort(self):
+        for part in self.parts:
+            part.cancel()
+        if self.upload_id is not None:
+            try:
+                self.storage.client.abort_multipart_upload(Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id)
+            except ClientError as e:
+                print(f"Error aborting multipart upload of {self.key}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+            self.executor.shutdown(cancel_futures=True)
+        return False
+
+
+class _LocalWriter:
+    """
+    Writable stream into a local file with the same interface as _MultipartWriter
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(f"{path}.part", 'wb')
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(f"{self.path}.part", self.path)
+
+    def discard(self):
+        self.file.seek(0)
+        self.file.truncate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(f"{self.path}.part")
+        return False
+
+
+class S3Storage:
+    """
+    Storage backed by the Astra S3 bucket, sharing one client per container
+    """
+    name = "s3"
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._client = None
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=MULTIPART_CHUNKSIZE_MB * 1024 * 1024,
+            max_concurrency=MAX_CONCURRENCY,
+            use_threads=True
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = boto3.client('s3', config=Config(max_pool_connections=max(10, MAX_CONCURRENCY)))
+        return self._client
+
+    def _raise_not_found(self, e, key):
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound'):
+            raise NotFound(key) from e
+        raise e
+
+    def put_bytes(self, key, data, content_type=None):
+        extra = {'ContentType': content_type} if content_type else {}
+        with _timed(self.name, "put", key):
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+
+    def create_bytes(self, key, data, content_type=None):
+        """
+        Put the object only if the key doesn't exist yet (If-None-Match: *)
+        :return: True if it was created, False if the key already existed
+        """
+        extra = {'ContentType': content_type} if content_type else {}
+        try:
+            with _timed(self.name, "create", key):
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=data, IfNoneMatch='*', **extra)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict', '412'):
+                return False
+            raise e
+
+    def replace_bytes(self, key, data, etag, content_type=None):
+        """
+        Put the object only if it is still the version with this ETag (If-Match)
+        :return: True if it was replaced, False if the object changed or is gone
+        """
+        extra = {'ContentType': content_type} if content_type else {}
+        try:
+            with _timed(self.name, "replace", key):
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=data, IfMatch=etag, **extra)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict', '412', 'NoSuchKey', '404'):
+                return False
+            raise e
+
+    def list_keys(self, prefix):
+        with _timed(self.name, "list", prefix):
+            paginator = self.client.get_paginator('list_objects_v2')
+            return [
+                item['Key']
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+                for item in page.get('Contents', [])
+            ]
+
+    def get_stream(self, key):
+        """
+        Returns a readable, unbuffered stream of the object body
+        """
+        try:
+            with _timed(self.name, "get", key):
+                response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            self._raise_not_found(e, key)
+        return response['Body']
+
+    def get_bytes(self, key):
+        body = self.get_stream(key)
+        with _timed(self.name, "read", key):
+            return body.read()
+
+    def get_object(self, key):
+        """
+        :return: (object bytes, last modified datetime)
+        """
+        try:
+            with _timed(self.name, "get", key):
+                response = self.client.get_object(Bucket=self.bucket, Key=key)
+                return response['Body'].read(), response['LastModified']
+        except ClientError as e:
+            self._raise_not_found(e, key)
+
+    def get_versioned(self, key):
+        """
+        :return: (object bytes, ETag) for a later replace_bytes
+        """
+        try:
+            with _timed(self.name, "get", key):
+                response = self.client.get_object(Bucket=self.bucket, Key=key)
+                return response['Body'].read(), response['ETag']
+        except ClientError as e:
+            self._raise_not_found(e, key)
+
+    def touch(self, key, content_type=None):
+        """
+        Reset the object's last modified time (copy onto itself), lifecycle expiration counts from it
+        """
+        extra = {'ContentType': content_type} if content_type else {}
+        with _timed(self.name, "touch", key):
+            self.client.copy_object(
+                Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+                MetadataDirective='REPLACE', **extra
+            )
+
+    def open_writer(self, key, content_type=None):
+        return _MultipartWriter(self, key, content_type)
+
+    def upload_file(self, f_path, key):
+        with _timed(self.name, "upload", key):
+            self.client.upload_file(f_path, self.bucket, key, Config=self.transfer_config)
+
+    def download_file(self, key, f_path):
+        try:
+            with _timed(self.name, "download", key):
+                self.client.download_file(self.bucket, key, f_path, Config=self.transfer_config)
+        except ClientError as e:
+            self._raise_not_found(e, key)
+
+    def download_if_changed(self, key, f_path, etag=None):
+        """
+        Download the object to f_path unless its ETag still matches etag (If-None-Match)
+        :return: The object's current ETag
+        """
+        extra = {'IfNoneMatch': etag} if etag else {}
+        try:
+            with _timed(self.name, "conditional get", key):
+                response = self.client.get_object(Bucket=self.bucket, Key=key, **extra)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return etag
+            self._raise_not_found(e, key)
+
+        with _timed(self.name, "download", key):
+            _write_atomic(f_path, response['Body'])
+        return response['ETag']
+
+
+def _local_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+class LocalStorage:
+    """
+    Storage backed by a local directory, with the same interface as S3Storage
+    """
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+        # Conditional replaces are only atomic between threads of one process, enough for offline runs
+        self._replace_lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _open(self, key):
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError as e:
+            raise NotFound(key) from e
+
+    def put_bytes(self, key, data, content_type=None):
+        path = self._path(key)
+        with _timed(self.name, "put", key):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def create_bytes(self, key, data, content_type=None):
+        path = self._path(key)
+        with _timed(self.name, "create", key):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                with open(path, 'xb') as f:
+                    f.write(data)
+                return True
+            except FileExistsError:
+                return False
+
+    def replace_bytes(self, key, data, etag, content_type=None):
+        path = self._path(key)
+        with _timed(self.name, "replace", key), self._replace_lock:
+            try:
+                current = _local_etag(os.stat(path))
+            except FileNotFoundError:
+                return False
+            if current != etag:
+                return False
+            _write_atomic(path, io.BytesIO(data))
+            return True
+
+    def list_keys(self, prefix):
+        with _timed(self.name, "list", prefix):
+            keys = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                    if key.startswith(prefix):
+                        keys.append(key)
+            return sorted(keys)
+
+    def get_stream(self, key):
+        with _timed(self.name, "get", key):
+            return self._open(key)
+
+    def get_bytes(self, key):
+        with _timed(self.name, "read", key):
+            with self._open(key) as f:
+                return f.read()
+
+    def get_object(self, key):
+        with _timed(self.name, "get", key):
+            with self._open(key) as f:
+                modified = datetime.fromtimestamp(os.fstat(f.fileno()).st_mtime, timezone.utc)
+                return f.read(), modified
+
+    def get_versioned(self, key):
+        with _timed(self.name, "get", key):
+            with self._open(key) as f:
+                return f.read(), _local_etag(os.fstat(f.fileno()))
+
+    def touch(self, key, content_type=None):
+        with _timed(self.name, "touch", key):
+            if not os.path.exists(self._path(key)):
+                raise NotFound(key)
+            os.utime(self._path(key))
+
+    def open_writer(self, key, content_type=None):
+        return _LocalWriter(self._path(key))
+
+    def upload_file(self, f_path, key):
+        path = self._path(key)
+        with _timed(self.name, "upload", key):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(f_path, path)
+
+    def download_file(self, key, f_path):
+        with _timed(self.name, "download", key):
+            if not os.path.exists(self._path(key)):
+                raise NotFound(key)
+            shutil.copyfile(self._path(key), f_path)
+
+    def download_if_changed(self, key, f_path, etag=None):
+        with self._open(key) as f:
+            current = _local_etag(os.fstat(f.fileno()))
+            if current != etag:
+                with _timed(self.name, "download", key):
+                    _write_atomic(f_path, f)
+        return current
+
+
+if STORAGE_BACKEND == "local":
+    print(f"Using local storage at {LOCAL_STORAGE_DIR}")
+    storage = LocalStorage(LOCAL_STORAGE_DIR)
+else:
+    storage = S3Storage(bucket_name)
+
+
 # Centralized area to define where various stuff is in S3 bucket
 def s3LocationMapping(user_id, episode_number, type):
     if (type == "USER_TOPICS"):
@@ -22,21 +470,18 @@ def get_s3_url(user_id, episode_number, type):
     object_key = s3LocationMapping(user_id, episode_number, type)
     return f'https://{bucket_name}.s3.us-east-1.amazonaws.com/{object_key}'
 
-def save_metadata(object, key):
+ENVELOPE_CONTENT_TYPE = 'application/x-msgpack'
+
+def save_metadata(object, key, schema="cluster_documents"):
     """
     Save metadata to S3.
     :param object: The metadata object to save.
     :param key: The S3 key where the metadata will be stored.
+    :param schema: Schema the object is checked against, see common.serialization.
     """
-
-    s3 = boto3.client('s3')
-    
     try:
-        s3.put_object(
-            Bucket=bucket_name,
-            Key=f"metadata/{key}",
-            Body=pickle.dumps(object)
-        )
+        data = serialization.dumps(object, schema, compress=True)
+        storage.put_bytes(f"metadata/{key}", data, content_type=ENVELOPE_CONTENT_TYPE)
         print(f"Metadata saved to {key}.")
     except Exception as e:
         print(f"Error saving metadata to bucket: {e}")
@@ -44,88 +489,169 @@ def save_metadata(object, key):
 def save_serialized(user_id, episode_number, type, data):
     object_key = s3LocationMapping(user_id, episode_number, type)
     # Serialize the data
-    serialized_data = pickle.dumps(data)
+    serialized_data = serialization.dumps(data, type)
 
     # Upload to S3
     try:
-        s3 = boto3.client('s3')
-        s3.put_object(Bucket=bucket_name, Key=object_key, Body=serialized_data)
+        storage.put_bytes(object_key, serialized_data, content_type=ENVELOPE_CONTENT_TYPE)
         print('Saved serialized data')
     except Exception as e:
         print(f"Error saving to bucket {e}")
 
 def restore_serialized(user_id, episode_number, type):
     object_key = s3LocationMapping(user_id, episode_number, type)
-    # Download serialized data from S3
-    s3 = boto3.client('s3')
 
+    # Deserialize straight from the response buffer
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        serialized_data = response['Body'].read()
+        data = serialization.loads(storage.get_bytes(object_key), type)
         print('Retrieved serialized data')
+        return data
     except Exception as e:
         print(f"Error reading from bucket {e}")
         return {}
 
-    # Deserialize the data
-    data = pickle.loads(serialized_data)
-    return data
-
 def save(user_id, episode_number, type, f_path):
     object_key = s3LocationMapping(user_id, episode_number, type)
     # Upload to S3
     try:
-        s3 = boto3.client('s3')
-
-        with open(f_path, 'rb') as f:
-            s3.upload_fileobj(f, bucket_name, object_key)
+        storage.upload_file(f_path, object_key)
         print('Saved data')
     except Exception as e:
         print(f"Error saving to bucket {e}")
 
+def open_writer(user_id, episode_number, type, content_type=None):
+    """
+    Open a writable stream straight into the object, used as a context manager.
+    The object only appears once the stream is closed without an error.
+    """
+    object_key = s3LocationMapping(user_id, episode_number, type)
+    return storage.open_writer(object_key, content_type=content_type)
+
 def restore(user_id, episode_number, type, f_path):
     object_key = s3LocationMapping(user_id, episode_number, type)
     # Download data from S3
-    s3 = boto3.client('s3')
-
     try:
-        with open(f_path, 'wb') as f:
-            s3.download_fileobj(bucket_name, object_key, f)
+        storage.download_file(object_key, f_path)
         print('Retrieved data')
     except Exception as e:
         print(f"Error reading from bucket {e}")
         return {}
-    
+
+
+# Shared assets under system/ in the bucket
+SYSTEM_ASSETS = {
+    "INTRO": "system/intro_music.mp3",
+}
+
+# System assets are kept in /tmp across warm invocations and revalidated against S3 with
+# If-None-Match at most once per TTL, so an unchanged asset is never downloaded twice
+SYSTEM_ASSET_DIR = os.getenv("ASTRA_SYSTEM_ASSET_DIR", "/tmp/system")
+SYSTEM_ASSET_TTL_SECONDS = int(os.getenv("SYSTEM_ASSET_TTL_SECONDS", "300"))
+
+# object key -> (etag, time of the last check)
+_system_assets = {}
+
+def get_system_asset(type):
+    """
+    Read-through /tmp cache for system assets.
+    :param type: Asset type, see SYSTEM_ASSETS.
+    :return: (local path, ETag) of the cached copy.
+    """
+    object_key = SYSTEM_ASSETS[type]
+    f_path = os.path.join(SYSTEM_ASSET_DIR, os.path.basename(object_key))
+    etag, checked_at = _system_assets.get(object_key, (None, 0))
+
+    if etag is not None and not os.path.exists(f_path):
+        etag = None
+    if etag is not None and time.monotonic() - checked_at < SYSTEM_ASSET_TTL_SECONDS:
+        return f_path, etag
+
+    try:
+        current = storage.download_if_changed(object_key, f_path, etag)
+    except NotFound:
+        raise
+    except Exception as e:
+        if etag is None:
+            raise
+        # Serve the cached copy, S3 is retried on the next call
+        print(f"Error revalidating {object_key}, using cached copy: {e}")
+        return f_path, etag
+
+    print(f"System asset {object_key} {'unchanged' if current == etag else 'downloaded'}")
+    _system_assets[object_key] = (current, time.monotonic())
+    return f_path, current
 
 def restore_from_system(type, f_path):
-    object_key = "system/intro_music.mp3"
-    # Download data from S3
-    s3 = boto3.client('s3')
+    object_key = SYSTEM_ASSETS.get(type)
 
-    # Check if the object exists before attempting to download
+    # Copy from the system asset cache
     try:
-        with open(f_path, 'wb') as f:
-            s3.download_fileobj(bucket_name, object_key, f)
+        cached_path, _ = get_system_asset(type)
+        shutil.copyfile(cached_path, f_path)
         print('Retrieved data')
-    except s3.exceptions.NoSuchKey:
+    except NotFound:
         print(f"Error: Object with key '{object_key}' does not exist in the bucket.")
         return {}
     except Exception as e:
         print(f"Error reading from bucket: {e}")
         return {}
 
-def get_metadata(key):
+def get_metadata(key, schema="cluster_documents"):
     """
     Retrieve metadata from S3.
     :param key: The S3 key where the metadata is stored.
+    :param schema: Schema the object must have been saved as.
     :return: The deserialized metadata object.
     """
-    s3 = boto3.client('s3')
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=f"metadata/{key}")
-        metadata = pickle.loads(response['Body'].read())
+        metadata = serialization.loads(storage.get_bytes(f"metadata/{key}"), schema)
         print(f"Metadata retrieved from {key}")
         return metadata
     except Exception as e:
         print(f"Error retrieving metadata from bucket: {e}")
         return None
+
+
+def save_json(key, data):
+    """
+    Save a JSON document to S3.
+    :param key: The full S3 key of the document.
+    :param data: A JSON serializable object.
+    """
+    storage.put_bytes(key, json.dumps(data).encode('utf-8'), content_type='application/json')
+
+
+def get_json(key):
+    """
+    Retrieve a JSON document from S3.
+    :param key: The full S3 key of the document.
+    :return: The parsed document, or None if it does not exist.
+    """
+    try:
+        return json.loads(storage.get_bytes(key))
+    except NotFound:
+        return None
+
+
+def get_json_versioned(key):
+    """
+    Retrieve a JSON document from S3 along with its ETag, for replace_json.
+    :param key: The full S3 key of the document.
+    :return: (parsed document, ETag), or (None, None) if it does not exist.
+    """
+    try:
+        data, etag = storage.get_versioned(key)
+    except NotFound:
+        return None, None
+    return json.loads(data), etag
+
+
+def replace_json(key, data, etag):
+    """
+    Save a JSON document to S3 only if it hasn't changed since it was read.
+    :param key: The full S3 key of the document.
+    :param data: A JSON serializable object.
+    :param etag: ETag returned by get_json_versioned.
+    :return: True if it was saved, False if someone else changed or removed it first.
+    """
+    return storage.replace_bytes(key, json.dumps(data).encode('utf-8'), etag, content_type='application/json')
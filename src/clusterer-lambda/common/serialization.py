@@ -0,0 +1,168 @@
+import pickle
+import msgpack
+import zstandard
+
+# Versioned binary envelope for objects stored in S3, replacing pickle.
+#
+#   b"AXM" | format version (1 byte) | codec (1 byte) | msgpack body
+#
+# The body is a map {"schema": <name>, "data": <payload>}. The schema name is checked on read
+# so an object is never decoded as something it isn't, and registered schemas also have their
+# structure validated on both write and read. Objects written before the envelope existed
+# (plain pickles) are still readable.
+
+MAGIC = b"AXM"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+
+CODEC_NONE = 0
+CODEC_ZSTD = 1
+
+ZSTD_LEVEL = 3
+
+
+class SchemaError(ValueError):
+    """Raised when an object does not match the schema it is written or read as"""
+
+
+def _check_cluster_documents(data):
+    """
+    Documents of one cluster as written by the clusterer: a list of records with
+    'source', 'type', 'title', 'text', 'url', 'keyword' (news also have 'similarity')
+    """
+    if not isinstance(data, list):
+        raise SchemaError(f"cluster_documents must be a list, got {type(data).__name__}")
+    for i, doc in enumerate(data):
+        if not isinstance(doc, dict):
+            raise SchemaError(f"cluster_documents[{i}] must be a map, got {type(doc).__name__}")
+        missing = {'source', 'type', 'title', 'text', 'url', 'keyword'} - doc.keys()
+        if missing:
+            raise SchemaError(f"cluster_documents[{i}] is missing {sorted(missing)}")
+        if not isinstance(doc['title'], str) or not isinstance(doc['text'], str):
+            raise SchemaError(f"cluster_documents[{i}] title and text must be strings")
+
+
+# Structural checks per schema name, schemas without an entry only have their name checked
+SCHEMAS = {
+    "cluster_documents": _check_cluster_documents,
+}
+
+
+def _default(obj):
+    # numpy scalars and arrays that slip through from pandas
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Cannot serialize object of type {type(obj).__name__}")
+
+
+def dumps(data, schema, compress=False):
+    """
+    Serialize data into a versioned envelope.
+    :param data: msgpack serializable object (dicts, lists, str, numbers, bytes, None).
+    :param schema: Name the object is stored under, checked again on read.
+    :param compress: Compress the body with zstd.
+    :return: The envelope bytes.
+    """
+    if schema in SCHEMAS:
+        SCHEMAS[schema](data)
+
+    body = msgpack.packb({"schema": schema, "data": data}, default=_default, use_bin_type=True)
+    codec = CODEC_NONE
+    if compress:
+        body = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+        codec = CODEC_ZSTD
+
+    return MAGIC + bytes([FORMAT_VERSION, codec]) + body
+
+
+def is_envelope(buffer):
+    return bytes(buffer[:len(MAGIC)]) == MAGIC
+
+
+def loads(buffer, schema=None):
+    """
+    Deserialize an envelope straight from the buffer it was read into.
+    :param buffer: bytes-like object holding the envelope, or a legacy pickle.
+    :param schema: Expected schema name, None to accept any.
+    :return: The deserialized object.
+    """
+    if not is_envelope(buffer):
+        print("Reading legacy pickle object")
+        return pickle.loads(buffer)
+
+    view = memoryview(buffer)
+    version, codec = view[len(MAGIC)], view[len(MAGIC) + 1]
+    if version != FORMAT_VERSION:
+        raise SchemaError(f"Unsupported envelope version {version}")
+
+    body = view[HEADER_SIZE:]
+    if codec == CODEC_ZSTD:
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif codec != CODEC_NONE:
+        raise SchemaError(f"Unsupported envelope codec {codec}")
+
+    envelope = msgpack.unpackb(body, raw=False)
+    if schema is not None and envelope["schema"] != schema:
+        raise SchemaError(f"Expected schema '{schema}', object was written as '{envelope['schema']}'")
+    if envelope["schema"] in SCHEMAS:
+        SCHEMAS[envelope["schema"]](envelope["data"])
+
+    return envelope["data"]
+
+
+if __name__ == "__main__":
+    # Bytes stored and decode time of pickle+JSON against the envelope on cluster payloads.
+    # python -m common.serialization [tmp/example_cluster.pkl ...]   (written by the clusterer's embed.py)
+    import io
+    import random
+    import sys
+    import time
+    import pandas as pd
+
+    def _timeit(fn, repeat=50):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def _synthetic_cluster():
+        rng = random.Random(0)
+        words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10))) for _ in range(5000)]
+        text = " ".join(rng.choice(words) for _ in range(7000))
+        docs = [{'source': 'gov', 'type': 'primary', 'title': 'Primary document', 'text': text,
+                 'url': 'https://www.govinfo.gov/doc', 'keyword': 'Energy'}]
+        docs += [{'source': 'news', 'type': 'news', 'title': f'News {i}', 'text': text[:6000],
+                  'url': f'https://news.example.com/{i}', 'keyword': 'Energy', 'similarity': 0.5}
+                 for i in range(3)]
+        return docs
+
+    paths = sys.argv[1:]
+    payloads = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            payloads.append((path, pickle.load(f)))
+    if not payloads:
+        print("No cluster payloads given, using a synthetic cluster")
+        payloads.append(("synthetic", _synthetic_cluster()))
+
+    for name, documents in payloads:
+        if isinstance(documents, str):
+            # Example clusters written before embed.py saved document records
+            documents = pd.read_json(io.StringIO(documents)).to_dict('records')
+
+        # What the clusterer used to store, a pickled DataFrame JSON string
+        legacy = pickle.dumps(pd.DataFrame(documents).to_json())
+        formats = [
+            ("pickle+json", legacy, lambda: pd.read_json(io.StringIO(pickle.loads(legacy)))),
+            ("msgpack", dumps(documents, "cluster_documents"), None),
+            ("msgpack+zstd", dumps(documents, "cluster_documents", compress=True), None),
+        ]
+
+        print(f"{name}: {len(documents)} documents")
+        for label, blob, decode in formats:
+            if decode is None:
+                decode = lambda blob=blob: pd.DataFrame.from_records(loads(blob, "cluster_documents"))
+            decode_ms = _timeit(decode)
+            print(f"  {label:<14} {len(blob):>10,} bytes {decode_ms:>8.2f} ms to DataFrame")
+
+        assert [doc['title'] for doc in loads(formats[2][1], "cluster_documents")] == [doc['title'] for doc in documents]
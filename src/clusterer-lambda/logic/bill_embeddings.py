@@ -3,73 +3,142 @@ Congress bill embedding generation module
 """
 
 import psycopg2
+import psycopg2.extras
 import os
+import time
 from sentence_transformers import SentenceTransformer
 
+import common.sqs
+
 db_access_url = os.environ.get('DB_ACCESS_URL')
 
-def generate_congress_bill_embeddings():
+# Bills are fetched, encoded and committed in chunks so a timeout only loses the current chunk
+CHUNK_SIZE = 512
+ENCODE_BATCH_SIZE = 64
+
+# Stop picking up new chunks once this much of the 15 minute Lambda budget is used,
+# then hand the remaining work to a fresh invocation
+TIME_BUDGET_SECONDS = 12 * 60
+
+
+def _fetch_pending_chunk(cursor, after_id, limit):
+    """
+    Fetch the next chunk of bills without an embedding.
+    A NULL embedding marks the bill as pending; the partial index on id
+    WHERE embedding IS NULL keeps this an index range scan.
+    """
+    cursor.execute("""
+        SELECT id, bill_id, title, latest_action_text
+        FROM congress_bills
+        WHERE embedding IS NULL AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (after_id, limit))
+    return cursor.fetchall()
+
+
+def _store_chunk(cursor, rows):
     """
-    Generate embeddings for congress bills that have placeholder embeddings.
+    Write a chunk of (id, embedding_str) pairs in a single UPDATE.
     """
+    psycopg2.extras.execute_values(cursor, """
+        UPDATE congress_bills AS c
+        SET embedding = v.embedding::vector
+        FROM (VALUES %s) AS v(id, embedding)
+        WHERE c.id = v.id
+    """, rows, page_size=len(rows))
+
+
+def generate_congress_bill_embeddings(after_id=0):
+    """
+    Generate embeddings for congress bills that are pending (NULL embedding).
+
+    Args:
+        after_id: Resume cursor, only bills with an id greater than this are processed
+
+    Returns:
+        The id of the last bill processed if the time budget ran out, otherwise None
+    """
+    started = time.monotonic()
+    conn = None
+    cursor = None
+    model = None
+    updated_count = 0
+
     try:
         conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
         cursor = conn.cursor()
-        
-        # Find bills with placeholder embeddings (all zeros)
-        cursor.execute("""
-            SELECT id, bill_id, title, latest_action_text
-            FROM congress_bills
-            WHERE embedding = %s
-        """, (f"[{','.join(['0'] * 384)}]",))
-        
-        bills_to_update = cursor.fetchall()
-        
-        if not bills_to_update:
-            print("No congress bills need embedding generation")
-            return
-        
-        print(f"Generating embeddings for {len(bills_to_update)} congress bills")
-        
-        # Initialize the embedding model
-        model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        updated_count = 0
-        for bill_id, bill_identifier, title, latest_action_text in bills_to_update:
+
+        while True:
+            if time.monotonic() - started > TIME_BUDGET_SECONDS:
+                print(f"Time budget reached after {updated_count} bills, stopping at id {after_id}")
+                return after_id
+
+            bills = _fetch_pending_chunk(cursor, after_id, CHUNK_SIZE)
+            if not bills:
+                break
+
+            if model is None:
+                # Initialize the embedding model only once there is work to do
+                model = SentenceTransformer('all-MiniLM-L6-v2')
+
+            # Keep in sync with congress_scraper.bill_content_hash, which decides when a bill is re-embedded
+            texts = [f"{title} {latest_action_text or ''}" for _, _, title, latest_action_text in bills]
+            embeddings = model.encode(texts, batch_size=ENCODE_BATCH_SIZE)
+
+            rows = [
+                (bill[0], f"[{','.join(map(str, embedding.tolist()))}]")
+                for bill, embedding in zip(bills, embeddings)
+            ]
+
             try:
-                # Generate embedding for the bill
-                bill_text = f"{title} {latest_action_text or ''}"
-                embedding = model.encode(bill_text).tolist()
-                embedding_str = f"[{','.join(map(str, embedding))}]"
-                
-                # Update the bill with real embedding
-                cursor.execute("""
-                    UPDATE congress_bills
-                    SET embedding = %s
-                    WHERE id = %s
-                """, (embedding_str, bill_id))
-                
-                updated_count += 1
-                
-            except Exception as e:
-                print(f"Error generating embedding for bill {bill_identifier}: {e}")
-                continue
-        
-        conn.commit()
-        print(f"Successfully generated embeddings for {updated_count} congress bills")
-        
+                _store_chunk(cursor, rows)
+                conn.commit()
+            except psycopg2.Error as e:
+                print(f"Error saving embeddings for bills {bills[0][1]}..{bills[-1][1]}: {e}")
+                conn.rollback()
+                raise
+
+            updated_count += len(rows)
+            after_id = bills[-1][0]
+            print(f"Committed embeddings for {updated_count} congress bills (cursor at id {after_id})")
+
+        if updated_count == 0:
+            print("No congress bills need embedding generation")
+        else:
+            print(f"Successfully generated embeddings for {updated_count} congress bills")
+        return None
+
     except Exception as e:
-        print(f"Error generating congress bill embeddings: {e}")
-        if conn:
+        # Raised so SQS redelivers the message. Committed chunks already have their embeddings,
+        # so the retry picks up at the first bill still pending.
+        print(f"Error generating congress bill embeddings after id {after_id}: {e}")
+        if conn and not conn.closed:
             conn.rollback()
+        raise
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
 
+
 def handler(payload):
     """AWS Lambda handler for congress bill embedding generation"""
-    print("Starting congress bill embedding generation")
-    generate_congress_bill_embeddings()
+    after_id = payload.get("after_id", 0)
+    print(f"Starting congress bill embedding generation after id {after_id}")
+
+    last_id = generate_congress_bill_embeddings(after_id)
+
+    if last_id is not None:
+        # Out of time - continue from the cursor in a new invocation
+        next_event = {
+            "action": "e_embed_bills",
+            "payload": {
+                "after_id": last_id
+            }
+        }
+        common.sqs.send_to_clusterer_queue(next_event)
+        print(f"Sent message to SQS to resume bill embeddings after id {last_id}")
+
     return {"statusCode": 200, "body": "Congress bill embeddings generated successfully"}
@@ -16,7 +16,6 @@ import json
 import spacy
 import hashlib
 from datetime import datetime
-from io import StringIO
 import common.s3 as s3
 
 db_access_url = os.environ.get('DB_ACCESS_URL')
@@ -369,9 +368,6 @@ class Clusterer:
                     all_news_similarities.append(doc['similarity'])
         
         for cluster in organized_clusters:
-            # Create a dataframe from the documents
-            df = pd.DataFrame(cluster['documents'])
-            
             # Extract news articles for similarity analysis
             news_docs = [doc for doc in cluster['documents'] if doc.get('source') == 'news']
             
@@ -445,7 +441,11 @@ class Clusterer:
             metadata = {
                 'center_embedding': cluster['center_embedding'],
                 'score': round(float(final_score), 4),
-                'articles': df.to_json(),
+                # Records for the content stack, stored as-is in the metadata envelope
+                'documents': [
+                    {**doc, 'text': doc['text'] if isinstance(doc['text'], str) else ''}
+                    for doc in cluster['documents']
+                ],
                 'key': key
             }
             
@@ -462,7 +462,7 @@ class Clusterer:
         separating government documents from news articles.
         
         Parameters:
-        - output: List of cluster metadata dictionaries containing score and articles JSON
+        - output: List of cluster metadata dictionaries containing score and documents
         - output_path: Path for the output text file
         """
         report_lines = []
@@ -474,16 +474,8 @@ class Clusterer:
         total_news_articles = 0
         
         for i, cluster_metadata in enumerate(output):
-            # Extract score and parse articles JSON
             score = cluster_metadata.get('score', 0)
-            articles_json = cluster_metadata.get('articles', '[]')
-            
-            try:
-                articles_df = pd.read_json(StringIO(articles_json))
-                articles = articles_df.to_dict('records') if not articles_df.empty else []
-            except Exception as e:
-                print(f"Error parsing articles JSON for cluster {i+1}: {e}")
-                articles = []
+            articles = cluster_metadata.get('documents', [])
             
             # Count government and news documents
             gov_count = len([doc for doc in articles if doc.get('source') == 'gov'])
@@ -632,14 +624,11 @@ class Clusterer:
 
 
 def load_df(type):
-    # Initialize S3 client
-    s3 = boto3.client('s3')
-    astra_bucket_name = os.getenv("ASTRA_BUCKET_NAME")
     try:
-        # Load pickled DataFrame from S3
+        # Load pickled DataFrame from S3, straight from the response stream
         key = f"{type}/articles.pkl"
-        response = s3.get_object(Bucket=astra_bucket_name, Key=key)
-        df = pickle.loads(response['Body'].read())
+        with s3.storage.get_stream(key) as body:
+            df = pickle.load(body)
         print(f"Loaded DataFrame with {len(df)} articles")
 
         return df
@@ -674,7 +663,7 @@ def handler(payload):
             for i, metadata in enumerate(clusters):
 
                 # Save the email description to S3
-                s3.save_metadata(metadata['articles'], metadata['key'])
+                s3.save_metadata(metadata['documents'], metadata['key'])
 
                 vector_str = f"[{','.join(map(str, metadata['center_embedding']))}]"
 
@@ -736,7 +725,7 @@ if __name__ == "__main__":
     
     if clusters and len(clusters) > 0:
         with open('tmp/example_cluster.pkl', 'wb') as f:
-            pickle.dump(clusters[0]['articles'], f)
+            pickle.dump(clusters[0]['documents'], f)
         print(f"Example cluster saved to tmp/example_cluster.pkl")
 
     if clusters and len(clusters) > 0:
@@ -14,6 +14,18 @@ db_access_url = os.environ.get('DB_ACCESS_URL')
 model = SentenceTransformer('all-MiniLM-L6-v2')
 
 
+def _rollback(conn):
+    """
+    Roll back a failed statement, if the connection is still there to roll back
+    """
+    if conn is None or conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg2.Error as e:
+        print(f"Error rolling back: {e}")
+
+
 def search_documents(interest, conn, limit=5):
     query_embedding = model.encode(interest).tolist()
     cur =  conn.cursor() 
@@ -27,12 +39,19 @@ def search_documents(interest, conn, limit=5):
         return cur.fetchall()
     except psycopg2.Error as e:
         print(f"Error executing query: {e}")
+        if conn.closed:
+            # The connection dropped, the user has to be retried rather than get no recommendations
+            raise
+        # don't leave a shared connection in an aborted transaction
+        _rollback(conn)
         return []
 
-def main(interests):
+def main(interests, conn=None):
     clusters = {}
+    owns_conn = conn is None
     try:
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
+        if owns_conn:
+            conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
         for interest in interests:
             rows = search_documents(interest, conn)
             for row in rows:
@@ -44,7 +63,7 @@ def main(interests):
                 else:
                     clusters[id] = ([distance], score) 
     finally:
-        if conn:
+        if owns_conn and conn:
             conn.close()
 
     # sorting
@@ -60,7 +79,7 @@ def main(interests):
     return [id for _, id in recommendations[:5]]
 
 
-def handler(payload):
+def handler(payload, conn=None):
     user_id = payload.get("user_id")
     user_email = payload.get("user_email")
     plan = payload.get("plan")
@@ -69,7 +88,7 @@ def handler(payload):
     user_name = payload.get("user_name")
     print(f"Infer.py invoked with interests: {interests}")
 
-    recommendations = main(interests)
+    recommendations = main(interests, conn)
 
     if len(recommendations) < 5:
         print('Warning: Low number of recommendations')
@@ -132,6 +151,33 @@ def handler(payload):
             print(f"Exception when sending message to SQS {e}")
 
 
+def batch_handler(payloads):
+    """
+    Infer recommendations for a batch of users over a single DB connection.
+
+    Returns:
+        Indexes of the payloads that failed
+    """
+    failed = []
+    conn = None
+    try:
+        for i, payload in enumerate(payloads):
+            try:
+                # Reconnected when the server dropped the connection, so one user's failure
+                # doesn't fail the users after them
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
+                handler(payload, conn)
+            except Exception as e:
+                print(f"Error inferring recommendations for user {payload.get('user_id')}: {e}")
+                _rollback(conn)
+                failed.append(i)
+    finally:
+        if conn is not None and not conn.closed:
+            conn.close()
+    return failed
+
+
 if __name__ == "__main__":
     interests = ["tariffs", "immigration", "foreign aid"]
     print(f"Infer.py invoked with interests: {interests}")
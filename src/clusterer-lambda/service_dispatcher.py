@@ -1,55 +1,181 @@
-import logic.embed
-import logic.infer
-import logic.represent_user
-import logic.bill_embeddings
+import importlib
 import json
+import os
+import sys
 import traceback
 
+# Map actions to internal functions as "module:function". Handler modules are only imported
+# when their action first arrives, so an e_infer cold start doesn't pay for spaCy or sklearn.
+action_map = {
+    "e_embed": "logic.embed:handler", # convert raw data sources to stories
+    "e_infer": "logic.infer:handler", # infer recommendations
+    "e_represent_user": "logic.represent_user:handler", # represent user in embedding space
+    "e_embed_bills": "logic.bill_embeddings:handler" # generate congress bill embeddings
+}
+
+# Actions that opt into receiving every record of an SQS batch in one call so shared work
+# (model load, DB connection) happens once. They take a list of payloads and return the
+# indexes of the payloads that failed.
+batch_action_map = {
+    "e_infer": "logic.infer:batch_handler",
+}
+
+# Stop starting new work when less than this much time is left in the invocation,
+# the remaining records are deferred to a later invocation
+TIME_RESERVE_MS = 60 * 1000
+
+# Actions that run for minutes are only started with room for a whole run. Otherwise the
+# invocation times out and SQS redelivers the whole batch, including the messages already done.
+ACTION_TIME_RESERVE_MS = {
+    "e_embed": 10 * 60 * 1000, # clustering the day's documents
+    "e_embed_bills": 13 * 60 * 1000, # runs for up to bill_embeddings.TIME_BUDGET_SECONDS
+}
+
+
+# Handler functions resolved so far in this container
+_resolved = {}
+
+# Created on the first deferral, most invocations never need it
+_sqs = None
+
+
+def _resolve(target):
+    """
+    Import and cache the function behind a "module:function" target
+    """
+    if target not in _resolved:
+        module_name, function_name = target.split(":")
+        _resolved[target] = getattr(importlib.import_module(module_name), function_name)
+    return _resolved[target]
+
+
+def _out_of_time(context, action):
+    reserve = ACTION_TIME_RESERVE_MS.get(action, TIME_RESERVE_MS)
+    return context is not None and context.get_remaining_time_in_millis() < reserve
+
+
+def _queue_url(record):
+    # arn:aws:sqs:<region>:<account>:<queue name>
+    _, _, _, region, account, name = record["eventSourceARN"].split(":")
+    return f"https://sqs.{region}.amazonaws.com/{account}/{name}"
+
+
+def _defer(records, failed_ids):
+    """
+    Send records there is no time left for back to their queue as new messages. Reporting them
+    as failed would count a receive against the queue's maxReceiveCount, so a record deferred on
+    every delivery could land in the DLQ without ever running. Records that can't be sent
+    are reported as failed instead.
+    """
+    global _sqs
+    for record in records:
+        try:
+            if _sqs is None:
+                import boto3
+                _sqs = boto3.client('sqs')
+            _sqs.send_message(QueueUrl=_queue_url(record), MessageBody=record["body"])
+            print(f"Deferred message {record['messageId']} to a later invocation")
+        except Exception as e:
+            print(f"Could not defer message {record['messageId']}, returning it to the queue: {e}")
+            failed_ids.append(record["messageId"])
+
+
+def _route(action, payload):
+    """
+    Route a single message to the appropriate function
+    """
+    print(f"ServiceTier Lambda Invoked with action {action}")
+    if action in action_map:
+        return _resolve(action_map[action])(payload)
+    else:
+        print(f"Unsupported Action {action}")
+
+
+def _handle_sqs_batch(records, context):
+    """
+    Process a batch of SQS records
+    :param records: SQS records from the Lambda event
+    :param context: AWS Lambda context object
+    :return: Message IDs of the records that failed and should be retried
+    """
+    failed_ids = []
+    single_messages = []
+    batched_messages = {}
+
+    for record in records:
+        try:
+            message_body = json.loads(record["body"])
+            if not isinstance(message_body, dict):
+                raise ValueError(f"expected an object, got {type(message_body).__name__}")
+            action = message_body.get('action')
+            payload = message_body.get('payload', {})
+        except (TypeError, ValueError) as e:
+            print(f"Could not parse message {record['messageId']}: {e}")
+            failed_ids.append(record["messageId"])
+            continue
+
+        if action in batch_action_map:
+            batched_messages.setdefault(action, []).append((record, payload))
+        else:
+            single_messages.append((record, action, payload))
+
+    for action, messages in batched_messages.items():
+        message_ids = [record["messageId"] for record, _ in messages]
+        if _out_of_time(context, action):
+            _defer([record for record, _ in messages], failed_ids)
+            continue
+
+        print(f"ServiceTier Lambda Invoked with action {action} for {len(messages)} messages")
+        try:
+            failed_indexes = _resolve(batch_action_map[action])([payload for _, payload in messages])
+            failed_ids.extend(message_ids[i] for i in failed_indexes)
+        except Exception as e:
+            print(f"Batch action {action} failed: {e}")
+            traceback.print_exc()
+            failed_ids.extend(message_ids)
+
+    for record, action, payload in single_messages:
+        message_id = record["messageId"]
+        if _out_of_time(context, action):
+            _defer([record], failed_ids)
+            continue
+
+        try:
+            _route(action, payload)
+        except Exception as e:
+            print(f"Message {message_id} failed: {e}")
+            traceback.print_exc()
+            failed_ids.append(message_id)
+
+    return failed_ids
+
+
 def _handler(event, context):
     """
     Main Lambda handler
     :param event: Input event with 'action' and 'payload'
     :param context: AWS Lambda context object
+    :return: Message IDs of failed SQS records, None when invoked manually
     """
      # Check if the event is triggered by SQS
-    json_message = None
     if "Records" in event and event["Records"][0].get("eventSource") == "aws:sqs":
-        print(f"ServiceTier Lambda Invoked from SQS")
-        if len(event["Records"]) > 1:
-            print(f"Got {len(event['Records'])} messages, expected 1 - bailing")
-            return {
-                "statusCode": 400,
-                "body": f"Multiple messages unsupported"
-            }
-        record = event["Records"][0]
-        message_body = json.loads(record["body"])
-        json_message = message_body
-    else:
-        print(f"ServiceTier Lambda Invoked manually")
-        json_message = event
-
-    # Extract the action and payload
-    action = json_message.get('action')
-    payload = json_message.get('payload', {})
-    print(f"ServiceTier Lambda Invoked with action {action}")
+        print(f"ServiceTier Lambda Invoked from SQS with {len(event['Records'])} messages")
+        return _handle_sqs_batch(event["Records"], context)
 
-    # Map actions to internal functions
-    action_map = {
-        "e_embed": logic.embed.handler, # convert raw data sources to stories
-        "e_infer": logic.infer.handler, # infer recommendations
-        "e_represent_user": logic.represent_user.handler, # represent user in embedding space
-        "e_embed_bills": logic.bill_embeddings.handler # generate congress bill embeddings
-    }
+    print(f"ServiceTier Lambda Invoked manually")
+    _route(event.get('action'), event.get('payload', {}))
 
-    # Route to the appropriate function
-    if action in action_map:
-        result = action_map[action](payload)
-    else:
-        print(f"Unsupported Action {action}")
 
 def handler(event, context):
     try:
-        _handler(event, context)
+        failed_ids = _handler(event, context)
+        if failed_ids is not None:
+            if failed_ids:
+                print(f"{len(failed_ids)} messages failed and will be retried: {failed_ids}")
+            # Partial batch response, only the listed messages are returned to the queue
+            return {
+                "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_ids]
+            }
         return {
             "statusCode": 200,
             "body": "Success"
@@ -61,3 +187,113 @@ def handler(event, context):
             "statusCode": 500,
             "body": f"Error executing action '{event}': {str(e)}"
         }
+
+
+def _parse_importtime(stderr):
+    """
+    Parse `python -X importtime` output into (level, cumulative_us, module) tuples.
+    Lines look like "import time:   self [us] |  cumulative | <2 spaces per level>package"
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((level, int(cumulative_us), name.strip()))
+    return entries
+
+
+def _import_time_report(actions):
+    """
+    Report what each action costs to import, in the style of `python -X importtime`.
+    Every action is measured in a fresh interpreter so shared imports are counted per action,
+    and modules already loaded by interpreter startup are left out.
+    """
+    import subprocess
+
+    lambda_root = os.path.dirname(os.path.abspath(__file__))
+
+    def _importtime(statement):
+        return subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            cwd=lambda_root, capture_output=True, text=True
+        )
+
+    startup = {name for _, _, name in _parse_importtime(_importtime("pass").stderr)}
+
+    targets = [("(dispatcher)", "service_dispatcher")]
+    targets += [(action, action_map[action].split(":")[0]) for action in actions]
+
+    for action, module_name in targets:
+        result = _importtime(f"import {module_name}")
+        entries = [entry for entry in _parse_importtime(result.stderr) if entry[2] not in startup]
+
+        total_ms = sum(us for level, us, _ in entries if level == 0) / 1000
+        status = "" if result.returncode == 0 else f"  (import failed: {result.stderr.strip().splitlines()[-1]})"
+        print(f"{action:<20} {module_name:<28} {total_ms:>9.1f} ms{status}")
+
+        # Heaviest direct dependencies of the handler module
+        children = sorted((entry for entry in entries if entry[0] == 1), key=lambda entry: entry[1], reverse=True)
+        for _, cumulative_us, name in children[:5]:
+            print(f"{'':<20}   {name:<26} {cumulative_us / 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    if "--importtime" in sys.argv:
+        # python service_dispatcher.py --importtime [action ...]
+        actions = [arg for arg in sys.argv[1:] if arg != "--importtime"] or list(action_map)
+        _import_time_report(actions)
+        sys.exit(0)
+
+    # Local check of the batch loop with a synthetic SQS event
+    class _Context:
+        def get_remaining_time_in_millis(self):
+            return 15 * 60 * 1000
+
+    def _ok(payload):
+        pass
+
+    def _fail(payload):
+        raise RuntimeError("synthetic failure")
+
+    def _batch(payloads):
+        return [i for i, payload in enumerate(payloads) if payload.get("fail")]
+
+    action_map = {"e_ok": "__main__:_ok", "e_fail": "__main__:_fail"}
+    batch_action_map = {"e_batch": "__main__:_batch"}
+
+    bodies = [
+        {"action": "e_ok", "payload": {}},
+        {"action": "e_fail", "payload": {}},
+        {"action": "e_batch", "payload": {}},
+        {"action": "e_batch", "payload": {"fail": True}},
+        {"action": "e_unknown", "payload": {}},
+    ]
+    records = [{"messageId": f"m{i}", "eventSource": "aws:sqs", "body": json.dumps(body)} for i, body in enumerate(bodies)]
+    records.append({"messageId": "m_bad", "eventSource": "aws:sqs", "body": "not json"})
+    records.append({"messageId": "m_list", "eventSource": "aws:sqs", "body": "[1, 2]"})
+
+    records = [dict(record, eventSourceARN="arn:aws:sqs:us-east-1:123456789012:local") for record in records]
+
+    result = handler({"Records": records}, _Context())
+    print(result)
+    assert [f["itemIdentifier"] for f in result["batchItemFailures"]] == ["m_bad", "m_list", "m3", "m1"]
+
+    # Out of time: records go back to the queue as new messages, not into batchItemFailures
+    class _LateContext:
+        def get_remaining_time_in_millis(self):
+            return 30 * 1000
+
+    class _SQS:
+        def __init__(self):
+            self.sent = []
+
+        def send_message(self, QueueUrl, MessageBody):
+            self.sent.append((QueueUrl, MessageBody))
+
+    _sqs = _SQS()
+    result = handler({"Records": records}, _LateContext())
+    print(result)
+    assert [f["itemIdentifier"] for f in result["batchItemFailures"]] == ["m_bad", "m_list"]
+    assert len(_sqs.sent) == 5 and _sqs.sent[0][0] == "https://sqs.us-east-1.amazonaws.com/123456789012/local"
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import common.db
+
+# Read-through cache of published articles, shared by every handler in the container. On a
+# delivery day thousands of e_email and e_nlp messages ask for the same few dozen articles, so
+# articles are kept by id and only the ids a lookup doesn't have are queried. Entries older
+# than the TTL are revalidated against the row's `date` (set whenever the article is written)
+# in the same query and only fetched again when it changed.
+
+ARTICLE_CACHE_TTL_SECONDS = int(os.environ.get('ARTICLE_CACHE_TTL_SECONDS', '300'))
+ARTICLE_CACHE_SIZE = int(os.environ.get('ARTICLE_CACHE_SIZE', '512'))
+
+# Rows come back for the ids not cached and for the cached ones whose date moved on,
+# cached ones still current come back with only their id and date
+_QUERY = """
+    SELECT a.id, a.date, a.date IS DISTINCT FROM known.date AS changed,
+           CASE WHEN a.date IS DISTINCT FROM known.date THEN a.title END,
+           CASE WHEN a.date IS DISTINCT FROM known.date THEN a.content END,
+           CASE WHEN a.date IS DISTINCT FROM known.date THEN a.summary END,
+           CASE WHEN a.date IS DISTINCT FROM known.date THEN a.topics END,
+           CASE WHEN a.date IS DISTINCT FROM known.date THEN a.tags END
+    FROM unnest(%s::int[], %s::timestamp[]) AS known (id, date)
+    JOIN articles a ON a.id = known.id
+"""
+
+
+class CacheStats:
+    """
+    Lookups served by the cache, queries and database round trips made (the queries plus the
+    pool's connection checks), for the container's lifetime
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.articles = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.fetched = 0
+        self.queries = 0
+        self.round_trips = 0
+
+    def record(self, articles, hits, revalidated=0, fetched=0, queries=0, round_trips=0):
+        with self.lock:
+            self.lookups += 1
+            self.articles += articles
+            self.hits += hits
+            self.revalidated += revalidated
+            self.fetched += fetched
+            self.queries += queries
+            self.round_trips += round_trips
+
+    def report(self):
+        return (f"Article cache: {self.lookups} lookups of {self.articles} articles, {self.hits} from memory, "
+                f"{self.revalidated} revalidated, {self.fetched} fetched in {self.queries} queries "
+                f"({self.lookups - self.queries} saved), {self.round_trips} database round trips")
+
+
+stats = CacheStats()
+
+# id -> (article, date, time of the last check), least recently used first
+_articles = OrderedDict()
+_lock = threading.Lock()
+
+
+def _article(row):
+    article_id, date, _, title, content, summary, topics, tags = row
+    return {
+        'id': article_id,
+        'title': title,
+        'content': content,
+        'summary': summary,
+        'topics': topics,
+        'tags': tags,
+        'url': f"https://auxiomai.com/article/{article_id}"
+    }
+
+
+def get_articles(article_ids):
+    """
+    Articles by id, from the container's cache where current and otherwise in one query.
+    :param article_ids: IDs of the articles to retrieve.
+    :return: List of article dictionaries with 'id', 'title', 'content', 'summary', 'topics',
+             'tags' and 'url' in the order of article_ids, ids that don't exist are left out.
+    """
+    article_ids = list(dict.fromkeys(article_ids))
+    now = time.monotonic()
+    found = {}
+    # id -> date of the cached copy, None when there is none
+    check = {}
+    with _lock:
+        for article_id in article_ids:
+            entry = _articles.get(article_id)
+            if entry is None:
+                check[article_id] = None
+                continue
+            _articles.move_to_end(article_id)
+            found[article_id] = entry[0]
+            if now - entry[2] >= ARTICLE_CACHE_TTL_SECONDS:
+                check[article_id] = entry[1]
+
+    if check:
+        with common.db.cursor() as cursor:
+            cursor.execute(_QUERY, (list(check), list(check.values())))
+            rows = cursor.fetchall()
+        round_trips = 1 + common.db.TRANSACTION_ROUND_TRIPS + common.db.checkout_round_trips()
+
+        revalidated = fetched = 0
+        with _lock:
+            for row in rows:
+                article_id, date, changed = row[0], row[1], row[2]
+                if changed:
+                    found[article_id] = _article(row)
+                    fetched += 1
+                else:
+                    revalidated += 1
+                _articles[article_id] = (found[article_id], date, now)
+                _articles.move_to_end(article_id)
+            # Cached articles that are gone from the database
+            for article_id in check.keys() - {row[0] for row in rows}:
+                _articles.pop(article_id, None)
+                found.pop(article_id, None)
+            while len(_articles) > ARTICLE_CACHE_SIZE:
+                _articles.popitem(last=False)
+        stats.record(len(article_ids), len(article_ids) - len(check), revalidated, fetched, queries=1, round_trips=round_trips)
+    else:
+        stats.record(len(article_ids), len(article_ids))
+
+    # Callers get their own copies to change
+    return [dict(found[article_id]) for article_id in article_ids if article_id in found]
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+db_access_url = os.environ.get('DB_ACCESS_URL')
+
+# Connections kept open per container, shared by the handler's worker threads
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when it runs out, callers wait for a connection instead
+_available = threading.BoundedSemaphore(DB_POOL_SIZE)
+
+# Connections idle for longer than this are checked before they are handed out
+DB_IDLE_CHECK_SECONDS = float(os.environ.get('DB_IDLE_CHECK_SECONDS', '30'))
+# connection -> time it was returned to the pool
+_returned = {}
+# Per thread, round trips the last checkout spent on connection checks
+_local = threading.local()
+# psycopg2 sends BEGIN before a block's first statement and COMMIT after the block, each its own round trip
+TRANSACTION_ROUND_TRIPS = 2
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(1, DB_POOL_SIZE, dsn=db_access_url, client_encoding='utf8')
+        return _pool
+
+
+def _alive(conn):
+    try:
+        # In autocommit the check is one round trip, no BEGIN and ROLLBACK around it
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(connections):
+    # Idle connections are tried first and may all have been dropped, the pool opens a new one
+    # once they are discarded. Only connections idle longer than DB_IDLE_CHECK_SECONDS are
+    # checked, the ones just used and just opened are handed out as they are.
+    checks = 0
+    for _ in range(DB_POOL_SIZE):
+        conn = connections.getconn()
+        returned = _returned.pop(conn, None)
+        if not conn.closed:
+            if returned is None or time.monotonic() - returned < DB_IDLE_CHECK_SECONDS:
+                break
+            checks += 1
+            if _alive(conn):
+                break
+        print("Discarding a database connection the server dropped")
+        connections.putconn(conn, close=True)
+    else:
+        conn = connections.getconn()
+    _local.checks = checks
+    return conn
+
+
+def checkout_round_trips():
+    """
+    Round trips the calling thread's last connection() spent checking its connection
+    """
+    return getattr(_local, 'checks', 0)
+
+
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection, committed when the block succeeds and rolled back when it raises.
+    Connections that sat idle are checked with SELECT 1 when borrowed, the ones the server
+    dropped (warm containers sit idle between invocations) are replaced.
+    """
+    with _available:
+        connections = _get_pool()
+        conn = _checkout(connections)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if not conn.closed:
+                _returned[conn] = time.monotonic()
+            connections.putconn(conn, close=bool(conn.closed))
+
+
+@contextmanager
+def cursor():
+    with connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
@@ -0,0 +1,87 @@
+import common.s3
+
+# Redelivered SQS messages (handler timeout or exception) repeat whatever work they contain.
+# The ledger records which steps of a unit of work (one cluster's article, one user's episode)
+# already finished, along with their results, so a repeat run skips straight past them.
+# Entries are expired by the bucket's lifecycle rule on the ledger/ prefix.
+
+
+def _load(path):
+    return common.s3.get_json(path)
+
+
+def _save(path, steps):
+    common.s3.save_json(path, steps)
+
+
+class Ledger:
+    """
+    Idempotency ledger for one unit of work, keyed by (action, stable payload key).
+    Step results must be JSON serializable.
+    """
+
+    def __init__(self, action, key):
+        self.path = f"ledger/{action}/{key}.json"
+        try:
+            self.steps = _load(self.path) or {}
+        except Exception as e:
+            print(f"Error reading ledger {self.path}, starting fresh: {e}")
+            self.steps = {}
+
+        if self.steps:
+            print(f"Ledger {self.path} has completed steps: {list(self.steps)}")
+
+    def done(self, step):
+        return step in self.steps
+
+    def mark_done(self, step, result=True):
+        self.steps[step] = result
+        try:
+            _save(self.path, self.steps)
+        except Exception as e:
+            # Losing a marker only costs repeated work on redelivery, never correctness
+            print(f"Error writing ledger {self.path}: {e}")
+
+    def run(self, step, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless the step already completed, in which case
+        the recorded result is returned instead.
+        """
+        if step in self.steps:
+            print(f"Ledger {self.path}: skipping completed step '{step}'")
+            return self.steps[step]
+
+        result = fn(*args, **kwargs)
+        self.mark_done(step, result)
+        return result
+
+
+if __name__ == "__main__":
+    # Simulate a redelivered message against an in-memory ledger and count external calls
+    store = {}
+    _load = store.get
+    _save = lambda path, steps: store.__setitem__(path, dict(steps))
+
+    calls = {"count": 0}
+
+    def _expensive(name):
+        calls["count"] += 1
+        return f"{name} result"
+
+    def _deliver(fail_after=None):
+        ledger = Ledger("e_test", "cluster-1")
+        for i, step in enumerate(["research", "article", "summary"]):
+            if fail_after is not None and i == fail_after:
+                raise RuntimeError("handler crashed")
+            ledger.run(step, _expensive, step)
+        ledger.mark_done("db")
+
+    try:
+        _deliver(fail_after=2)
+    except RuntimeError:
+        pass
+    first = calls["count"]
+    _deliver()
+    _deliver()
+    print(f"External calls: {first} before crash, {calls['count'] - first} on two redeliveries "
+          f"({3 * 2 - (calls['count'] - first)} avoided)")
@@ -0,0 +1,260 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Outgoing email through SES. One client and one send rate budget per container: every send
+# waits on a token bucket filled at the account's maximum send rate (recipients per second),
+# and sends SES throttles anyway (other containers share the account's rate) are retried
+# with backoff.
+
+SENDER = "Auxiom <Auxiom@auxiomai.com>"
+SOURCE = 'delivery@auxiomai.com'
+# Every email is also sent to this address
+COPY_TO = 'rahilv99@gmail.com'
+
+SES_SEND_WORKERS = int(os.environ.get('SES_SEND_WORKERS', '8'))
+# Recipients per second, read from the account's send quota when not set
+SES_MAX_SEND_RATE = float(os.environ.get('SES_MAX_SEND_RATE', '0'))
+SES_MAX_RETRIES = int(os.environ.get('SES_MAX_RETRIES', '5'))
+SES_BACKOFF_SECONDS = float(os.environ.get('SES_BACKOFF_SECONDS', '0.5'))
+
+# Bodies shared by at least this many recipients are sent as one SES template with
+# SendBulkTemplatedEmail, 0 sends every email on its own
+SES_TEMPLATED_MIN_RECIPIENTS = int(os.environ.get('SES_TEMPLATED_MIN_RECIPIENTS', '0'))
+BULK_DESTINATIONS = 50  # SES limit per SendBulkTemplatedEmail call
+
+# Bulk destination statuses worth sending again
+_RETRY_STATUSES = {'AccountThrottled', 'TransientFailure', 'Failed'}
+
+
+class SendThrottled(Exception):
+    """Raised when SES kept throttling a send through every retry"""
+
+
+class SendFailed(Exception):
+    """Raised for a bulk destination SES neither sent nor rejected"""
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by the sending threads: tokens refill at `rate` per second up to
+    `capacity`, acquire blocks until the tokens it asks for are available. The default capacity
+    is a tenth of a second's worth, SES counts its rate over short windows and throttles bursts.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(2.0, rate / 10))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        # Requests larger than the bucket are taken a bucketful at a time
+        remaining = float(tokens)
+        while remaining > 0:
+            wanted = min(remaining, self.capacity)
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= wanted:
+                    self.tokens -= wanted
+                    remaining -= wanted
+                    continue
+                wait = (wanted - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_client = None
+_bucket = None
+_lock = threading.Lock()
+
+
+def client():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = boto3.client('ses',
+                region_name="us-east-1",
+                aws_access_key_id=os.environ.get('AWS_ACCESS_KEY'), # make sure these are set
+                aws_secret_access_key=os.environ.get('AWS_SECRET_KEY'), # make sure these are set
+                # Throttled sends are retried here, against the token bucket
+                config=Config(max_pool_connections=max(10, SES_SEND_WORKERS), retries={'total_max_attempts': 1})
+            )
+        return _client
+
+
+def bucket():
+    global _bucket
+    if _bucket is None:
+        rate = SES_MAX_SEND_RATE
+        if not rate:
+            try:
+                rate = float(client().get_send_quota()['MaxSendRate'])
+            except Exception as e:
+                print(f"Error reading SES send quota, sending at 1 recipient per second: {e}")
+                rate = 1.0
+        with _lock:
+            if _bucket is None:
+                print(f"Sending email at up to {rate:g} recipients per second")
+                _bucket = TokenBucket(rate)
+    return _bucket
+
+
+def _throttled(e):
+    error = e.response.get('Error', {})
+    return error.get('Code') in ('Throttling', 'ThrottlingException') or 'rate exceeded' in error.get('Message', '')
+
+
+def _call(method, recipients, **kwargs):
+    """
+    Call an SES client method once the token bucket allows `recipients` more recipients,
+    retrying with backoff while SES throttles it
+    """
+    for attempt in range(SES_MAX_RETRIES + 1):
+        bucket().acquire(recipients)
+        try:
+            return getattr(client(), method)(**kwargs)
+        except ClientError as e:
+            if not _throttled(e):
+                raise
+            if attempt == SES_MAX_RETRIES:
+                raise SendThrottled(f"{method} throttled {SES_MAX_RETRIES + 1} times") from e
+            time.sleep(SES_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def build_message(recipient, subject, html):
+    # Create a multipart/mixed parent container
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = subject
+    msg['From'] = SENDER
+    msg['To'] = recipient
+
+    # Add the HTML body to the email
+    msg_body = MIMEMultipart('alternative')
+    html_part = MIMEText(html, 'html', 'utf-8')
+    msg_body.attach(html_part)
+    msg.attach(msg_body)
+    return msg.as_string()
+
+
+def send_email(recipient, subject, html):
+    """
+    Send one email, waiting for the container's send rate.
+    :return: The SES message ID, None if SES rejected the email (MessageRejected).
+    :raises SendThrottled: SES throttled every attempt, the email can be sent again later.
+    :raises ClientError: Any other SES error.
+    """
+    try:
+        response = _call('send_raw_email', 2,
+            Source=SOURCE,
+            Destinations=[recipient, COPY_TO],
+            RawMessage={
+                'Data': build_message(recipient, subject, html),
+            }
+        )
+        print(f"Email sent to {recipient}! Message ID: {response['MessageId']}")
+        return response['MessageId']
+
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'MessageRejected':
+            raise
+        print(f"Email rejected: {e}")
+        return None
+
+
+class BulkSender:
+    """
+    Sends many emails at once from a thread pool, sharing the container's client and send rate.
+    Used as a context manager, leaving it waits for the sends still in flight.
+    """
+    def __init__(self, workers=SES_SEND_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def send(self, recipient, subject, html):
+        """
+        :return: Future of send_email's result.
+        """
+        return self.executor.submit(send_email, recipient, subject, html)
+
+    def send_templated(self, subject, html, recipients):
+        """
+        Send one body to many recipients with SendBulkTemplatedEmail.
+        :param subject: Subject, may use the same {{placeholders}} as html.
+        :param html: Body with {{placeholders}} filled in per recipient by SES.
+        :param recipients: List of (address, {placeholder: value}).
+        :return: One future per recipient, with the same results as send's.
+        """
+        futures = [Future() for _ in recipients]
+        self.executor.submit(self._send_templated, subject, html, recipients, futures)
+        return futures
+
+    def _send_templated(self, subject, html, recipients, futures):
+        # Templates are per call so other containers never see one change or disappear under them
+        name = f"auxiom-bulk-{uuid.uuid4().hex}"
+        try:
+            client().create_template(Template={'TemplateName': name, 'SubjectPart': subject, 'HtmlPart': html})
+            try:
+                pending = list(range(len(recipients)))
+                for attempt in range(SES_MAX_RETRIES + 1):
+                    retry = []
+                    for start in range(0, len(pending), BULK_DESTINATIONS):
+                        indexes = pending[start:start + BULK_DESTINATIONS]
+                        response = _call('send_bulk_templated_email', 2 * len(indexes),
+                            Source=SOURCE,
+                            Template=name,
+                            DefaultTemplateData='{}',
+                            Destinations=[{
+                                'Destination': {'ToAddresses': [recipients[i][0]], 'BccAddresses': [COPY_TO]},
+                                'ReplacementTemplateData': json.dumps(recipients[i][1]),
+                            } for i in indexes]
+                        )
+                        for i, status in zip(indexes, response['Status']):
+                            if status['Status'] == 'Success':
+                                futures[i].set_result(status['MessageId'])
+                            elif status['Status'] in _RETRY_STATUSES:
+                                retry.append(i)
+                            elif status['Status'] == 'MessageRejected':
+                                print(f"Email to {recipients[i][0]} rejected: {status.get('Error', '')}")
+                                futures[i].set_result(None)
+                            else:
+                                futures[i].set_exception(SendFailed(
+                                    f"Email to {recipients[i][0]} failed: {status['Status']} {status.get('Error', '')}"))
+                    if not retry:
+                        break
+                    if attempt == SES_MAX_RETRIES:
+                        raise SendThrottled(f"{len(retry)} bulk destinations still failing after {SES_MAX_RETRIES + 1} attempts")
+                    pending = retry
+                    time.sleep(SES_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+                sent = sum(1 for future in futures if future.exception() is None and future.result())
+                print(f"Bulk email sent to {sent}/{len(recipients)} recipients")
+            finally:
+                try:
+                    client().delete_template(TemplateName=name)
+                except ClientError as e:
+                    print(f"Error deleting SES template {name}: {e}")
+        except Exception as e:
+            # Recipients not sent yet fail, the ones SES already accepted keep their results
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
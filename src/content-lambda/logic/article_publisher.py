@@ -2,48 +2,87 @@ import re
 import google.generativeai as genai
 import os
 import psycopg2 
+import psycopg2.extras
+import hashlib
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pandas as pd
-from io import StringIO
+import common.db
 import common.s3
+import common.ledger
+import logic.cluster_documents
+import logic.compression
+import logic.providers
 
 
-GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
+summary_model = logic.providers.text_model('gemini-2.0-flash')  # $0.075 /M input  $0.30 /M output tokens 
+article_model = logic.providers.text_model('gemini-2.5-flash')  # $0.10 /M input $0.40 /M output tokens
 
-summary_model = genai.GenerativeModel('gemini-2.0-flash')  # $0.075 /M input  $0.30 /M output tokens 
-article_model = genai.GenerativeModel('gemini-2.5-flash')  # $0.10 /M input $0.40 /M output tokens
+# Clusters of a chunk are published concurrently, and so are the research calls within a cluster.
+# Gemini concurrency across all of them is governed by logic.providers' adaptive limits.
+PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS', '5'))
+RESEARCH_WORKERS = int(os.environ.get('RESEARCH_WORKERS', '4'))
+# S3 metadata downloads in flight while a chunk's clusters are loaded
+METADATA_WORKERS = int(os.environ.get('METADATA_WORKERS', '8'))
 
-db_access_url = os.environ.get('DB_ACCESS_URL')
 
 ### Underwriter - Researches documents in a cluster
-def underwriter_research(cluster_df):
+
+# Research notes depend on the document and on the cluster's titles and headlines it is
+# compressed against, so they are cached in S3 under both and reused while the scrapers'
+# 7 day lookback keeps bringing the same cluster back. Bump the version when the research
+# prompt or the compression changes.
+RESEARCH_PROMPT_VERSION = 1
+RESEARCH_CACHE_TTL_DAYS = int(os.environ.get('RESEARCH_CACHE_TTL_DAYS', '10'))
+
+
+class ResearchStats:
     """
-    Research component that analyzes documents in a cluster and creates detailed notes
-    for the article writer.
-    
-    Args:
-        cluster_df: DataFrame containing documents in a cluster with columns:
-                   'source', 'type', 'title', 'text', 'url', 'keyword'
-    
-    Returns:
-        Dictionary with research notes for each document type
+    Gemini research calls made and saved by the notes cache, shared by the worker threads of a run
     """
-    research_notes = {
-        'primary_doc': {},
-        'secondary_docs': [],
-        'news_articles': []
-    }
-    
-    # Process primary government document
-    primary_doc = cluster_df[cluster_df['type'] == 'primary'].iloc[0]
-    primary_prompt = f"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.cached = 0
+        self.input_tokens = 0
+
+    def record(self, cached, input_tokens=0):
+        with self.lock:
+            self.documents += 1
+            self.cached += cached
+            self.input_tokens += input_tokens
+
+    def merge(self, other):
+        with self.lock:
+            self.documents += other.documents
+            self.cached += other.cached
+            self.input_tokens += other.input_tokens
+
+    def report(self):
+        return (f"Research cache: {self.cached}/{self.documents} documents reused, {self.cached} Gemini calls saved, "
+                f"~{self.input_tokens} input tokens sent")
+
+
+def _research_cache_key(doc, doc_type, queries):
+    text = str(doc.text)
+    identity = doc.url or hashlib.sha256(text.encode('utf-8')).hexdigest()
+    # The notes are written from the passages compress() picked for these queries
+    queries_digest = hashlib.sha256("\n".join(sorted(str(query) for query in queries)).encode('utf-8')).hexdigest()
+    digest = hashlib.sha256(
+        f"{text}|{doc_type}|{queries_digest}|{summary_model.model_name}|{RESEARCH_PROMPT_VERSION}".encode('utf-8')
+    ).hexdigest()[:40]
+    return f"research/{hashlib.sha256(identity.encode('utf-8')).hexdigest()[:40]}/{digest}.json"
+
+
+def _research_prompt(title, text):
+    return f"""
     You are a meticulous research analyst extracting the key information from government documents to write an in depth article.
     
     DOCUMENT:
-    Title: {primary_doc['title']}
-    Text: {primary_doc['text'][1000:50000]}
+    Title: {title}
+    Text: {text}
     
     Create factual research notes:
     1. **Summary of Key Points**: Detailed summary of the document's main points
@@ -60,68 +99,109 @@ def underwriter_research(cluster_df):
     - No analysis or interpretation
     Keep response under 500 tokens.
     """
-    
-    primary_response = summary_model.generate_content(
-        primary_prompt,
+
+
+def document_notes(doc, doc_type, queries, stats):
+    """
+    Research notes for one government document, from the notes cache when it was analyzed before.
+
+    Args:
+        doc: ClusterDocument to research
+        doc_type: 'primary' or 'secondary'
+        queries: Titles and headlines of the cluster, used to compress the document
+        stats: ResearchStats of the run
+
+    Returns:
+        The research notes
+    """
+    key = _research_cache_key(doc, doc_type, queries)
+    try:
+        cached = common.s3.get_json(key)
+        if cached is not None and time.time() - cached['created_at'] < RESEARCH_CACHE_TTL_DAYS * 86400:
+            stats.record(cached=True)
+            return cached['notes']
+    except Exception as e:
+        print(f"Error reading research cache {key}: {e}")
+
+    # Government documents are cut down to the passages most relevant to the cluster's titles and headlines
+    if doc_type == 'primary':
+        budget, max_output_tokens = logic.compression.PRIMARY_TOKEN_BUDGET, 700
+    else:
+        budget, max_output_tokens = logic.compression.SECONDARY_TOKEN_BUDGET, 600
+    prompt = _research_prompt(doc.title, logic.compression.compress(str(doc.text), queries, budget))
+
+    response = summary_model.generate_content(
+        prompt,
         generation_config=genai.GenerationConfig(
-            max_output_tokens=700,
+            max_output_tokens=max_output_tokens,
             temperature=0.2
         )
     )
+    stats.record(cached=False, input_tokens=logic.compression.estimate_tokens(prompt))
+
+    try:
+        common.s3.save_json(key, {'notes': response.text, 'created_at': time.time()})
+    except Exception as e:
+        print(f"Error writing research cache {key}: {e}")
+    return response.text
+
+
+def underwriter_research(documents, stats=None):
+    """
+    Research component that analyzes documents in a cluster and creates detailed notes
+    for the article writer.
     
-    research_notes['primary_doc'] = {
-        'title': primary_doc['title'],
-        'url': primary_doc['url'],
-        'notes': primary_response.text
-    }
+    Args:
+        documents: List of ClusterDocument in the cluster
+        stats: ResearchStats collecting the publishing run's cache hits
     
-    # Process secondary government documents
-    secondary_docs = cluster_df[cluster_df['type'] == 'secondary']
-    for _, doc in secondary_docs.iterrows():
-        secondary_prompt = f"""
-        You are a meticulous research analyst extracting the key information from government documents to write an in depth article.
-        
-        DOCUMENT:
-        Title: {doc['title']}
-        Text: {doc['text'][1000:50000]}
-        
-        Create factual research notes:
-        1. **Summary of Key Points**: Detailed summary of the document's main points
-
-        Use bullet points for the following:
-        2. **Explicit Actions**: Only actions/decisions directly stated
-        3. **Named Entities**: Exact names mentioned in the document
-        4. **Specific Data**: Precise numbers, dates, amounts from the text
-        5. **Direct Quotes**: Key statements in quotation marks
-        6. **Cross-References**: Any references to other documents/policies mentioned
-        
-        REQUIREMENTS:
-        - Mark uncertain information as "[UNCLEAR]"
-        - No analysis or interpretation
-        Keep response under 500 tokens.
-        """
-        
-        secondary_response = summary_model.generate_content(
-            secondary_prompt,
-            generation_config=genai.GenerationConfig(
-                max_output_tokens=600,
-                temperature=0.2
-            )
-        )
-        
-        research_notes['secondary_docs'].append({
-            'title': doc['title'],
-            'url': doc['url'],
-            'notes': secondary_response.text
-        })
+    Returns:
+        Dictionary with research notes for each document type
+    """
+    research_notes = {
+        'primary_doc': {},
+        'secondary_docs': [],
+        'news_articles': []
+    }
+
+    queries = [str(doc.title) for doc in documents]
+    cluster_stats = ResearchStats()
+    started = time.perf_counter()
+
+    primary_doc = logic.cluster_documents.of_type(documents, 'primary')[0]
+    secondary_docs = logic.cluster_documents.of_type(documents, 'secondary')
+
+    # One Gemini call per document, all in flight at once (bounded by the model's shared limit)
+    with ThreadPoolExecutor(max_workers=RESEARCH_WORKERS) as executor:
+        primary_notes = executor.submit(document_notes, primary_doc, 'primary', queries, cluster_stats)
+        secondary_notes = [executor.submit(document_notes, doc, 'secondary', queries, cluster_stats) for doc in secondary_docs]
+
+        # Process primary government document
+        research_notes['primary_doc'] = {
+            'title': primary_doc.title,
+            'url': primary_doc.url,
+            'notes': primary_notes.result()
+        }
+
+        # Process secondary government documents
+        for doc, notes in zip(secondary_docs, secondary_notes):
+            research_notes['secondary_docs'].append({
+                'title': doc.title,
+                'url': doc.url,
+                'notes': notes.result()
+            })
+
+    print(f"Research on {cluster_stats.documents} documents ({cluster_stats.cached} cached): "
+          f"~{cluster_stats.input_tokens} input tokens, {time.perf_counter() - started:.1f}s")
+    if stats is not None:
+        stats.merge(cluster_stats)
     
     # Process news articles
-    news_articles = cluster_df[cluster_df['type'] == 'news']
-    for _, article in news_articles.iterrows():
+    for article in logic.cluster_documents.of_type(documents, 'news'):
         research_notes['news_articles'].append({
-            'title': article['title'],
-            #'publisher': article['publisher'],
-            'url': article['url'],
+            'title': article.title,
+            #'publisher': article.publisher,
+            'url': article.url,
             'notes': ''
         })
     
@@ -129,6 +209,31 @@ def underwriter_research(cluster_df):
 
 
 ### Article Writer - Creates an article for a cluster based on underwriter's research
+
+# Write the overview bullets and the newsletter blurb in the article call instead of two more
+# calls that send the article back. Either one falls back to its own call when it comes back invalid.
+SINGLE_CALL_ARTICLE = os.environ.get('SINGLE_CALL_ARTICLE', '1') == '1'
+OVERVIEW_AND_BLURB_TOKENS = 300
+
+OVERVIEW_AND_BLURB_INSTRUCTIONS = """,
+    "Overview": <List of 3-5 key points for readers scanning the article, each a complete sentence under 25 words with specific names, numbers or dates, not repeating the title. Plain text, no HTML>,
+    "Blurb": <Newsletter blurb of 2-3 sentences, under 60 words: lead with what changed, who is affected or what is at stake, in active voice and present tense, end with the impact. Write like breaking news, not marketing copy>"""
+
+OVERVIEW_AND_BLURB_SCHEMA = {
+    "Overview": {
+        "type": "array",
+        "items": {
+            "type": "string"
+        },
+        "min_items": 3,
+        "max_items": 5,
+        "description": "Key points of the article, each under 25 words"
+    },
+    "Blurb": {
+        "type": "string",
+        "description": "Newsletter blurb of 2-3 sentences, under 60 words"
+    },
+}
 def create_cluster_article(research_notes):
     """
     Creates an article for an entire cluster based on the underwriter's research.
@@ -142,6 +247,11 @@ def create_cluster_article(research_notes):
 
     tokens = 2500  
 
+    # The overview and newsletter blurb are written in the same call as the article
+    extra_fields = ""
+    if SINGLE_CALL_ARTICLE:
+        extra_fields = OVERVIEW_AND_BLURB_INSTRUCTIONS
+
     # Extract information from research notes
     primary_doc = research_notes['primary_doc']
     secondary_docs = research_notes['secondary_docs']
@@ -161,7 +271,7 @@ def create_cluster_article(research_notes):
     "Title": <Specific, newsworthy headline that captures the core development>,
     "People": <List of specific names of the top (at most) 3 real people mentioned in the documents>
     "Keywords": <List the top (at most) 5 relevant policy/topic keywords>,
-    "Article": <Content in HTML format using only <p> tags for paragraphs>
+    "Article": <Content in HTML format using only <p> tags for paragraphs>{extra_fields}
     
     **ENHANCED WRITING FRAMEWORK:**
     
@@ -232,12 +342,15 @@ def create_cluster_article(research_notes):
         },
         "required": ["Title", "People", "Article"],
     }
+    if SINGLE_CALL_ARTICLE:
+        json_schema["properties"].update(OVERVIEW_AND_BLURB_SCHEMA)
+        json_schema["required"] += list(OVERVIEW_AND_BLURB_SCHEMA)
 
     # Generate the article
     response = article_model.generate_content(
         system_prompt,
         generation_config=genai.GenerationConfig(
-            max_output_tokens=tokens*2,
+            max_output_tokens=tokens*2 + (OVERVIEW_AND_BLURB_TOKENS if SINGLE_CALL_ARTICLE else 0),
             temperature=0.3,
             response_mime_type="application/json",
             response_schema=json_schema
@@ -251,23 +364,65 @@ def create_cluster_article(research_notes):
     people = article_json.get("People", [])
     keywords = article_json.get("Keywords", [])
 
-    # Generate article overview bullet points
-    overview_bullets = generate_article_overview(title, content)
+    # Overview bullet points, from the same response unless they are missing or malformed
+    overview = _valid_overview(article_json.get("Overview")) if SINGLE_CALL_ARTICLE else None
+    if overview is None:
+        if SINGLE_CALL_ARTICLE:
+            print(f"Article '{title}' came without a valid overview, generating it separately")
+        overview_bullets = generate_article_overview(title, content)
+    else:
+        overview_bullets = "<ul>\n" + "".join(f"<li>{bullet}</li>\n" for bullet in overview) + "</ul>"
     
     # Prepend overview to the beginning of the article content
     final_content = overview_bullets + content
     
-    time = round(len(final_content.split()) / 175)  # Average reading speed is 175 words per minute
+    read_minutes = round(len(final_content.split()) / 175)  # Average reading speed is 175 words per minute
 
-    return {
+    article = {
         'title': title,
         'content': final_content,
         'people': people,
         'tags': keywords,
         'research_notes': research_notes,
-        'time': time
+        'time': read_minutes
     }
 
+    # Newsletter blurb, left out when invalid so process_single_cluster generates it separately
+    blurb = _valid_blurb(article_json.get("Blurb")) if SINGLE_CALL_ARTICLE else None
+    if blurb is not None:
+        article['summary'] = blurb
+    elif SINGLE_CALL_ARTICLE:
+        print(f"Article '{title}' came without a valid blurb, generating it separately")
+
+    return article
+
+
+def _valid_overview(overview):
+    """
+    The overview's bullets if it has 3-5 non-empty ones, otherwise None
+    """
+    if not isinstance(overview, list):
+        return None
+    bullets = [bullet.strip() for bullet in overview if isinstance(bullet, str) and bullet.strip()]
+    if not 3 <= len(bullets) <= 5 or len(bullets) != len(overview):
+        return None
+    # The prompt asks for plain sentences, the <ul> is added here
+    if any("<" in bullet for bullet in bullets):
+        return None
+    return bullets
+
+
+def _valid_blurb(blurb):
+    """
+    The cleaned blurb if it is a short non-empty text, otherwise None
+    """
+    if not isinstance(blurb, str):
+        return None
+    blurb = _clean_summary_text(blurb)
+    if not blurb or len(blurb.split()) > 80:
+        return None
+    return blurb
+
 
 def generate_article_overview(article_title, article_content):
     """
@@ -318,6 +473,11 @@ def generate_article_overview(article_title, article_content):
     return response.text.strip()
 
 
+def _clean_summary_text(text):
+    text = re.sub(r'\*', '', text)
+    return re.sub(r'\s+', ' ', text.replace('\n', ' ').replace('\\', '')).strip()
+
+
 def generate_summary(article_title, article_content):
     """
     Generates a newsletter blurb about the article for email delivery.
@@ -330,10 +490,6 @@ def generate_summary(article_title, article_content):
     Returns:
         Dictionary with newsletter blurb information
     """
-    def _clean_summary_text(text):
-        text = re.sub(r'\*', '', text)
-        return re.sub(r'\s+', ' ', text.replace('\n', ' ').replace('\\', '')).strip()
-    
     # Create newsletter blurb using the article content
     blurb_prompt = f"""
     Create a compelling newsletter blurb for this government policy article.
@@ -373,13 +529,12 @@ def generate_summary(article_title, article_content):
     
     return summary
 
-def parse_sources(cluster_df):
+def parse_sources(documents):
     """
-    Process the cluster_df object and extract source information.
+    Process the cluster's documents and extract source information.
     
     Args:
-        cluster_df: DataFrame containing documents in a cluster with columns:
-                   'source', 'type', 'title', 'text', 'url', 'keyword'
+        documents: List of ClusterDocument in the cluster
     
     Returns:
         List of dictionaries containing source information with keys:
@@ -387,170 +542,233 @@ def parse_sources(cluster_df):
     """
     sources = []
     
-    for _, row in cluster_df.iterrows():
+    for doc in documents:
         source_info = {
-            'type': 'primary' if row['type'] in ['primary', 'secondary'] else 'news',
-            'url': row['url'],
-            'source': row['source'],
-            'title': row['title']
+            'type': 'primary' if doc.type in ['primary', 'secondary'] else 'news',
+            'url': doc.url,
+            'source': doc.source,
+            'title': doc.title
         }
         sources.append(source_info)
     
     return sources
 
 
-def update_db(article_title, article_content, summary, people, time, topics, tags, cluster_id, sources):
+def update_db(articles):
     """
-    Update database with single article information.
+    Write the articles of a chunk to the database in a single statement and transaction.
     Capitalizes each word in people, topics, and tags.
+
+    Args:
+        articles: List of dictionaries with 'cluster_id', 'title', 'content', 'summary',
+                  'people', 'time', 'topics', 'tags' and 'sources'
+
+    Database errors are raised, nothing of the chunk is written then.
+    """
+    now = datetime.now()
+    rows = [(
+        article['cluster_id'],
+        article['title'],
+        article['content'],
+        article['summary'],
+        json.dumps(article['people']),
+        article['time'],
+        json.dumps(article['topics']),
+        json.dumps(article['tags']),
+        now,
+        json.dumps(article['sources'])
+    ) for article in articles]
+
+    with common.db.cursor() as cursor:
+        psycopg2.extras.execute_values(cursor, """
+            UPDATE articles
+            SET title = v.title, content = v.content, summary = v.summary, people = v.people, duration = v.duration,
+                topics = v.topics, tags = v.tags, date = v.date, sources = v.sources
+            FROM (VALUES %s) AS v (id, title, content, summary, people, duration, topics, tags, date, sources)
+            WHERE articles.id = v.id
+        """, rows, template="(%s, %s, %s, %s, %s::jsonb, %s, %s::jsonb, %s::jsonb, %s, %s::jsonb)", page_size=100)
+
+    print(f"Successfully updated clusters {[row[0] for row in rows]} with article information")
+
+
+def _legacy_records(documents):
     """
+    Records of legacy metadata, a DataFrame's to_json() string ({column: {index: value}})
+    """
+    columns = json.loads(documents)
+    index = sorted({i for values in columns.values() for i in values}, key=int)
+    return [{column: values.get(i) for column, values in columns.items()} for i in index]
 
-    try:
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            UPDATE articles 
-            SET title = %s, content = %s, summary = %s, people = %s::jsonb, duration = %s, topics = %s::jsonb, tags = %s::jsonb, date = %s, sources = %s::jsonb
-            WHERE id = %s
-        """, (
-            article_title,
-            article_content,
-            summary,
-            json.dumps(people),
-            time,
-            json.dumps(topics),
-            json.dumps(tags),
-            datetime.now(),
-            json.dumps(sources),
-            cluster_id
-        ))
-
-        conn.commit()
-        print(f"Successfully updated cluster {cluster_id} with article information")
-
-    except psycopg2.Error as e:
-        print(f"Database error: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-
-
-def get_cluster_metadata(cluster_id):
-    """
-    Retrieve cluster metadata from database and S3.
+
+def _fetch_documents(cluster_id, cluster_key):
+    documents = common.s3.get_metadata(cluster_key)
+    if documents is None:
+        print(f"Failed to retrieve metadata for cluster {cluster_id}")
+        return None
+
+    if isinstance(documents, str):
+        # Legacy metadata, a pickled DataFrame JSON string
+        return _legacy_records(documents)
+
+    return documents
+
+
+def get_cluster_metadata(cluster_ids):
+    """
+    Retrieve the metadata of a chunk's clusters: their keys from the database in one query,
+    then the documents from S3 concurrently.
     
     Args:
-        cluster_id: The cluster ID to retrieve metadata for
+        cluster_ids: The cluster IDs to retrieve metadata for
         
     Returns:
-        DataFrame containing cluster documents or None if error
+        Dictionary of cluster ID to its list of documents, clusters that could not be
+        retrieved are left out
     """
     try:
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT key FROM articles WHERE id = %s", (cluster_id,))
-        result = cursor.fetchone()
-        
-        if not result:
-            print(f"No cluster found with ID {cluster_id}")
-            return None
-            
-        cluster_key = result[0]
-        
-        # Retrieve metadata from S3
-        articles_json = common.s3.get_metadata(cluster_key)
-        if articles_json is None:
-            print(f"Failed to retrieve metadata for cluster {cluster_id}")
-            return None
-            
-        # Parse JSON to DataFrame
-        import pandas as pd
-        cluster_df = pd.read_json(StringIO(articles_json))
-        
-        return cluster_df
-        
+        with common.db.cursor() as cursor:
+            cursor.execute("SELECT id, key FROM articles WHERE id = ANY(%s)", (list(cluster_ids),))
+            cluster_keys = dict(cursor.fetchall())
     except Exception as e:
-        print(f"Error retrieving cluster metadata for {cluster_id}: {e}")
-        return None
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        print(f"Error retrieving cluster keys for {cluster_ids}: {e}")
+        return {}
 
+    for cluster_id in cluster_ids:
+        if cluster_id not in cluster_keys:
+            print(f"No cluster found with ID {cluster_id}")
 
-def process_single_cluster(cluster_id):
+    metadata = {}
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        futures = {cluster_id: executor.submit(_fetch_documents, cluster_id, cluster_key)
+                   for cluster_id, cluster_key in cluster_keys.items()}
+        for cluster_id, future in futures.items():
+            try:
+                documents = future.result()
+            except Exception as e:
+                print(f"Error retrieving cluster metadata for {cluster_id}: {e}")
+                continue
+            if documents is not None:
+                metadata[cluster_id] = documents
+    return metadata
+
+
+def process_single_cluster(cluster_id, documents, stats=None):
     """
     Process a single cluster and generate an article.
     
     Args:
         cluster_id: The cluster ID to process
+        documents: The cluster's documents, None if they could not be retrieved
+        stats: ResearchStats collecting the publishing run's research cache hits
         
     Returns:
-        Boolean indicating success or failure
+        (ledger, article) where article holds the fields for update_db, or is None when the
+        cluster was already published. Errors are raised for the handler to report.
     """
-    try:
-        print(f"Processing cluster {cluster_id}")
-        
-        # Step 1: Retrieve cluster metadata from S3
-        cluster_df = get_cluster_metadata(cluster_id)
-        if cluster_df is None or cluster_df.empty:
-            print(f"Failed to retrieve metadata for cluster {cluster_id}")
-            return False
-        
-        # Step 2: Underwriter researches the cluster
-        research_notes = underwriter_research(cluster_df)
-        
-        # Step 3: Article writer creates an article for the cluster
-        article = create_cluster_article(research_notes)
-        
-        # Step 4: Generate newsletter blurb
-        summary = generate_summary(
-            article['title'], 
-            article['content']
-        )
-
-        topics = cluster_df['keyword'].unique().tolist()
+    print(f"Processing cluster {cluster_id}")
 
-        sources = parse_sources(cluster_df)
+    # Completed Gemini steps are recorded so a redelivered message doesn't repeat them
+    ledger = common.ledger.Ledger("e_publish", cluster_id)
+    if ledger.done("db"):
+        print(f"Cluster {cluster_id} was already published")
+        return ledger, None
+    
+    # Step 1: Cluster metadata, retrieved for the whole chunk by the handler
+    if not documents:
+        raise ValueError(f"Failed to retrieve metadata for cluster {cluster_id}")
+    documents = logic.cluster_documents.from_records(documents)
+    
+    # Step 2: Underwriter researches the cluster
+    research_notes = ledger.run("research", underwriter_research, documents, stats)
+    
+    # Step 3: Article writer creates an article for the cluster
+    article = ledger.run("article", create_cluster_article, research_notes)
+    
+    # Step 4: Generate newsletter blurb, unless the article writer already wrote it
+    summary = article.get('summary') or ledger.run("summary", generate_summary,
+        article['title'], 
+        article['content']
+    )
 
-        # Step 5: Update database
-        update_db(article['title'], article['content'], summary, article['people'], article['time'], topics, article['tags'], cluster_id, sources)
-        
-        print(f"Successfully processed cluster {cluster_id}")
-        return True
-        
-    except Exception as e:
-        print(f"Error processing cluster {cluster_id}: {e}")
-        return False
+    topics = logic.cluster_documents.keywords(documents)
+
+    sources = parse_sources(documents)
+
+    # Step 5: The database update is made by the handler for the whole chunk
+    print(f"Successfully processed cluster {cluster_id}")
+    return ledger, {
+        'cluster_id': cluster_id,
+        'title': article['title'],
+        'content': article['content'],
+        'summary': summary,
+        'people': article['people'],
+        'time': article['time'],
+        'topics': topics,
+        'tags': article['tags'],
+        'sources': sources
+    }
 
 
 # Main Execution
 def handler(payload):
+    """
+    Publish a chunk of clusters. Clusters that fail don't stop the others, once the rest are
+    written and marked done the failures are raised so SQS redelivers the message, and the
+    ledger skips everything already published or researched on the next delivery.
+    """
     cluster_ids = payload.get("clusters", [])
     
     print(f"Processing {len(cluster_ids)} clusters: {cluster_ids}")
+    started = time.perf_counter()
     
     successful_clusters = []
     failed_clusters = []
-    
-    # Process each cluster in the chunk
+    # cluster id -> (ledger, article) or the exception it failed with
+    results = {}
+    stats = ResearchStats()
+
+    # Step 1 for every cluster of the chunk at once
+    metadata = get_cluster_metadata(cluster_ids)
+    
+    # Process the clusters in the chunk concurrently
+    with ThreadPoolExecutor(max_workers=PUBLISH_WORKERS) as executor:
+        futures = {cluster_id: executor.submit(process_single_cluster, cluster_id, metadata.get(cluster_id), stats)
+                   for cluster_id in cluster_ids}
+        for cluster_id, future in futures.items():
+            try:
+                results[cluster_id] = future.result()
+            except Exception as e:
+                print(f"Error processing cluster {cluster_id}: {e}")
+                results[cluster_id] = e
+
+    # Step 5 for every processed cluster in one transaction
+    articles = [result[1] for result in results.values() if isinstance(result, tuple) and result[1] is not None]
+    write_error = None
+    if articles:
+        try:
+            update_db(articles)
+        except Exception as e:
+            print(f"Database error writing clusters {[article['cluster_id'] for article in articles]}: {e}")
+            write_error = e
+
     for cluster_id in cluster_ids:
-        success = process_single_cluster(cluster_id)
-        if success:
-            successful_clusters.append(cluster_id)
-        else:
+        result = results[cluster_id]
+        if isinstance(result, Exception):
             failed_clusters.append(cluster_id)
-    
-    print(f"Processing complete. Successful: {len(successful_clusters)}, Failed: {len(failed_clusters)}")
+            continue
+        ledger, article = result
+        if article is not None:
+            if write_error is not None:
+                results[cluster_id] = write_error
+                failed_clusters.append(cluster_id)
+                continue
+            ledger.mark_done("db")
+        successful_clusters.append(cluster_id)
+    
+    print(f"Processing complete in {time.perf_counter() - started:.1f}s. Successful: {len(successful_clusters)}, Failed: {len(failed_clusters)}")
+    print(stats.report())
     if failed_clusters:
-        print(f"Failed clusters: {failed_clusters}")
+        raise RuntimeError(f"Failed clusters: {failed_clusters}") from results[failed_clusters[0]]
 
 
 if __name__ == "__main__":
@@ -560,10 +778,10 @@ if __name__ == "__main__":
     cluster = pkl.loads(open("tmp/example_cluster.pkl", "rb").read())
     cluster_id = 3887
 
-    cluster_df = pd.read_json(StringIO(cluster))
+    documents = logic.cluster_documents.from_records(_legacy_records(cluster) if isinstance(cluster, str) else cluster)
         
     # Step 1: Underwriter researches the cluster
-    research_notes = underwriter_research(cluster_df)
+    research_notes = underwriter_research(documents)
     
     # Step 2: Article writer creates an article for the cluster
     article = create_cluster_article(research_notes)
@@ -574,10 +792,12 @@ if __name__ == "__main__":
         article['content']
     )
 
-    topics = cluster_df['keyword'].unique().tolist()
-    sources = parse_sources(cluster_df)
+    topics = logic.cluster_documents.keywords(documents)
+    sources = parse_sources(documents)
 
-    update_db(article['title'], article['content'], summary, article['people'], article['time'], topics, article['tags'], cluster_id, sources)
+    update_db([{'cluster_id': cluster_id, 'title': article['title'], 'content': article['content'], 'summary': summary,
+                'people': article['people'], 'time': article['time'], 'topics': topics, 'tags': article['tags'],
+                'sources': sources}])
 
     print("---- GENERATED ARTICLE ----")
     print(f"Title: {article['title']}")
@@ -0,0 +1,54 @@
+"""
+Documents of one cluster, as written by the clusterer (common.serialization's cluster_documents schema)
+
+Clusters hold a handful of documents, so they are kept as a plain list of slotted records
+rather than a DataFrame, which keeps pandas out of the content Lambda's cold start.
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class ClusterDocument:
+    source: str
+    type: str
+    title: str
+    text: str
+    url: str | None
+    keyword: str
+    # Only set on news, how close the article is to the cluster's government documents
+    similarity: float | None = None
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            source=record['source'],
+            type=record['type'],
+            title=record['title'],
+            text=record['text'],
+            url=record.get('url'),
+            keyword=record['keyword'],
+            similarity=record.get('similarity'),
+        )
+
+
+def from_records(records):
+    """
+    :param records: List of document dictionaries, as returned by common.s3.get_metadata.
+    :return: List of ClusterDocument in the same order.
+    """
+    return [ClusterDocument.from_record(record) for record in records]
+
+
+def of_type(documents, doc_type):
+    """
+    :return: The documents of one type ('primary', 'secondary' or 'news') in cluster order.
+    """
+    return [doc for doc in documents if doc.type == doc_type]
+
+
+def keywords(documents):
+    """
+    :return: The distinct keywords of the documents, in order of first appearance.
+    """
+    return list(dict.fromkeys(doc.keyword for doc in documents))
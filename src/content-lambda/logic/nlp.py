@@ -6,24 +6,53 @@ import google.generativeai as genai
 # merge chunks
 from pydub import AudioSegment
 import os
-from openai import OpenAI
-import psycopg2 
+import openai
 import json
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import common.articles
+import common.db
 import common.s3
+import common.ledger
+import logic.audio
+import logic.providers
+import logic.tts_cache
+import logic.shared_episodes
 
-db_access_url = os.environ.get('DB_ACCESS_URL')
-TEMP_BASE = "/tmp"
 
 # carteisa is expensive, TTS account is currently: CLOSED
 cartesia = False
 
-GOOGLE_API_KEY= os.environ.get('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
-
-summary_model = genai.GenerativeModel('gemini-2.0-flash') # $0.075 /M input  $0.30 /M output tokens 
-script_model = genai.GenerativeModel('gemini-2.5-flash') # $0.10 /M input $0.40 /M output tokens
+# TTS requests run on a bounded thread pool, rate limited requests are retried with backoff
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', '8'))
+TTS_MAX_RETRIES = int(os.environ.get('TTS_MAX_RETRIES', '5'))
+TTS_BACKOFF_SECONDS = float(os.environ.get('TTS_BACKOFF_SECONDS', '1.0'))
+TTS_MAX_CHARS = 4096  # API input limit per request
+TTS_MODEL = "gpt-4o-mini-tts"
+
+# Article segments are written concurrently, a segment that fails or runs past the timeout
+# falls back to the article's summary
+SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS', '5'))
+SEGMENT_TIMEOUT_SECONDS = float(os.environ.get('SEGMENT_TIMEOUT_SECONDS', '60'))
+
+# Segments only depend on the article and plan, so they are cached in S3 and shared by every
+# episode that includes the article. Bump the version when the segment prompt changes.
+SEGMENT_PROMPT_VERSION = 1
+
+# Errors worth retrying, anything else fails the line straight away
+TTS_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+summary_model = logic.providers.text_model('gemini-2.0-flash') # $0.075 /M input  $0.30 /M output tokens 
+script_model = logic.providers.text_model('gemini-2.5-flash') # $0.10 /M input $0.40 /M output tokens
 
 def summarize(title, text, use = 'summary'):
     if use == 'topic':
@@ -81,9 +110,23 @@ def clean_text_for_conversational_tts(input_text):
     return output_text
 
 
-def _create_line(client, host, line, num, chunk):
+def _tts_backoff(attempt, error):
+    """
+    Seconds to wait before retrying a TTS request, honouring Retry-After when the API sends it
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            # Spread out retries of requests that were rejected together
+            return float(response.headers.get('retry-after')) * random.uniform(1.0, 1.5)
+        except (TypeError, ValueError):
+            pass
+    return TTS_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _create_line(client, host, line, num, chunk, cache_stats=None):
     """
-    Creates an audio line for a specific host.
+    Creates an audio line for a specific host, reusing a cached clip of the same text and voice when there is one.
     
     Args:
         client: TTS client
@@ -91,6 +134,10 @@ def _create_line(client, host, line, num, chunk):
         line: Text to convert to speech
         num: Line number
         chunk: Chunk number (for long lines)
+        cache_stats: logic.tts_cache.Stats collecting the episode's cache hits
+
+    Returns:
+        The clip's MP3 bytes
     """
     if host == 1:
         # female
@@ -105,83 +152,113 @@ def _create_line(client, host, line, num, chunk):
         else:
             voice = 'onyx'
     
-    output_file = f"{TEMP_BASE}/conversation/{host}/line_{num}_{chunk}.mp3"
-    
-    # Ensure the output directory exists
-    output_dir = os.path.dirname(output_file)
-    os.makedirs(output_dir, exist_ok=True)
-    
+    engine, model = ("cartesia", "sonic-english") if cartesia else ("openai", TTS_MODEL)
+    clip = logic.tts_cache.clip_key(engine, model, voice, line)
+    audio_bytes = logic.tts_cache.fetch(clip, cache_stats)
+    if audio_bytes is not None:
+        return audio_bytes
+    
+    for attempt in range(TTS_MAX_RETRIES + 1):
+        try:
+            if cartesia:
+                audio_bytes = client.tts.bytes(
+                    model_id=model,
+                    transcript=line,
+                    voice_id=voice,
+                    language="en",
+                    output_format={
+                        "container": "wav",
+                        "sample_rate": 44100,
+                        "encoding": "pcm_s16le",
+                    },
+                )
+            else:
+                response = client.audio.speech.create(
+                    model=model,
+                    voice=voice,
+                    input=line,
+                    response_format='mp3'
+                )
+                audio_bytes = response.content
+                logic.tts_cache.store(clip, audio_bytes)
+            return audio_bytes
+
+        except TTS_RETRYABLE_ERRORS as e:
+            if attempt == TTS_MAX_RETRIES:
+                print(f"TTS for line {num} chunk {chunk} failed after {attempt + 1} attempts: {e}")
+                raise
+            delay = _tts_backoff(attempt, e)
+            print(f"TTS for line {num} chunk {chunk} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        except Exception as e:
+            print(f"An error occurred while generating TTS: {e}")
+            raise
+
+
+def synthesize_lines(client, script_turns, workers=TTS_WORKERS):
+    """
+    Runs TTS for every script turn with at most `workers` requests in flight.
+    Lines over the API limit are split into chunks that are synthesized like any other line.
+
+    Args:
+        client: TTS client, shared by all workers
+        script_turns: List of cleaned script lines, alternating hosts
+        workers: Maximum number of concurrent TTS requests
+
+    Yields:
+        (turn index, clip MP3 bytes) for every chunk in script order, each as soon as it
+        and everything before it are done
+    """
+    jobs = []
+    for index, sentence in enumerate(script_turns):
+        host = 1 if index % 2 == 0 else 2
+        for chunk_index, i in enumerate(range(0, len(sentence), TTS_MAX_CHARS)):
+            jobs.append((host, sentence[i:i + TTS_MAX_CHARS], index, chunk_index))
+
+    started = time.perf_counter()
+    cache_stats = logic.tts_cache.Stats()
+    executor = ThreadPoolExecutor(max_workers=workers)
     try:
-        if cartesia:
-            audio_bytes = client.tts.bytes(
-                model_id="sonic-english",
-                transcript=line,
-                voice_id=voice,
-                language="en",
-                output_format={
-                    "container": "wav",
-                    "sample_rate": 44100,
-                    "encoding": "pcm_s16le",
-                },
-            )
-        else:
-            response = client.audio.speech.create(
-                model="gpt-4o-mini-tts",
-                voice=voice,
-                input=line,
-                response_format='mp3'
-            )
-            response.stream_to_file(output_file)
-    
-    except Exception as e:
-        print(f"An error occurred while generating TTS: {e}")
+        futures = [executor.submit(_create_line, client, *job, cache_stats=cache_stats) for job in jobs]
+        # Results are yielded in submission order, whatever order the requests finish in
+        for (_, _, index, _), future in zip(jobs, futures):
+            yield index, future.result()
+    finally:
+        # A failed clip or a consumer that stopped early abandons the episode, the requests
+        # still queued are cancelled instead of paid for
+        executor.shutdown(cancel_futures=True)
+
+    print(f"Synthesized {len(jobs)} TTS clips with {workers} workers in {time.perf_counter() - started:.1f}s")
+    print(cache_stats.report())
 
 
-def write_to_s3(num_turns, user_id, episode_number):
+# Decoded intro music, kept across warm invocations and keyed by the S3 ETag it was decoded from
+_intro_music = {"etag": None, "audio": None}
+
+def load_intro_music():
     """
-    Writes the podcast audio to S3.
-    
-    Args:
-        num_turns: Number of conversational turns
-        user_id: User ID
-        episode_number: Episode number
+    Returns the intro music as an AudioSegment, only decoding it again when the
+    system asset changed in S3.
     """
-    # merge audio files
-    print("Merging audio files...")
-    
-    final_audio = AudioSegment.from_mp3(f"{TEMP_BASE}/conversation/1/line_0_0.mp3")
-    for i in range(1, num_turns):
-        audio = AudioSegment.from_mp3(f"{TEMP_BASE}/conversation/{1 if i % 2 == 0 else 2}/line_{i}_0.mp3")
-        final_audio = final_audio.append(audio)
-    
-    print("Audio files merged.")
-    
-    # add intro music
-    # Load the intro music from s3
-    common.s3.restore_from_system("INTRO", f"{TEMP_BASE}/intro_music.mp3")
-    
-    intro_music = AudioSegment.from_mp3(f"{TEMP_BASE}/intro_music.mp3")
-    final_audio = intro_music.append(final_audio, crossfade=2000)
-    
-    print("Intro music added.")
-    final_audio.export(f"{TEMP_BASE}/podcast.mp3", format="mp3")
-    print(f"Conversation audio file saved as {TEMP_BASE}/podcast.mp3")
-    
-    # Export the final audio
-    common.s3.save(user_id, episode_number, "PODCAST", f"{TEMP_BASE}/podcast.mp3")
-    
-    print("Audio file uploaded to S3.")
+    f_path, etag = common.s3.get_system_asset("INTRO")
+    if _intro_music["etag"] != etag:
+        _intro_music["audio"] = AudioSegment.from_mp3(f_path)
+        _intro_music["etag"] = etag
+        print("Decoded intro music")
+    return _intro_music["audio"]
 
 def update_db(user_id, episode_title, topics, episode_number, s3_url, script):
-    try:
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
-        cursor = conn.cursor()
+    """
+    Record the podcast and the user's new episode count in one transaction, on a pooled connection.
+    Database errors are raised, so the message is retried.
+    """
+    with common.db.cursor() as cursor:
         cursor.execute("""
             INSERT INTO podcasts (title, user_id, articles, episode_number, audio_file_url, script, date, completed)
             VALUES (%s, %s, %s::jsonb, %s, %s, %s::jsonb, %s, %s)
             RETURNING id
         """, (episode_title, user_id, json.dumps(topics), episode_number, s3_url, json.dumps(script), datetime.now(), False))
-        
 
         # Update user's episode count and podcast status
         cursor.execute("""
@@ -191,67 +268,24 @@ def update_db(user_id, episode_title, topics, episode_number, s3_url, script):
             WHERE id = %s
         """, (datetime.now(), user_id))
 
-        conn.commit()
-        print(f"Successfully updated podcast and user tables for user {user_id}")
-
-    except psycopg2.Error as e:
-        print(f"Database error: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    print(f"Successfully updated podcast and user tables for user {user_id}")
 
 # Main Execution
 def get_articles_from_db(article_ids):
     """
-    Retrieve articles from the database using article IDs.
+    Retrieve articles using article IDs, through the container's article cache.
     
     Args:
         article_ids: List of article IDs to retrieve
     
     Returns:
         List of article dictionaries with title, content, summary, etc.
+
+    Database errors are raised, so the message is retried rather than treated as having no articles.
     """
-    try:
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
-        cursor = conn.cursor()
-        
-        # Create placeholders for the IN clause
-        placeholders = ','.join(['%s'] * len(article_ids))
-        
-        cursor.execute(f"""
-            SELECT id, title, content, summary, topics, tags
-            FROM articles 
-            WHERE id IN ({placeholders})
-        """, article_ids)
-        
-        articles = []
-        for row in cursor.fetchall():
-            
-            articles.append({
-                'id': row[0],
-                'title': row[1],
-                'content': row[2],
-                'summary': row[3],
-                'topics': row[4],
-                'tags': row[5],
-                'url': f"https://auxiomai.com/article/{row[0]}"
-            })
-        
-        print(f"Retrieved {len(articles)} articles from database")
-        return articles
-        
-    except psycopg2.Error as e:
-        print(f"Database error retrieving articles: {e}")
-        return []
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    articles = common.articles.get_articles(article_ids)
+    print(f"Retrieved {len(articles)} articles")
+    return articles
 
 
 ### Segment writer - Creates a script segment for an individual article
@@ -318,12 +352,94 @@ def create_article_segment(article, plan='free'):
         generation_config=genai.GenerationConfig(
             max_output_tokens=tokens*2,
             temperature=0.3
-        )
+        ),
+        request_options={"timeout": SEGMENT_TIMEOUT_SECONDS}
     )
     
     return response.text
 
 
+def _segment_cache_key(article, plan):
+    content = json.dumps([
+        article['title'],
+        article.get('content', article.get('summary', '')),
+        article.get('topics', [])
+    ])
+    digest = hashlib.sha256(
+        f"{content}|{plan}|{script_model.model_name}|{SEGMENT_PROMPT_VERSION}".encode('utf-8')
+    ).hexdigest()[:40]
+    return f"segments/{article['id']}/{digest}.json"
+
+
+def cached_article_segment(article, plan='free'):
+    """
+    create_article_segment behind the per-article segment cache.
+    
+    Returns:
+        Tuple of (segment script, True if it came from the cache)
+    """
+    key = _segment_cache_key(article, plan)
+    try:
+        cached = common.s3.get_json(key)
+        if cached is not None:
+            return cached['segment'], True
+    except Exception as e:
+        print(f"Error reading segment cache {key}: {e}")
+
+    segment = create_article_segment(article, plan)
+    try:
+        common.s3.save_json(key, {'segment': segment})
+    except Exception as e:
+        print(f"Error writing segment cache {key}: {e}")
+    return segment, False
+
+
+def _summary_segment(article):
+    """
+    Stand-in segment built from the article summary, for when the segment writer fails
+    """
+    return (f"**HOST 1:** Next up, our article \"{article['title']}\".\n"
+            f"**HOST 2:** {article.get('summary') or article['title']}")
+
+
+def write_segments(articles, plan='free', workers=None):
+    """
+    Runs the segment writer for every article concurrently, reusing cached segments.
+    
+    Args:
+        articles: List of article dictionaries
+        plan: Plan passed on to create_article_segment
+        workers: Maximum number of concurrent segment writer calls, SEGMENT_WORKERS by default
+    
+    Returns:
+        List of segment scripts in article order
+    """
+    if not articles:
+        return []
+
+    workers = workers or SEGMENT_WORKERS
+    deadline = time.monotonic() + SEGMENT_TIMEOUT_SECONDS
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(articles))))
+    futures = [executor.submit(cached_article_segment, article, plan) for article in articles]
+
+    segments = []
+    cache_hits = 0
+    for i, (article, future) in enumerate(zip(articles, futures)):
+        print(f"Processing article {i+1}/{len(articles)}: {article['title']}")
+        try:
+            segment, cached = future.result(timeout=max(0, deadline - time.monotonic()))
+            segments.append(segment)
+            cache_hits += cached
+        except Exception as e:
+            print(f"Segment for article {article.get('id')} failed ({type(e).__name__}: {e}), using its summary")
+            segments.append(_summary_segment(article))
+
+    # Don't wait on calls that ran past the deadline
+    executor.shutdown(wait=False, cancel_futures=True)
+    print(f"Segment cache: {cache_hits}/{len(articles)} segments reused")
+    return segments
+
+
 ### Senior editor - Combines segments into a cohesive podcast
 def make_podcast_script(articles, plan='free'):
     """
@@ -344,16 +460,11 @@ def make_podcast_script(articles, plan='free'):
         tokens = 2000
         articles = articles[:5]
     
-    # Process each article to create segments
-    segments = []
-    for i, article in enumerate(articles):
-        print(f"Processing article {i+1}/{len(articles)}: {article['title']}")
-        
-        # Segment writer creates a script for each article
-        segment = create_article_segment(article, plan)
-        segments.append(segment)
+    # Segment writer creates a script for each article
+    started = time.perf_counter()
+    segments = write_segments(articles, plan)
     
-    print(f'Processed {len(segments)} article segments')
+    print(f'Processed {len(segments)} article segments in {time.perf_counter() - started:.1f}s')
     
     # Senior editor combines segments
     system_prompt = f"""
@@ -464,68 +575,143 @@ def handler(payload):
     print(f"Processing podcast for user {user_id}, episode {episode}")
     print(f"Article recommendations: {recommendations}")
 
+    # Completed script/TTS steps are recorded so a redelivered message doesn't repeat them
+    ledger = common.ledger.Ledger("e_nlp", f"{user_id}/{episode}")
+    if ledger.done("db"):
+        print(f"Podcast for user {user_id}, episode {episode} was already delivered")
+        return
+
     # Get articles from database using the recommendation IDs
     articles = get_articles_from_db(recommendations)
     
     if not articles:
         print("No articles found for the given recommendations")
         return
+
+    # Users with the same recommendations and plan this week share one generated episode
+    shared_episode = logic.shared_episodes.SharedEpisode(recommendations, plan)
+    shared = shared_episode.acquire(user_id)
+    if shared is not None:
+        update_db(user_id, shared["title"], shared["articles"], episode, shared["s3_url"], shared["script"])
+        ledger.mark_done("db")
+        # A retry of this user's own episode whose database write failed isn't a share
+        if shared["owner"] != user_id:
+            shared_episode.record_share(user_id)
+        print(f"Shared podcast delivered to user {user_id}, episode {episode}")
+        return
+
+    published = False
+    try:
+        # Create podcast script using the new segment writer + senior writer architecture
+        script_turns, episode_title = ledger.run("script", create_podcast_from_articles, articles, plan)
+
+        if not ledger.done("audio"):
+            synthesize_podcast(script_turns, user_id, episode)
+            ledger.mark_done("audio")
+        
+        # Get S3 URL for the saved audio
+        s3_url = common.s3.get_s3_url(user_id, episode, "PODCAST")
+        
+        # Share the episode before recording it, users waiting on the claim get it even if the
+        # database write fails and this message is retried
+        article_info = [{"title": article['title'], "description": article["summary"], "url": article['url']} for article in articles]
+        shared_episode.publish(user_id, episode_title, article_info, s3_url, script_turns)
+        published = True
+
+        # Update database with podcast information
+        update_db(user_id, episode_title, article_info, episode, s3_url, script_turns)
+        ledger.mark_done("db")
+    finally:
+        if not published:
+            # Users waiting on this episode take over the claim instead of waiting for it to go stale
+            shared_episode.release(user_id)
     
-    # Create podcast script using the new segment writer + senior writer architecture
-    script_turns, episode_title = create_podcast_from_articles(articles, plan)
-    
+    print(f"Podcast generation completed for user {user_id}, episode {episode}")
+
+
+def synthesize_podcast(script_turns, user_id, episode):
+    """
+    Runs TTS for every script turn and streams the merged episode to S3.
+
+    Clips are joined in memory as soon as they and every clip before them are done, and
+    full parts go out as a multipart upload while later lines are still being synthesized.
+    Nothing is written to /tmp, so concurrent or back to back invocations can't see each
+    other's audio.
+
+    Args:
+        script_turns: List of cleaned script lines, alternating hosts
+        user_id: User ID
+        episode: Episode number
+    """
     # Create TTS audio files
     if cartesia:
         client = Cartesia(api_key=os.environ.get('CARTESIA_API_KEY'))
     else:
-        client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-    
-    for index, sentence in enumerate(script_turns):
-        host = 1 if index % 2 == 0 else 2
-        
-        # Handle lines longer than API limit
-        if len(sentence) > 4096:
-            # Chunk into 4096 characters
-            chunks = [sentence[i:i + 4096] for i in range(0, len(sentence), 4096)]
-            
-            for chunk_index, chunk in enumerate(chunks):
-                _create_line(client, host, chunk, index, chunk_index)
-            
-            chunk_files = [f"{TEMP_BASE}/conversation/{host}/line_{index}_{i}.mp3" for i in range(len(chunks))]
-            combined_audio = AudioSegment.empty()
-            for file in chunk_files:
-                audio_segment = AudioSegment.from_mp3(file)
-                combined_audio += audio_segment
-            
-            print(f"Combined chunked audio for line {index}")
-            combined_output_file = f"{TEMP_BASE}/conversation/{host}/line_{index}_0.mp3"
-            combined_audio.export(combined_output_file, format="mp3")
-            
-            # Clean up individual chunk files
-            for file in chunk_files:
-                os.remove(file)
-        else:
-            _create_line(client, host, sentence, index, 0)
-    
-    # Save audio file to S3
-    num_turns = len(script_turns)
-    write_to_s3(num_turns, user_id, episode)
+        # Retries are handled per line by _create_line
+        client = logic.providers.tts_client()
     
-    # Get S3 URL for the saved audio
-    s3_url = common.s3.get_s3_url(user_id, episode, "PODCAST")
-    
-    # Update database with podcast information
-    article_info = [{"title": article['title'], "description": article["summary"], "url": article['url']} for article in articles]
-    update_db(user_id, episode_title, article_info, episode, s3_url, script_turns)
-    
-    print(f"Podcast generation completed for user {user_id}, episode {episode}")
+    clips = (audio_bytes for _, audio_bytes in synthesize_lines(client, script_turns))
 
+    # Merge the clips, with the intro music crossfaded into the first line, straight into S3
+    intro = load_intro_music()
+    with common.s3.open_writer(user_id, episode, "PODCAST", content_type='audio/mpeg') as out:
+        logic.audio.assemble_episode(clips, out, intro=intro, crossfade_ms=2000)
 
+    print("Audio file uploaded to S3.")
 
 
+def _benchmark_script_generation():
+    """
+    Script generation latency with a stubbed Gemini model: segment calls take ~4s, the
+    editor call ~8s, and one segment call per run fails to exercise the summary fallback.
+    Each run uses new articles so the segment cache is cold, then the last run is repeated
+    against a warm cache. Run with ASTRA_STORAGE=local to keep the cache off the bucket.
+    """
+    import threading
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+
+    class _StubModel:
+        model_name = "models/stub"
+
+        def __init__(self):
+            self.calls = 0
+            self.lock = threading.Lock()
+
+        def generate_content(self, prompt, generation_config=None, request_options=None):
+            with self.lock:
+                self.calls += 1
+                call = self.calls
+            editor = "senior editor" in prompt
+            time.sleep(random.uniform(6, 10) if editor else random.uniform(3, 5))
+            if not editor and call == 2:
+                raise RuntimeError("stub segment failure")
+            return _Response("**HOST 1:** stub line\n**HOST 2:** stub reply")
+
+    global script_model
+    run_id = int(time.time())
+    runs = [(plan, workers, [f"{run_id}-{plan}-{workers}-{i}" for i in range(5)])
+            for plan in ('pro', 'premium') for workers in (1, SEGMENT_WORKERS)]
+    runs.append(runs[-1])
+
+    for plan, workers, article_ids in runs:
+        articles = [{'id': i, 'title': f"Article {i}", 'content': "content", 'summary': "summary", 'topics': []} for i in article_ids]
+        script_model = _StubModel()
+        globals()['SEGMENT_WORKERS'] = workers
+        started = time.perf_counter()
+        make_podcast_script(articles, plan)
+        print(f"BENCHMARK plan={plan} workers={workers}: {time.perf_counter() - started:.1f}s "
+              f"for {script_model.calls} model calls")
 
 
 if __name__ == "__main__":
+    import sys
+    if "--benchmark-script" in sys.argv:
+        _benchmark_script_generation()
+        sys.exit(0)
+
     # Test the new functionality
     test_payload = {
         "user_id": "test_user",
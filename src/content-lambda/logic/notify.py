@@ -1,9 +1,6 @@
-import boto3
 import os          
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import os
 from string import Template
+import common.mailer
 
 
 def generate_html(name, keywords):
@@ -16,41 +13,7 @@ def generate_html(name, keywords):
     return template.substitute(user=name, keywords=keywords)
 
 def send_email(RECIPIENT, BODY_HTML):
-
-    # Create a multipart/mixed parent container
-    msg = MIMEMultipart('mixed')
-    msg['Subject'] = 'Your Auxiom podcast'
-    msg['From'] = "Auxiom <Auxiom@auxiomai.com>"
-    msg['To'] = RECIPIENT
-
-    # Add the HTML body to the email
-    msg_body = MIMEMultipart('alternative')
-    html_part = MIMEText(BODY_HTML, 'html', 'utf-8')
-    msg_body.attach(html_part)
-    msg.attach(msg_body)
-
-    # Send the email
-    client = boto3.client('ses',
-        region_name="us-east-1",
-        aws_access_key_id= os.environ.get('AWS_ACCESS_KEY'), # make sure these are set
-        aws_secret_access_key= os.environ.get('AWS_SECRET_KEY') # make sure these are set
-        )
-
-    try:
-        response = client.send_raw_email(
-            Source='delivery@auxiomai.com',
-            Destinations=[RECIPIENT, 'rahilv99@gmail.com'],
-            RawMessage={
-                'Data': msg.as_string(),
-            }
-        )
-        print("Email sent! Message ID:"),
-        print(response['MessageId'])
-
-    except client.exceptions.MessageRejected as e:
-        print(f"Email rejected: {e}")
-    except client.exceptions.ClientError as e:
-        print(f"Unexpected error: {e}")
+    return common.mailer.send_email(RECIPIENT, 'Your Auxiom podcast', BODY_HTML)
 
 
 # Main Execution
@@ -0,0 +1,372 @@
+"""
+LLM and TTS providers
+
+The content Lambda gets its Gemini models and TTS client from here instead of configuring
+them at import time. LLM_PROVIDER / TTS_PROVIDER pick the implementation:
+  - "gemini" / "openai" (default): the real APIs, configured on first use
+  - "fake": offline stand-ins with the same call surface, so article_publisher.handler and
+    nlp.handler can be load-tested without API keys or credits
+
+The fakes return deterministic output for a given prompt: JSON matching the requested
+response_schema, **HOST 1**/**HOST 2** turns for podcast scripts, <ul> overviews, plain
+sentences otherwise, and silent MP3s as long as the text would take to speak. Their
+latency and failures follow FAKE_LLM_LATENCY / FAKE_TTS_LATENCY and FAKE_LLM_ERROR_RATE /
+FAKE_TTS_ERROR_RATE, and FAKE_LLM_QUOTA rate limits Gemini calls above a concurrency.
+A latency is either "median[,sigma[,seconds_per_char]]" (lognormal) or "replay:<path>"
+to sample latencies recorded from the real APIs with PROVIDER_LATENCY_LOG=<path>.
+
+Every Gemini model runs under an adaptive concurrency limit shared across the container,
+so threads fanning out calls back off together when the quota is hit.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'gemini')
+TTS_PROVIDER = os.environ.get('TTS_PROVIDER', 'openai')
+
+# JSON lines of {"provider", "model", "seconds", "chars"} for every real API call, when set
+PROVIDER_LATENCY_LOG = os.environ.get('PROVIDER_LATENCY_LOG')
+
+# Gemini calls in flight per model start at GEMINI_CONCURRENCY and adapt to rate limiting:
+# every 429 halves the limit, every success raises it by 1/limit, up to GEMINI_MAX_CONCURRENCY
+GEMINI_CONCURRENCY = int(os.environ.get('GEMINI_CONCURRENCY', '8'))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '32'))
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', '5'))
+GEMINI_BACKOFF_SECONDS = float(os.environ.get('GEMINI_BACKOFF_SECONDS', '2.0'))
+
+FAKE_LLM_LATENCY = os.environ.get('FAKE_LLM_LATENCY', '2.0,0.5')
+FAKE_TTS_LATENCY = os.environ.get('FAKE_TTS_LATENCY', '0.4,0.25,0.002')
+FAKE_LLM_ERROR_RATE = float(os.environ.get('FAKE_LLM_ERROR_RATE', '0'))
+FAKE_TTS_ERROR_RATE = float(os.environ.get('FAKE_TTS_ERROR_RATE', '0'))
+# Time per generated token (~4 characters) of a fake Gemini answer, on top of FAKE_LLM_LATENCY
+FAKE_LLM_OUTPUT_TOKEN_SECONDS = float(os.environ.get('FAKE_LLM_OUTPUT_TOKEN_SECONDS', '0'))
+# Calls in flight per fake model above this get a 429 like a quota would, 0 for no quota
+FAKE_LLM_QUOTA = int(os.environ.get('FAKE_LLM_QUOTA', '0'))
+
+# Silent MPEG-2 Layer III frame, 24 kHz mono 64 kbps: 24 ms of audio in 192 bytes
+SILENT_FRAME = bytes([0xFF, 0xF3, 0x84, 0xC4]) + bytes(188)
+FRAME_SECONDS = 576 / 24000
+CHARS_PER_SECOND = 15
+
+_WORDS = ("the committee bill funding agency report federal state program policy rule court "
+          "senate house department budget public health energy education trade security "
+          "would require expand review approve announce million percent year week").split()
+
+_latency_log_lock = threading.Lock()
+
+
+def _record_latency(provider, model, seconds, chars):
+    if not PROVIDER_LATENCY_LOG:
+        return
+    with _latency_log_lock:
+        with open(PROVIDER_LATENCY_LOG, 'a') as f:
+            f.write(json.dumps({"provider": provider, "model": model, "seconds": round(seconds, 4), "chars": chars}) + "\n")
+
+
+class Latency:
+    """
+    Latency distribution of a fake provider call
+    """
+    def __init__(self, spec, provider):
+        self.samples = None
+        if spec.startswith("replay:"):
+            with open(spec[len("replay:"):]) as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            self.samples = [record["seconds"] for record in records if record["provider"] == provider]
+            if not self.samples:
+                raise ValueError(f"No {provider} latencies recorded in {spec}")
+        else:
+            values = [float(value) for value in spec.split(",")]
+            self.median, self.sigma, self.per_char = (values + [0.0, 0.0])[:3]
+
+    def sample(self, chars=0):
+        if self.samples is not None:
+            return random.choice(self.samples)
+        return (self.median + self.per_char * chars) * random.lognormvariate(0, self.sigma)
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit that shrinks on rate limiting and grows back while calls succeed
+    (additive increase, multiplicative decrease), shared by every thread calling one model
+    """
+    def __init__(self, name, initial, maximum, minimum=1):
+        self.name = name
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.last_decrease = 0.0
+        self.throttled = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                # Calls rejected together count as one signal
+                if time.monotonic() - self.last_decrease > 1.0:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = time.monotonic()
+                    print(f"{self.name} rate limited, concurrency limit now {int(self.limit)}")
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+### Gemini
+
+class _GeminiModel:
+    """
+    genai.GenerativeModel that configures the API key on its first call instead of at import
+    """
+    _configured = False
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self.model_name = f"models/{name}"
+        self._model = None
+
+    def generate_content(self, prompt, **kwargs):
+        if self._model is None:
+            with _GeminiModel._lock:
+                if not _GeminiModel._configured:
+                    genai.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
+                    _GeminiModel._configured = True
+            self._model = genai.GenerativeModel(self.name)
+
+        started = time.perf_counter()
+        response = self._model.generate_content(prompt, **kwargs)
+        _record_latency("llm", self.name, time.perf_counter() - started, len(prompt))
+        return response
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """
+    Offline stand-in for genai.GenerativeModel, the same prompt always gets the same text
+    """
+    _in_flight = Counter()
+    _in_flight_lock = threading.Lock()
+
+    def __init__(self, name, latency=None, error_rate=None, quota=None):
+        self.name = name
+        self.model_name = f"fake/{name}"
+        self.latency = latency or Latency(FAKE_LLM_LATENCY, "llm")
+        self.error_rate = FAKE_LLM_ERROR_RATE if error_rate is None else error_rate
+        self.quota = FAKE_LLM_QUOTA if quota is None else quota
+
+    def _sentences(self, rng, words):
+        sentences = []
+        while words > 0:
+            length = min(words, rng.randint(8, 20))
+            sentence = " ".join(rng.choice(_WORDS) for _ in range(length))
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            words -= length
+        return " ".join(sentences)
+
+    def _from_schema(self, rng, schema, words):
+        kind = schema.get("type")
+        if kind == "object":
+            # Titles and names are short, every other text field gets the whole length
+            return {name: self._from_schema(rng, prop, 8 if re.search("title|name", name, re.I) else words)
+                    for name, prop in schema.get("properties", {}).items()}
+        if kind == "array":
+            count = rng.randint(schema.get("min_items", 1), schema.get("max_items", 5))
+            return [self._from_schema(rng, schema.get("items", {"type": "string"}), 3) for _ in range(count)]
+        if kind in ("integer", "number"):
+            return rng.randint(1, 100)
+        if kind == "boolean":
+            return rng.random() < 0.5
+        if words <= 8:
+            return " ".join(rng.choice(_WORDS) for _ in range(words)).title()
+        # Fields that state a length in their description ("under 60 words") are plain sentences
+        limit = re.search(r"under (\d+) words", schema.get("description", ""))
+        if limit:
+            return self._sentences(rng, rng.randint(int(limit.group(1)) // 2, int(limit.group(1)) - 1))
+        # Long fields are article bodies, split into <p> paragraphs of ~60 words
+        paragraphs = [self._sentences(rng, min(60, words - i)) for i in range(0, words, 60)]
+        return "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+
+    def _text(self, rng, prompt, words):
+        if "**HOST 1**" in prompt:
+            turns = []
+            for i in range(max(2, words // 40)):
+                turns.append(f"**HOST {1 + i % 2}**: {self._sentences(rng, 40)}")
+            turns.append("**HOST 1**: Thanks for listening, stay tuned for more episodes.")
+            return "\n".join(turns)
+        if "<li>" in prompt:
+            return "<ul>\n" + "".join(f"<li>{self._sentences(rng, 15)}</li>\n" for _ in range(rng.randint(3, 5))) + "</ul>"
+        return self._sentences(rng, words)
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        rng = random.Random(hashlib.sha256(f"{self.name}\x1f{prompt}".encode('utf-8')).digest())
+        max_tokens = getattr(generation_config, 'max_output_tokens', None) or 1000
+        # ~0.75 words per token, leave room under the limit like a real answer would
+        words = max(3, int(max_tokens * 0.75 * 0.6))
+
+        schema = getattr(generation_config, 'response_schema', None)
+        if schema is not None:
+            text = json.dumps(self._from_schema(rng, schema, words))
+        else:
+            text = self._text(rng, prompt, words)
+
+        with FakeGeminiModel._in_flight_lock:
+            if self.quota and FakeGeminiModel._in_flight[self.name] >= self.quota:
+                raise google_exceptions.ResourceExhausted("Fake Gemini quota exceeded")
+            FakeGeminiModel._in_flight[self.name] += 1
+        try:
+            # Output is generated token by token on top of the latency to the first one
+            time.sleep(self.latency.sample(len(prompt)) + FAKE_LLM_OUTPUT_TOKEN_SECONDS * len(text) / 4)
+        finally:
+            with FakeGeminiModel._in_flight_lock:
+                FakeGeminiModel._in_flight[self.name] -= 1
+
+        if random.random() < self.error_rate:
+            raise random.choice([google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable])("Fake Gemini error")
+        return _FakeResponse(text)
+
+
+class _LimitedModel:
+    """
+    Runs a model's calls under its AdaptiveLimit and retries the ones that were rate limited
+    """
+    def __init__(self, model, limit):
+        self.model = model
+        self.limit = limit
+        self.model_name = model.model_name
+
+    def generate_content(self, prompt, **kwargs):
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            self.limit.acquire()
+            try:
+                response = self.model.generate_content(prompt, **kwargs)
+            except google_exceptions.ResourceExhausted:
+                self.limit.release(throttled=True)
+                if attempt == GEMINI_MAX_RETRIES:
+                    raise
+                time.sleep(GEMINI_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            except Exception:
+                self.limit.release()
+                raise
+            self.limit.release()
+            return response
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def text_model(name):
+    """
+    Model for a Gemini model name, e.g. 'gemini-2.5-flash', with generate_content like genai.GenerativeModel.
+    Models of the same name share one concurrency limit across the container.
+    """
+    with _limits_lock:
+        if name not in _limits:
+            _limits[name] = AdaptiveLimit(name, GEMINI_CONCURRENCY, GEMINI_MAX_CONCURRENCY)
+    model = FakeGeminiModel(name) if LLM_PROVIDER == 'fake' else _GeminiModel(name)
+    return _LimitedModel(model, _limits[name])
+
+
+### TTS
+
+class _FakeSpeechResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+class _ErrorResponse:
+    """
+    Just enough of an HTTP response for the openai error types
+    """
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.request = None
+
+
+class _FakeSpeech:
+    def __init__(self, latency, error_rate):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def _error(self):
+        # Imported here so only the podcast path (e_nlp) loads the OpenAI SDK
+        import openai
+
+        if random.random() < 0.5:
+            response = _ErrorResponse(429, {"retry-after": "1"})
+            return openai.RateLimitError("Fake rate limit", response=response, body=None)
+        return openai.InternalServerError("Fake server error", response=_ErrorResponse(500), body=None)
+
+    def create(self, model, voice, input, response_format='mp3', **kwargs):
+        time.sleep(self.latency.sample(len(input)))
+        if random.random() < self.error_rate:
+            raise self._error()
+        frames = max(1, round(len(input) / CHARS_PER_SECOND / FRAME_SECONDS))
+        return _FakeSpeechResponse(SILENT_FRAME * frames)
+
+
+class _Audio:
+    def __init__(self, speech):
+        self.speech = speech
+
+
+class FakeTTSClient:
+    """
+    Offline stand-in for the OpenAI client's audio.speech.create, returns silent MP3 clips
+    """
+    def __init__(self, latency=None, error_rate=None):
+        latency = latency or Latency(FAKE_TTS_LATENCY, "tts")
+        error_rate = FAKE_TTS_ERROR_RATE if error_rate is None else error_rate
+        self.audio = _Audio(_FakeSpeech(latency, error_rate))
+
+
+class _RecordedSpeech:
+    def __init__(self, speech):
+        self._speech = speech
+
+    def create(self, model, voice, input, **kwargs):
+        started = time.perf_counter()
+        response = self._speech.create(model=model, voice=voice, input=input, **kwargs)
+        _record_latency("tts", model, time.perf_counter() - started, len(input))
+        return response
+
+
+def tts_client():
+    """
+    Client for OpenAI TTS. Retries are handled per line by the caller, so the client doesn't retry.
+    """
+    if TTS_PROVIDER == 'fake':
+        return FakeTTSClient()
+    # Imported here so only the podcast path (e_nlp) loads the OpenAI SDK
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'), max_retries=0)
+    if PROVIDER_LATENCY_LOG:
+        client.audio = _Audio(_RecordedSpeech(client.audio.speech))
+    return client
@@ -1,17 +1,21 @@
-import boto3
 import os          
-import psycopg2
+import threading
+from collections import OrderedDict
 from string import Template
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import google.generativeai as genai
+import common.articles
+import common.db
+import common.mailer
+import logic.providers
 
-db_access_url = os.environ.get('DB_ACCESS_URL')
+summary_model = logic.providers.text_model('gemini-2.0-flash') # $0.075 /M input  $0.30 /M output tokens 
 
-GOOGLE_API_KEY= os.environ.get('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
 
-summary_model = genai.GenerativeModel('gemini-2.0-flash') # $0.075 /M input  $0.30 /M output tokens 
+# Users with the same recommendations get the same episode title and article list, so both are
+# rendered once per container and recommendation set. Only the name and episode number are
+# filled in per user.
+NEWSLETTER_CACHE_SIZE = int(os.environ.get('NEWSLETTER_CACHE_SIZE', '256'))
 
 
 def episode_title(article_titles):
@@ -25,145 +29,247 @@ def episode_title(article_titles):
 
 def get_articles_by_ids(article_ids):
     """
-    Retrieve articles from the database using their IDs
+    Retrieve articles using their IDs, through the container's article cache
     Returns a list of dictionaries with id, title, and summary
+    Database errors are raised, so the message is retried rather than treated as having no articles
     """
     if not article_ids:
         return []
     
-    try:
-        # Connect to PostgreSQL database
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
-        
-        cursor = conn.cursor()
-        
-        # Create placeholders for the IN clause
-        placeholders = ','.join(['%s'] * len(article_ids))
-        query = f"""
-            SELECT id, title, summary 
-            FROM articles 
-            WHERE id IN ({placeholders})
-        """
-        
-        cursor.execute(query, article_ids)
-        results = cursor.fetchall()
-        
-        # Convert to list of dictionaries
-        articles = []
-        for row in results:
-            articles.append({
-                'id': row[0],
-                'title': row[1],
-                'summary': row[2]
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return articles
-        
-    except Exception as e:
-        print(f"Error retrieving articles from database: {e}")
-        return []
+    return [{'id': article['id'], 'title': article['title'], 'summary': article['summary']}
+            for article in common.articles.get_articles(article_ids)]
 
 def update_user_delivered(user_id, episode):
+    """
+    Stamp the user's delivery on a pooled connection. Errors are only logged, the newsletter
+    is already sent and a retry would send it again.
+    """
     try:
-        conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE users
-            SET delivered = NOW(), episode = %s
-            WHERE id = %s
-        """, (episode + 1, user_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with common.db.cursor() as cursor:
+            cursor.execute("""
+                UPDATE users
+                SET delivered = NOW(), episode = %s
+                WHERE id = %s
+            """, (episode + 1, user_id))
     except Exception as e:
         print(f"Error last sent data for {user_id}: {e}")
 
+class CompiledTemplate:
+    """
+    A string.Template split once into literal text and placeholder names, so rendering is a join
+    """
+    def __init__(self, parts):
+        # Literal text at even indexes, placeholder names at odd indexes
+        self.parts = parts
+
+    @classmethod
+    def from_text(cls, text):
+        parts = ['']
+        last = 0
+        for match in Template.pattern.finditer(text):
+            parts[-1] += text[last:match.start()]
+            last = match.end()
+            if match.group('escaped') is not None:
+                parts[-1] += '$'
+                continue
+            name = match.group('named') or match.group('braced')
+            if name is None:
+                raise ValueError(f"Invalid placeholder in template at position {match.start()}")
+            parts += [name, '']
+        parts[-1] += text[last:]
+        return cls(parts)
+
+    def bind(self, **values):
+        """
+        :return: A template with the given placeholders filled in and the rest left open.
+        """
+        parts = ['']
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                parts[-1] += part
+            elif part in values:
+                parts[-1] += str(values[part])
+            else:
+                parts += [part, '']
+        return CompiledTemplate(parts)
+
+    def render(self, **values):
+        """
+        :return: The text with every placeholder filled in, KeyError when one has no value.
+        """
+        return ''.join(part if i % 2 == 0 else str(values[part]) for i, part in enumerate(self.parts))
+
+
+# Templates are read and compiled once per container
+_templates = {}
+
+def _template(name):
+    if name not in _templates:
+        with open(os.path.join(TEMPLATE_DIR, name), 'r') as file:
+            _templates[name] = CompiledTemplate.from_text(file.read())
+    return _templates[name]
+
+
+def _articles_html(articles):
+    articles_template = _template('article.html')
+    return ''.join(
+        articles_template.render(
+            title=article['title'], 
+            description=article['summary'], 
+            url=f"https://auxiomai.com/article/{article['id']}"
+        )
+        for article in articles
+    )
+
+
 def generate_html(episode_title, articles, episode, name):
-    # Load the HTML template
-    def _load_template(file_path):
-        with open(file_path, 'r') as file:
-            return Template(file.read())
-
-    # Generate articles list as HTML
-    def _generate_articles_html(articles):
-        articles_html = ''
-        for article in articles:
-            articles_template = _load_template('logic/templates/article.html')
-            url = f"https://auxiomai.com/article/{article['id']}"
-            articles_html += articles_template.substitute(
-                title=article['title'], 
-                description=article['summary'], 
-                url=url
-            )
-        return articles_html
-
-    template = _load_template('logic/templates/index.html')
-    articles_html = _generate_articles_html(articles)
-    return template.substitute(episode_title=episode_title, episode_number=episode, articles=articles_html, user=name)
+    body = _template('index.html').bind(episode_title=episode_title, articles=_articles_html(articles))
+    return body.render(episode_number=episode, user=name)
+
+
+# sorted recommendation ids -> {'title', 'body'}, most recently used last
+_newsletters = OrderedDict()
+_newsletters_lock = threading.Lock()
+
+
+def newsletter(recommendations):
+    """
+    Episode title and pre-rendered body of the newsletter for a recommendation set, generated
+    on the first request for the set and served from the container's render cache after that.
+    :param recommendations: Article IDs recommended to the user.
+    :return: Dictionary with 'title' and 'body', a CompiledTemplate still open for episode_number
+             and user. None if none of the articles were found.
+    """
+    key = tuple(sorted(recommendations))
+    with _newsletters_lock:
+        if key in _newsletters:
+            _newsletters.move_to_end(key)
+            return _newsletters[key]
+
+    # Get articles from database using the recommendation IDs
+    articles = get_articles_by_ids(recommendations)
+    if not articles:
+        return None
+
+    title = episode_title([article['title'] for article in articles])
+    entry = {
+        'title': title,
+        'body': _template('index.html').bind(episode_title=title, articles=_articles_html(articles)),
+    }
+
+    # A set with missing articles (not published yet) is rendered again for the next user
+    if len(articles) == len(set(recommendations)):
+        with _newsletters_lock:
+            _newsletters[key] = entry
+            while len(_newsletters) > NEWSLETTER_CACHE_SIZE:
+                _newsletters.popitem(last=False)
+    return entry
 
 
 def send_email(RECIPIENT, SUBJECT, BODY_HTML):
+    return common.mailer.send_email(RECIPIENT, SUBJECT, BODY_HTML)
 
-    # Create a multipart/mixed parent container
-    msg = MIMEMultipart('mixed')
-    msg['Subject'] = SUBJECT
-    msg['From'] = "Auxiom <Auxiom@auxiomai.com>"
-    msg['To'] = RECIPIENT
-
-    # Add the HTML body to the email
-    msg_body = MIMEMultipart('alternative')
-    html_part = MIMEText(BODY_HTML, 'html', 'utf-8')
-    msg_body.attach(html_part)
-    msg.attach(msg_body)
-
-    # Send the email
-    client = boto3.client('ses',
-        region_name="us-east-1",
-        aws_access_key_id= os.environ.get('AWS_ACCESS_KEY'), # make sure these are set
-        aws_secret_access_key= os.environ.get('AWS_SECRET_KEY') # make sure these are set
-        )
 
-    try:
-        response = client.send_raw_email(
-            Source='delivery@auxiomai.com',
-            Destinations=[RECIPIENT, 'rahilv99@gmail.com'],
-            RawMessage={
-                'Data': msg.as_string(),
-            }
-        )
-        print("Email sent! Message ID:"),
-        print(response['MessageId'])
+def _prepare(payload):
+    """
+    :return: (newsletter, first name) for a user's payload.
+    :raises ValueError: None of the recommended articles were found, the message is retried
+                        in case they were being written.
+    """
+    name = payload.get("user_name")
+    recommendations = payload.get("recommendations", [])
 
-    except client.exceptions.MessageRejected as e:
-        print(f"Email rejected: {e}")
-    except client.exceptions.ClientError as e:
-        print(f"Unexpected error: {e}")
+    # Title and articles of the recommendation set, shared with every user who got the same set
+    content = newsletter(recommendations)
+    if content is None:
+        raise ValueError(f"No articles found for user {payload.get('user_id')} recommendations {recommendations}")
+
+    if len(name.split()) > 1:
+        name = name.split()[0]
+    return content, name
 
 
 # Main Execution
 def handler(payload):
     user_id = payload.get("user_id")
     user_email = payload.get("user_email")
-    name = payload.get("user_name")
     episode = payload.get("episode")
-    recommendations = payload.get("recommendations", [])
 
-    # Get articles from database using the recommendation IDs
-    articles = get_articles_by_ids(recommendations)
+    content, name = _prepare(payload)
 
-    if len(name.split()) > 1:
-        name = name.split()[0]
+    html = content['body'].render(episode_number=episode, user=name)
 
-    ep_title = episode_title([article['title'] for article in articles])
+    if send_email(user_email, content['title'], html) is None:
+        # Rejected by SES, sending it again would be rejected too
+        print(f"Newsletter to user {user_id} failed: rejected by SES, not retried")
+        return
 
-    html = generate_html(ep_title, articles, episode, name)
+    update_user_delivered(user_id, episode)
 
-    send_email(user_email, ep_title, html)
 
-    update_user_delivered(user_id, episode)
+def batch_handler(payloads):
+    """
+    Send the newsletters of a batch of users at once through a common.mailer.BulkSender.
+    Users who got the same recommendation set share one templated bulk send when there are
+    at least SES_TEMPLATED_MIN_RECIPIENTS of them (and it is turned on).
+
+    Returns:
+        Indexes of the payloads to retry. Newsletters SES rejected (MessageRejected) are
+        permanent failures, they are logged and not retried.
+    """
+    failed = []
+    # id of the shared newsletter -> [(index, payload, name)]
+    groups = {}
+    newsletters = {}
+    for i, payload in enumerate(payloads):
+        try:
+            content, name = _prepare(payload)
+        except Exception as e:
+            print(f"Error preparing newsletter for user {payload.get('user_id')}: {e}")
+            failed.append(i)
+            continue
+        newsletters[id(content)] = content
+        groups.setdefault(id(content), []).append((i, payload, name))
+
+    sends = []
+    with common.mailer.BulkSender() as sender:
+        for key, members in groups.items():
+            content = newsletters[key]
+            minimum = common.mailer.SES_TEMPLATED_MIN_RECIPIENTS
+            if minimum and len(members) >= minimum and '{{' not in content['body'].render(episode_number='', user=''):
+                # SES fills in the user and episode number of every recipient
+                html = content['body'].render(episode_number='{{episode_number}}', user='{{user}}')
+                futures = sender.send_templated(content['title'], html, [
+                    (payload.get("user_email"), {'user': name, 'episode_number': str(payload.get("episode"))})
+                    for _, payload, name in members
+                ])
+            else:
+                futures = [sender.send(payload.get("user_email"), content['title'],
+                                       content['body'].render(episode_number=payload.get("episode"), user=name))
+                           for _, payload, name in members]
+            sends += [(i, payload, future) for (i, payload, _), future in zip(members, futures)]
+
+    rejected = 0
+    for i, payload, future in sends:
+        try:
+            message_id = future.result()
+        except Exception as e:
+            # Throttled (SendThrottled) or a transient SES error, the message is retried
+            print(f"Error sending newsletter to user {payload.get('user_id')}: {e}")
+            failed.append(i)
+            continue
+        if message_id is None:
+            # Rejected by SES, sending it again would be rejected too
+            print(f"Newsletter to user {payload.get('user_id')} failed: rejected by SES, not retried")
+            rejected += 1
+            continue
+        update_user_delivered(payload.get("user_id"), payload.get("episode"))
+
+    if rejected:
+        print(f"{rejected}/{len(sends)} newsletters rejected by SES")
+
+    print(common.articles.stats.report())
+    return sorted(failed)
 
 if __name__ == "__main__":
     # Test payload with article recommendations
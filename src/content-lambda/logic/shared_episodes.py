@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import common.s3
+
+# Paid users with the same recommendations and plan in the same week get the same episode.
+# The first user to claim the episode key generates it; everyone else gets a podcasts row
+# pointing at the shared audio and script instead of paying for the LLM and TTS calls again.
+#
+#   episodes/{week}/{key}/episode.json        claim, then the finished episode
+#   episodes/{week}/{key}/shared/{user}.json  one marker per user the episode was shared with
+#
+# Entries are expired by the bucket's lifecycle rule on the episodes/ prefix.
+
+# How long a user waits for an episode someone else is generating. A user still waiting on a
+# live claim after that fails with EpisodePending, and the message is retried later.
+WAIT_SECONDS = int(os.environ.get('SHARED_EPISODE_WAIT_SECONDS', str(6 * 60)))
+POLL_SECONDS = 10
+
+# The owner rewrites its claim this often while it generates the episode
+HEARTBEAT_SECONDS = 60
+# A claim without a heartbeat for this long belongs to a generation that died, the next user
+# takes it over. Claims whose generation failed are marked failed and taken over right away.
+STALE_CLAIM_SECONDS = 5 * 60
+
+
+class EpisodePending(Exception):
+    """
+    Another user is still generating the episode
+    """
+
+
+def current_week():
+    year, week, _ = datetime.now(timezone.utc).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def episode_key(recommendations, plan):
+    ids = ",".join(str(article_id) for article_id in sorted(recommendations))
+    return hashlib.sha256(f"{ids}|{plan}".encode('utf-8')).hexdigest()[:40]
+
+
+class SharedEpisode:
+    """
+    Episode cache entry for (sorted recommendation ids, plan, week)
+    """
+
+    def __init__(self, recommendations, plan, week=None):
+        self.week = week or current_week()
+        self.prefix = f"episodes/{self.week}/{episode_key(recommendations, plan)}"
+        self.path = f"{self.prefix}/episode.json"
+        # Set once this user holds the claim
+        self.claimed = False
+        self._stop_heartbeat = None
+
+    def _claim(self, user_id):
+        claim = {"status": "pending", "owner": user_id, "claimed_at": time.time(), "heartbeat_at": time.time()}
+        if common.s3.storage.create_bytes(self.path, json.dumps(claim).encode('utf-8'), content_type='application/json'):
+            self.claimed = True
+        return self.claimed
+
+    def _take_over(self, user_id, etag):
+        # Conditional on the version we read, so of two users taking over only one wins
+        claim = {"status": "pending", "owner": user_id, "claimed_at": time.time(), "heartbeat_at": time.time()}
+        if common.s3.replace_json(self.path, claim, etag):
+            self.claimed = True
+        return self.claimed
+
+    def _heartbeat(self, user_id, stop):
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                entry, etag = common.s3.get_json_versioned(self.path)
+                if entry is None or entry["status"] != "pending" or entry["owner"] != user_id:
+                    return
+                common.s3.replace_json(self.path, dict(entry, heartbeat_at=time.time()), etag)
+            except Exception as e:
+                # A few missed beats are fine, waiters only take over after STALE_CLAIM_SECONDS
+                print(f"Error refreshing claim on {self.path}: {e}")
+
+    def _start_heartbeat(self, user_id):
+        self._stop_heartbeat = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(user_id, self._stop_heartbeat), daemon=True).start()
+
+    def _end_heartbeat(self):
+        if self._stop_heartbeat is not None:
+            self._stop_heartbeat.set()
+            self._stop_heartbeat = None
+
+    @staticmethod
+    def _stale(entry, unchanged_since):
+        # Either the owner's own heartbeat is old, or the claim hasn't changed for as long while
+        # we watched it (which doesn't depend on the two Lambdas' clocks agreeing)
+        heartbeat_at = entry.get("heartbeat_at", entry["claimed_at"])
+        return (time.time() - heartbeat_at > STALE_CLAIM_SECONDS
+                or time.monotonic() - unchanged_since > STALE_CLAIM_SECONDS)
+
+    def acquire(self, user_id):
+        """
+        Claim the episode or wait for whoever claimed it first. The claim is kept alive by a
+        heartbeat until publish or release.
+        :return: The finished episode to reuse, or None if this user should generate it.
+        :raises EpisodePending: If the episode's owner is still generating it after WAIT_SECONDS.
+        """
+        self.claimed = False
+        try:
+            deadline = time.monotonic() + WAIT_SECONDS
+            seen_etag, unchanged_since = None, time.monotonic()
+            while True:
+                if self._claim(user_id):
+                    print(f"Claimed shared episode {self.path}")
+                    break
+
+                entry, etag = common.s3.get_json_versioned(self.path)
+                if entry is not None:
+                    if entry["status"] == "ready":
+                        print(f"Reusing shared episode {self.path} generated for user {entry['owner']}")
+                        return entry
+                    if etag != seen_etag:
+                        seen_etag, unchanged_since = etag, time.monotonic()
+                    # Our own claim from an earlier delivery of this message, a claim whose
+                    # generation failed, or one whose generation died
+                    if entry["owner"] == user_id or entry["status"] == "failed" or self._stale(entry, unchanged_since):
+                        if self._take_over(user_id, etag):
+                            print(f"Took over {entry['status']} claim on {self.path} from user {entry['owner']}")
+                            break
+                        # Someone else took it over first, wait on them instead
+                        continue
+
+                if time.monotonic() > deadline:
+                    raise EpisodePending(f"{self.path} is still being generated for user {entry and entry['owner']}")
+
+                time.sleep(POLL_SECONDS)
+        except EpisodePending:
+            raise
+        except Exception as e:
+            # Sharing is an optimization, fall back to generating the episode
+            print(f"Error checking shared episode {self.path}: {e}")
+            return None
+
+        self._start_heartbeat(user_id)
+        return None
+
+    def publish(self, user_id, episode_title, article_info, s3_url, script):
+        """
+        Replace the claim with the finished episode. Errors are raised, users waiting on the
+        claim would otherwise wait it out.
+        """
+        self._end_heartbeat()
+        common.s3.save_json(self.path, {
+            "status": "ready",
+            "owner": user_id,
+            "title": episode_title,
+            "articles": article_info,
+            "s3_url": s3_url,
+            "script": script,
+        })
+
+    def release(self, user_id):
+        """
+        Mark this user's claim failed, so users waiting on it take it over instead of waiting it out
+        """
+        self._end_heartbeat()
+        if not self.claimed:
+            return
+        try:
+            entry, etag = common.s3.get_json_versioned(self.path)
+            if entry is not None and entry["status"] == "pending" and entry["owner"] == user_id:
+                common.s3.replace_json(self.path, {"status": "failed", "owner": user_id, "claimed_at": entry["claimed_at"]}, etag)
+                print(f"Released claim on {self.path}")
+        except Exception as e:
+            print(f"Error releasing claim on {self.path}: {e}")
+
+    def record_share(self, user_id):
+        try:
+            common.s3.save_json(f"{self.prefix}/shared/{user_id}.json", {"date": datetime.now(timezone.utc).date().isoformat()})
+        except Exception as e:
+            print(f"Error recording share of {self.path}: {e}")
+
+
+def sharing_report(week=None):
+    """
+    Generations avoided by episode sharing, per delivery day (one cron run per day)
+    """
+    week = week or current_week()
+    keys = common.s3.storage.list_keys(f"episodes/{week}/")
+    generated = sum(1 for key in keys if key.endswith("/episode.json"))
+    avoided = Counter(common.s3.get_json(key)["date"] for key in keys if "/shared/" in key)
+
+    print(f"Episode sharing for {week}: {generated} episodes generated, {sum(avoided.values())} generations avoided")
+    for day, count in sorted(avoided.items()):
+        print(f"  {day}: {count} avoided")
+    return avoided
+
+
+if __name__ == "__main__":
+    # python -m logic.shared_episodes [week, e.g. 2025-W32]
+    import sys
+    sharing_report(sys.argv[1] if len(sys.argv) > 1 else None)
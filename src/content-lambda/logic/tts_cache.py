@@ -0,0 +1,158 @@
+"""
+Content-addressed cache for TTS clips
+
+Lines like the closing "Thanks for listening, stay tuned for more episodes." come back in
+every episode, so clips are cached by hash(engine, model, voice, normalized text):
+  - /tmp tier: survives warm invocations, bounded by TTS_CACHE_TMP_MB with LRU eviction
+  - S3 tier (tts-cache/ prefix): shared by all containers. Hits refresh a clip's last
+    modified time and the bucket's lifecycle rule expires clips that go unused, so the
+    tier evicts least recently used clips.
+"""
+
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import common.s3
+
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', '/tmp/tts-cache')
+TTS_CACHE_TMP_MB = int(os.environ.get('TTS_CACHE_TMP_MB', '256'))
+S3_PREFIX = "tts-cache"
+
+# Refresh a clip's last modified time on a hit at most this often, well inside the lifecycle expiration
+S3_REFRESH_AFTER = timedelta(days=7)
+
+
+def clip_key(engine, model, voice, text):
+    """
+    Cache key of a clip. Whitespace and unicode normalization don't change the speech,
+    casing and punctuation do, so they are kept.
+    """
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.sha256("\x1f".join([engine, model, voice, normalized]).encode('utf-8')).hexdigest()
+
+
+class _TmpTier:
+    """
+    Size bounded LRU of clip files in /tmp
+    """
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+
+        os.makedirs(root, exist_ok=True)
+        # A warm container may already have clips from earlier invocations
+        files = [entry for entry in os.scandir(root) if entry.name.endswith(".mp3")]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name[:-4]] = entry.stat().st_size
+            self.total_bytes += entry.stat().st_size
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.mp3")
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        size = len(data)
+        # Write then rename so concurrent invocations never read a partial clip
+        part_path = f"{self._path(key)}.{threading.get_ident()}.part"
+        with open(part_path, 'wb') as f:
+            f.write(data)
+        os.replace(part_path, self._path(key))
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted, evicted_size = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                try:
+                    os.remove(self._path(evicted))
+                except FileNotFoundError:
+                    pass
+
+
+_tmp_tier = None
+_tmp_tier_lock = threading.Lock()
+
+
+def _tmp():
+    global _tmp_tier
+    with _tmp_tier_lock:
+        if _tmp_tier is None:
+            _tmp_tier = _TmpTier(TTS_CACHE_DIR, TTS_CACHE_TMP_MB * 1024 * 1024)
+        return _tmp_tier
+
+
+class Stats:
+    """
+    Hit counts for one episode, shared by the TTS worker threads
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"tmp": 0, "s3": 0, "miss": 0}
+
+    def record(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def report(self):
+        total = sum(self.counts.values())
+        hits = total - self.counts["miss"]
+        rate = hits / total * 100 if total else 0
+        return f"TTS cache: {hits}/{total} clips hit ({rate:.0f}%, tmp {self.counts['tmp']}, s3 {self.counts['s3']})"
+
+
+def fetch(key, stats=None):
+    """
+    Look up a cached clip.
+    :return: The clip's bytes on a hit in either tier, None on a miss.
+    """
+    outcome = "miss"
+    data = _tmp().get(key)
+    if data is not None:
+        outcome = "tmp"
+    else:
+        s3_key = f"{S3_PREFIX}/{key}.mp3"
+        try:
+            data, last_modified = common.s3.storage.get_object(s3_key)
+            _tmp().put(key, data)
+            outcome = "s3"
+
+            if datetime.now(timezone.utc) - last_modified > S3_REFRESH_AFTER:
+                common.s3.storage.touch(s3_key, content_type='audio/mpeg')
+        except common.s3.NotFound:
+            pass
+        except Exception as e:
+            print(f"Error reading TTS cache {s3_key}: {e}")
+
+    if stats is not None:
+        stats.record(outcome)
+    return data
+
+
+def store(key, data):
+    """
+    Add a freshly synthesized clip to both tiers. Failures only cost a future cache miss.
+    """
+    try:
+        _tmp().put(key, data)
+        common.s3.storage.put_bytes(f"{S3_PREFIX}/{key}.mp3", data, content_type='audio/mpeg')
+    except Exception as e:
+        print(f"Error writing TTS cache for {key}: {e}")
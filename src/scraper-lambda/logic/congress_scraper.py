@@ -3,6 +3,7 @@ import requests
 import logging
 import json
 import datetime
+import hashlib
 import boto3
 
 from logic.article_resource import ArticleResource
@@ -143,67 +144,96 @@ class Congress(ArticleResource):
             return None
     
     
+def bill_content_hash(bill):
+    """
+    Hash of the fields that go into a bill's embedding (title + latest action text).
+    Must stay in sync with the text encoded by the clusterer's bill_embeddings module.
+    """
+    bill_text = f"{bill['title']} {bill.get('latest_action_text') or ''}"
+    return hashlib.sha256(bill_text.encode('utf-8')).hexdigest()
+
+
 def save_to_database(bills):
     """
-    Save congress bills to PostgreSQL database without embeddings.
-    Clears existing bills first to ensure fresh data with correct URLs.
-    Embeddings will be generated later by the clusterer stack.
+    Upsert congress bills into PostgreSQL.
+    Metadata (url, latest action, etc.) is always refreshed, but the embedding is only
+    reset to NULL (pending) when the hash of the embedded fields changes, so the
+    clusterer only re-embeds bills that actually moved.
     
     Args:
         bills: List of bill dictionaries
+
+    Returns:
+        Number of bills left pending an embedding by this upsert
     """
     import psycopg2
+    import psycopg2.extras
     
     db_access_url = os.environ.get('DB_ACCESS_URL')
     if not db_access_url:
         raise ValueError("DB_ACCESS_URL environment variable not set")
+
+    # ON CONFLICT can't touch the same row twice in one statement, so keep the last copy of each bill
+    unique_bills = {}
+    for bill in bills:
+        if not bill.get('bill_id'):
+            print(f"Skipping bill without identifier: {bill.get('title', 'unknown')}")
+            continue
+        unique_bills[bill['bill_id']] = bill
+
+    if not unique_bills:
+        print("No bills to save")
+        return 0
+
+    rows = [
+        (
+            bill['bill_id'],
+            bill['title'],
+            bill.get('url'),
+            bill.get('latest_action_date'),
+            bill.get('latest_action_text'),
+            bill.get('congress'),
+            bill.get('bill_type'),
+            bill.get('bill_number'),
+            bill_content_hash(bill)
+        )
+        for bill in unique_bills.values()
+    ]
     
+    conn = None
+    cursor = None
     try:
         conn = psycopg2.connect(dsn=db_access_url, client_encoding='utf8')
         cursor = conn.cursor()
         
-        # Clear existing congress bills to ensure fresh data with correct URLs
-        cursor.execute("DELETE FROM congress_bills")
-        deleted_count = cursor.rowcount
-        conn.commit()  # COMMIT THE DELETE IMMEDIATELY
-        print(f"Cleared {deleted_count} existing congress bills from database")
-        
-        saved_count = 0
-        
-        # Process all bills
-        for bill in bills:
-            try:
-                # Create a placeholder embedding (will be updated by clusterer)
-                placeholder_embedding = f"[{','.join(['0'] * 384)}]"
-                
-                # Insert bill into database without real embedding
-                cursor.execute("""
-                    INSERT INTO congress_bills (
-                        bill_id, title, url, latest_action_date, latest_action_text,
-                        congress, bill_type, bill_number, embedding
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (bill_id) DO NOTHING
-                """, (
-                    bill['bill_id'],
-                    bill['title'],
-                    bill.get('url'),
-                    bill.get('latest_action_date'),
-                    bill.get('latest_action_text'),
-                    bill.get('congress'),
-                    bill.get('bill_type'),
-                    bill.get('bill_number'),
-                    placeholder_embedding
-                ))
-                
-                saved_count += 1
-                
-            except Exception as e:
-                print(f"Error saving bill {bill.get('bill_id', 'unknown')}: {e}")
-                continue
+        results = psycopg2.extras.execute_values(cursor, """
+            INSERT INTO congress_bills (
+                bill_id, title, url, latest_action_date, latest_action_text,
+                congress, bill_type, bill_number, content_hash
+            ) VALUES %s
+            ON CONFLICT (bill_id) DO UPDATE SET
+                title = EXCLUDED.title,
+                url = EXCLUDED.url,
+                latest_action_date = EXCLUDED.latest_action_date,
+                latest_action_text = EXCLUDED.latest_action_text,
+                congress = EXCLUDED.congress,
+                bill_type = EXCLUDED.bill_type,
+                bill_number = EXCLUDED.bill_number,
+                content_hash = EXCLUDED.content_hash,
+                embedding = CASE
+                    WHEN congress_bills.content_hash IS DISTINCT FROM EXCLUDED.content_hash THEN NULL
+                    ELSE congress_bills.embedding
+                END
+            RETURNING (xmax = 0) AS inserted, embedding IS NULL AS pending
+        """, rows, page_size=500, fetch=True)
         
         conn.commit()
-        print(f"Successfully saved {saved_count} new bills to database")
-        print("Note: Embeddings will be generated by the clusterer stack")
+
+        inserted_count = sum(1 for inserted, _ in results if inserted)
+        pending_count = sum(1 for _, pending in results if pending)
+        print(f"Upserted {len(results)} bills ({inserted_count} new, {len(results) - inserted_count} existing)")
+        print(f"{pending_count} bills need embeddings from the clusterer stack")
+        return pending_count
         
     except psycopg2.Error as e:
         print(f"Database error: {e}")
@@ -237,14 +267,16 @@ def handler(payload):
         
         # Save bills to PostgreSQL database
         print(f"Saving congress bills to PostgreSQL database")
-        save_to_database(bills)
-        
+        pending_count = save_to_database(bills)
+
         # Send message to clusterer queue to generate embeddings
         try:
             sqs = boto3.client('sqs')
             clusterer_queue_url = os.environ.get('CLUSTERER_QUEUE_URL')
-            
-            if clusterer_queue_url:
+
+            if pending_count == 0:
+                print("No bill text changed, skipping embedding generation")
+            elif clusterer_queue_url:
                 embed_message = {
                     "action": "e_embed_bills",
                     "payload": {}
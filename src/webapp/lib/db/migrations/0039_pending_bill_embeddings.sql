@@ -0,0 +1,3 @@
+ALTER TABLE "congress_bills" ALTER COLUMN "embedding" DROP NOT NULL;--> statement-breakpoint
+UPDATE "congress_bills" SET "embedding" = NULL WHERE "embedding" = array_fill(0, ARRAY[384])::vector;--> statement-breakpoint
+CREATE INDEX "congress_bills_pending_embedding_idx" ON "congress_bills" USING btree ("id") WHERE "congress_bills"."embedding" IS NULL;
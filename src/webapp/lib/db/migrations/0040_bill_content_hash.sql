@@ -0,0 +1,2 @@
+ALTER TABLE "congress_bills" ADD COLUMN "content_hash" varchar(64);--> statement-breakpoint
+UPDATE "congress_bills" SET "content_hash" = encode(sha256(convert_to("title" || ' ' || coalesce("latest_action_text", ''), 'UTF8')), 'hex');
@@ -1,4 +1,5 @@
-import { pgTable, serial, text, varchar, jsonb, integer, boolean, timestamp, vector, real } from 'drizzle-orm/pg-core';
+import { sql } from 'drizzle-orm';
+import { pgTable, serial, text, varchar, jsonb, integer, boolean, timestamp, vector, real, index } from 'drizzle-orm/pg-core';
 
 // Define the user table schema
 const DEFAULT_EMBEDDING = Array(384).fill(0);
@@ -73,11 +74,15 @@ export const congressBills = pgTable('congress_bills', {
   congress: integer('congress'),
   billType: varchar('bill_type', { length: 20 }),
   billNumber: integer('bill_number'),
-  embedding: vector('embedding', { dimensions: 384 }).notNull(),
+  embedding: vector('embedding', { dimensions: 384 }), // NULL until generated by the clusterer
+  contentHash: varchar('content_hash', { length: 64 }), // sha256 of the embedded text (title + latest action)
 
   // keyword: varchar('keyword', { length: 255 }), // The user interest that matched
   // similarityScore: real('similarity_score'),
-});
+}, (table) => ({
+  // Partial index so the clusterer can find bills still waiting for an embedding
+  pendingEmbeddingIdx: index('congress_bills_pending_embedding_idx').on(table.id).where(sql`${table.embedding} IS NULL`),
+}));
 
 export type User = typeof users.$inferSelect;
 export type NewUser = typeof users.$inferInsert;
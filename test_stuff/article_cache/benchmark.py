@@ -0,0 +1,124 @@
+"""
+Article Cache Benchmark
+
+Database round trips and article text transferred during one cron burst: every user gets an
+e_email and paid users an e_nlp, all recommending articles from the week's few dozen, spread
+over the content Lambda's concurrent containers (each with its own caches).
+
+  no cache  - common.articles with no room, every lookup queries all of its ids, as ses.py and
+              nlp.py did (ses.py without the content column, counted that way here)
+  cache     - common.articles read-through cache, only missing ids are queried
+  TTL 0     - as cache, every lookup revalidates its cached articles against `date`
+
+ses.py's newsletter render cache is on in every mode, e_email only looks articles up for a
+recommendation set its container hasn't rendered yet. The database is an in-memory stand-in
+behind common.db.cursor.
+
+    python test_stuff/article_cache/benchmark.py [--users 2000] [--containers 10]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+from contextlib import contextmanager
+
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["FAKE_LLM_LATENCY"] = "0,0"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import common.articles
+import common.db
+import logic.nlp as nlp
+import logic.ses as ses
+
+
+class _Database:
+    """
+    articles table behind common.db.cursor, counting queries and content characters returned
+    """
+    def __init__(self, articles):
+        self.articles = articles
+        self.queries = 0
+        self.content_chars = 0
+        self.select_content = True
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, params):
+        self.queries += 1
+        self.rows = []
+        for article_id, known_date in zip(*params):
+            article = self.articles.get(article_id)
+            if article is None:
+                continue
+            changed = article["date"] != known_date
+            self.rows.append((article_id, article["date"], changed) + tuple(
+                article[column] if changed else None for column in ("title", "content", "summary", "topics", "tags")))
+            if changed and self.select_content:
+                self.content_chars += len(article["content"])
+
+    def fetchall(self):
+        return self.rows
+
+
+def _burst(users, containers, paid, pool, seed=11):
+    """
+    The e_email and e_nlp article lookups of one cron run, per container
+    """
+    rng = random.Random(seed)
+    weekly = rng.sample(list(pool), 40)
+    sets = [rng.sample(weekly, 5) for _ in range(120)]
+    messages = []
+    for user_id in range(users):
+        recommendations = rng.choice(sets)
+        messages.append(("e_email", recommendations))
+        if rng.random() < paid:
+            messages.append(("e_nlp", recommendations))
+    rng.shuffle(messages)
+    return [messages[i::containers] for i in range(containers)]
+
+
+def benchmark(users, containers, paid):
+    rng = random.Random(2)
+    date = datetime.datetime(2026, 10, 19, 6, 0)
+    pool = {article_id: {"title": f"Article {article_id}", "content": "<p>" + "policy text " * 600 + "</p>",
+                         "summary": "Summary.", "topics": ["Health"], "tags": [], "date": date}
+            for article_id in range(1, 301)}
+    bursts = _burst(users, containers, paid, pool)
+    lookups = sum(len(messages) for messages in bursts)
+    size, ttl = common.articles.ARTICLE_CACHE_SIZE, common.articles.ARTICLE_CACHE_TTL_SECONDS
+
+    print(f"{users} users ({paid:.0%} paid), {containers} containers, {lookups} messages")
+    print(f"{'mode':<10} {'queries':>8} {'content MB':>11} {'queries saved':>14}")
+    baseline = None
+    for label, cache_size, cache_ttl in (("no cache", 0, ttl), ("cache", size, ttl), ("TTL 0", size, 0)):
+        db = _Database(pool)
+        common.db.cursor = db.cursor
+        common.articles.ARTICLE_CACHE_SIZE, common.articles.ARTICLE_CACHE_TTL_SECONDS = cache_size, cache_ttl
+
+        for messages in bursts:
+            # A fresh container
+            common.articles._articles.clear()
+            ses._newsletters.clear()
+            for action, recommendations in messages:
+                db.select_content = cache_size > 0 or action == "e_nlp"
+                if action == "e_email":
+                    ses.newsletter(recommendations)
+                else:
+                    nlp.get_articles_from_db(recommendations)
+
+        baseline = db.queries if baseline is None else baseline
+        print(f"{label:<10} {db.queries:>8} {db.content_chars / 1e6:>11.1f} {baseline - db.queries:>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Article cache benchmark")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--containers", type=int, default=10)
+    parser.add_argument("--paid", type=float, default=0.3)
+    args = parser.parse_args()
+    benchmark(args.users, args.containers, args.paid)
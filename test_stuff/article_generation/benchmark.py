@@ -0,0 +1,92 @@
+"""
+Article Generation Benchmark
+
+Per-cluster latency, Gemini calls and tokens of writing the article, overview and newsletter
+blurb after research, with the fake Gemini provider:
+  three calls - article, then overview and blurb calls that send the article back
+  single call - Overview and Blurb fields in the article's JSON schema
+
+Latency is modelled with FAKE_LLM_LATENCY (time to first token) plus
+FAKE_LLM_OUTPUT_TOKEN_SECONDS per generated token, roughly gemini-2.x-flash.
+
+    python test_stuff/article_generation/benchmark.py
+"""
+
+import os
+import random
+import sys
+import time
+
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.6,0.2")
+os.environ.setdefault("FAKE_LLM_OUTPUT_TOKEN_SECONDS", "0.004")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import logic.article_publisher as article_publisher
+import logic.compression
+
+CLUSTERS = 6
+
+_WORDS = "the agency will expand grants for rural hospitals and publish annual reports on program outcomes".split()
+
+
+def _research_notes(rng):
+    def _notes():
+        return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(250, 400)))
+
+    return {
+        'primary_doc': {'title': " ".join(rng.choice(_WORDS) for _ in range(8)), 'url': "", 'notes': _notes()},
+        'secondary_docs': [{'title': " ".join(rng.choice(_WORDS) for _ in range(8)), 'url': "", 'notes': _notes()}
+                           for _ in range(rng.randint(0, 2))],
+        'news_articles': [],
+    }
+
+
+class _Meter:
+    """
+    Wraps a model to count its calls and estimated input/output tokens
+    """
+    def __init__(self, model):
+        self.model = model
+        self.model_name = model.model_name
+        self.calls = self.input_tokens = self.output_tokens = 0
+
+    def generate_content(self, prompt, **kwargs):
+        response = self.model.generate_content(prompt, **kwargs)
+        self.calls += 1
+        self.input_tokens += logic.compression.estimate_tokens(prompt)
+        self.output_tokens += logic.compression.estimate_tokens(response.text)
+        return response
+
+
+def _article_steps(research_notes):
+    # Steps 3 and 4 of process_single_cluster
+    article = article_publisher.create_cluster_article(research_notes)
+    return article.get('summary') or article_publisher.generate_summary(article['title'], article['content'])
+
+
+def benchmark():
+    models = (article_publisher.summary_model, article_publisher.article_model)
+    print(f"{'mode':<12} {'latency/cluster':>16} {'calls':>6} {'input tokens':>13} {'output tokens':>14}")
+
+    for label, single_call in (("three calls", False), ("single call", True)):
+        article_publisher.SINGLE_CALL_ARTICLE = single_call
+        meters = [_Meter(model) for model in models]
+        article_publisher.summary_model, article_publisher.article_model = meters
+
+        rng = random.Random(7)
+        started = time.perf_counter()
+        for _ in range(CLUSTERS):
+            _article_steps(_research_notes(rng))
+        elapsed = (time.perf_counter() - started) / CLUSTERS
+
+        calls = sum(meter.calls for meter in meters) / CLUSTERS
+        input_tokens = sum(meter.input_tokens for meter in meters) // CLUSTERS
+        output_tokens = sum(meter.output_tokens for meter in meters) // CLUSTERS
+        print(f"{label:<12} {elapsed:>15.2f}s {calls:>6.1f} {input_tokens:>13} {output_tokens:>14}")
+
+    article_publisher.summary_model, article_publisher.article_model = models
+
+
+if __name__ == "__main__":
+    benchmark()
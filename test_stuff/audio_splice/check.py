@@ -0,0 +1,126 @@
+"""
+Audio Splice Check
+
+assemble_episode re-encodes the frames under the intro crossfade and copies the rest of
+the first clip after them. A copied frame can start its audio data in the bit reservoir of
+the frames before it (main_data_begin), so if those were replaced by the re-encoded lead-in
+the decoder reads the wrong bytes and the splice glitches.
+
+  splice point - _splice_point only stops the lead-in at a frame with main_data_begin 0
+  decode       - an episode joined from LAME-encoded clips (which use the bit reservoir)
+                 decodes to the same samples as the clips on their own after every splice
+
+The decode part needs ffmpeg on the PATH and is skipped without it.
+
+    python test_stuff/audio_splice/check.py
+"""
+
+import array
+import io
+import math
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import logic.audio as audio
+
+# MPEG-2 Layer III, 24 kHz mono, 64 kbps, no CRC: 192 byte frames, side information from byte 4
+_HEADER = bytes([0xFF, 0xF3, 0x84, 0xC4])
+
+
+def _frame(main_data_begin):
+    return _HEADER + bytes([main_data_begin]) + bytes(187)
+
+
+def check_splice_point():
+    frames = [_frame(begin) for begin in (0, 40, 80, 0, 60, 30, 0, 10)]
+    assert [audio._main_data_begin(frame) for frame in frames] == [0, 40, 80, 0, 60, 30, 0, 10]
+
+    assert audio._splice_point(frames, 1) == 3
+    assert audio._splice_point(frames, 3) == 3
+    assert audio._splice_point(frames, 4) == 6
+    # No self-contained frame left, the whole clip is re-encoded
+    assert audio._splice_point(frames, 7) == 8
+    assert audio._splice_point(frames, 20) == 8
+
+    # MPEG-1 (9 bits), with and without the CRC after the header
+    assert audio._main_data_begin(bytes([0xFF, 0xFB, 0x90, 0x64, 0b10110011, 0b10000000]) + bytes(10)) == 0b101100111
+    assert audio._main_data_begin(bytes([0xFF, 0xFA, 0x90, 0x64, 0xAB, 0xCD, 0b00000001, 0b00000000]) + bytes(10)) == 0b000000010
+    print("splice point: ok")
+
+
+def _clip(seconds, pitch):
+    from pydub import AudioSegment
+    from pydub.generators import Sine, WhiteNoise
+
+    tone = Sine(pitch).to_audio_segment(duration=seconds * 1000, volume=-12)
+    tone = tone.overlay(WhiteNoise().to_audio_segment(duration=seconds * 1000, volume=-20))
+    # Alternating loud and quiet stretches make LAME fill and drain the bit reservoir
+    speech = AudioSegment.empty()
+    for start in range(0, seconds * 1000, 250):
+        part = tone[start:start + 250]
+        speech += part if (start // 250) % 2 else part - 30
+    encoded = io.BytesIO()
+    speech.set_frame_rate(24000).set_channels(1).export(encoded, format="mp3", bitrate="64k")
+    return encoded.getvalue()
+
+
+def _decode(frames):
+    """
+    16 bit samples of bare frames, one 576 sample granule per MPEG-2 frame
+    """
+    result = subprocess.run(["ffmpeg", "-v", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-"],
+                            input=b"".join(bytes(frame) for frame in frames), capture_output=True, check=True)
+    return array.array("h", result.stdout)
+
+
+def _rms(a, b):
+    return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)) / max(len(a), 1))
+
+
+def check_decode():
+    if not shutil.which("ffmpeg"):
+        print("decode: ffmpeg not found, skipped")
+        return
+
+    from pydub.generators import Sine
+
+    clips = [_clip(6, 220), _clip(4, 330), _clip(5, 260)]
+    intro = Sine(440).to_audio_segment(duration=3000, volume=-10).set_frame_rate(24000).set_channels(1)
+
+    _, _, _, frames = audio.mp3_frames(clips[0])
+    assert any(audio._main_data_begin(frame) for frame in frames), "the test clip doesn't use the bit reservoir"
+
+    out = io.BytesIO()
+    audio.assemble_episode(clips, out, intro=intro, crossfade_ms=2000)
+    _, _, _, episode_frames = audio.mp3_frames(out.getvalue())
+    episode = _decode(episode_frames)
+    position = {bytes(frame): i for i, frame in enumerate(episode_frames)}
+
+    # Wherever a clip's frames are copied into the episode, the decoded audio from there on has
+    # to match the clip decoded on its own. The first copied frame only differs by the overlap
+    # with the granule before it, the frames after it not at all. A frame reading the wrong
+    # bit reservoir decodes to noise and throws the next few frames off too.
+    granule = 576
+    for number, clip in enumerate(clips, 1):
+        _, _, _, clip_frames = audio.mp3_frames(clip)
+        first = next((i for i, frame in enumerate(clip_frames) if bytes(frame) in position), None)
+        if first is None:
+            # The whole clip went into the re-encoded lead-in
+            continue
+        offset = position[bytes(clip_frames[first])]
+        original = _decode(clip_frames)
+        for step in range(min(8, len(clip_frames) - first)):
+            error = _rms(episode[(offset + step) * granule:(offset + step + 1) * granule],
+                         original[(first + step) * granule:(first + step + 1) * granule])
+            limit = 1000 if step == 0 else 50 if step == 1 else 2
+            assert error <= limit, f"clip {number} glitches {step} frames after the splice at frame {first} (rms {error:.0f})"
+    print(f"decode: ok ({len(episode_frames)} frames)")
+
+
+if __name__ == "__main__":
+    check_splice_point()
+    check_decode()
@@ -0,0 +1,150 @@
+"""
+Cluster Metadata Benchmark
+
+Database round trips, transactions and wall time of loading and writing back one e_publish
+chunk, per cluster (one key query, S3 fetch and UPDATE transaction for each cluster, as
+process_single_cluster used to) against article_publisher's batched get_cluster_metadata
+and update_db.
+
+The database is a stand-in cursor that sleeps DB_RTT per statement and per commit, S3 is
+local storage behind a stand-in that sleeps S3_LATENCY per object.
+
+    python test_stuff/cluster_metadata/benchmark.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+WORKDIR = tempfile.mkdtemp(prefix="metadata-benchmark-")
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["ASTRA_STORAGE"] = "local"
+os.environ["ASTRA_LOCAL_STORAGE_DIR"] = WORKDIR
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import pandas as pd
+
+import common.db
+import common.s3
+import logic.article_publisher as article_publisher
+
+CLUSTERS = 10
+DB_RTT = 0.02
+S3_LATENCY = 0.08
+
+
+class _Database:
+    """
+    articles table behind common.db.cursor, counting statements and commits
+    """
+    def __init__(self, keys):
+        self.keys = keys
+        self.lock = threading.Lock()
+        self.statements = self.commits = 0
+        # Connections of the pool, checked out one at a time like common.db
+        self.available = threading.BoundedSemaphore(common.db.DB_POOL_SIZE)
+
+    @contextmanager
+    def cursor(self):
+        with self.available:
+            yield _Cursor(self)
+            time.sleep(DB_RTT)
+            with self.lock:
+                self.commits += 1
+
+
+class _Cursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.connection = self
+        self.encoding = "UTF8"
+
+    def execute(self, query, params=None):
+        time.sleep(DB_RTT)
+        with self.db.lock:
+            self.db.statements += 1
+        if isinstance(query, bytes):
+            # execute_values sends the rendered statement
+            return
+        if query.startswith("SELECT id, key"):
+            self.rows = [(cluster_id, self.db.keys[cluster_id]) for cluster_id in params[0]]
+        elif query.startswith("SELECT key"):
+            self.rows = [(self.db.keys[params[0]],)]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def mogrify(self, template, args):
+        return repr(args).encode("utf-8")
+
+
+class _SlowStorage:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_bytes(self, key):
+        time.sleep(S3_LATENCY)
+        return self.storage.get_bytes(key)
+
+
+def _per_cluster(cluster_ids, articles):
+    # One cluster at a time in each of PUBLISH_WORKERS threads, as before batching
+    def _load_and_write(cluster_id):
+        with common.db.cursor() as cursor:
+            cursor.execute("SELECT key FROM articles WHERE id = %s", (cluster_id,))
+            cluster_key = cursor.fetchone()[0]
+        documents = pd.DataFrame.from_records(common.s3.get_metadata(cluster_key))
+        with common.db.cursor() as cursor:
+            cursor.execute("UPDATE articles SET ... WHERE id = %s", (cluster_id,))
+        return len(documents)
+
+    with ThreadPoolExecutor(max_workers=article_publisher.PUBLISH_WORKERS) as executor:
+        return sum(executor.map(_load_and_write, cluster_ids))
+
+
+def _batched(cluster_ids, articles):
+    metadata = article_publisher.get_cluster_metadata(cluster_ids)
+    article_publisher.update_db(articles)
+    return sum(len(documents) for documents in metadata.values())
+
+
+def benchmark():
+    keys = {}
+    for cluster_id in range(1, CLUSTERS + 1):
+        keys[cluster_id] = f"clusters/{cluster_id}.msgpack"
+        documents = [{"source": "congress", "type": "primary", "title": f"Bill {cluster_id}", "text": "text " * 5000,
+                      "url": f"https://example.gov/{cluster_id}", "keyword": "Health"}]
+        documents += [{"source": "news", "type": "news", "title": f"News {i}", "text": "text " * 500,
+                       "url": f"https://example.com/{cluster_id}/{i}", "keyword": "Health"} for i in range(5)]
+        common.s3.save_metadata(documents, keys[cluster_id])
+    common.s3.storage = _SlowStorage(common.s3.storage)
+
+    cluster_ids = list(keys)
+    articles = [{"cluster_id": cluster_id, "title": "Title", "content": "<p>Content</p>", "summary": "Summary",
+                 "people": [], "time": 3, "topics": ["Health"], "tags": [], "sources": []} for cluster_id in cluster_ids]
+
+    print(f"{CLUSTERS} clusters, DB round trip {DB_RTT * 1000:.0f}ms, S3 GET {S3_LATENCY * 1000:.0f}ms")
+    print(f"{'mode':<12} {'time':>7} {'statements':>11} {'transactions':>13} {'documents':>10}")
+    for label, fn in (("per cluster", _per_cluster), ("batched", _batched)):
+        db = _Database(keys)
+        common.db.cursor = db.cursor
+        started = time.perf_counter()
+        documents = fn(cluster_ids, articles)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<12} {elapsed:>6.2f}s {db.statements:>11} {db.commits:>13} {documents:>10}")
+
+
+if __name__ == "__main__":
+    try:
+        benchmark()
+    finally:
+        shutil.rmtree(WORKDIR)
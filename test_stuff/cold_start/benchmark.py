@@ -0,0 +1,100 @@
+"""
+Cold Start Benchmark
+
+Import time and peak RSS of the content Lambda's handler modules in a fresh interpreter,
+with and without pandas (which article_publisher imported until cluster documents became
+logic.cluster_documents records), and the per-cluster cost of the document handling that
+used DataFrames.
+
+    python test_stuff/cold_start/benchmark.py
+"""
+
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+CONTENT_LAMBDA = os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda")
+RUNS = 7
+
+_IMPORT = """
+import json, resource, sys, time
+started = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "pandas": "pandas" in sys.modules}}))
+"""
+
+_HANDLER_MODULES = "import logic.article_publisher, logic.nlp, logic.ses"
+
+
+def _cold_import(imports):
+    results = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, "-W", "ignore", "-c", _IMPORT.format(imports=imports)],
+                                cwd=CONTENT_LAMBDA, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return (statistics.median(result["seconds"] for result in results),
+            statistics.median(result["rss_mb"] for result in results),
+            results[0]["pandas"])
+
+
+def _records(rng):
+    records = [{"source": "congress", "type": "primary", "title": "Primary", "text": "text " * 5000,
+                "url": "https://example.gov/0", "keyword": "Health"}]
+    records += [{"source": "federal register", "type": "secondary", "title": f"Secondary {i}", "text": "text " * 2000,
+                 "url": f"https://example.gov/{i}", "keyword": "Energy"} for i in range(1, rng.randint(2, 4))]
+    records += [{"source": "news", "type": "news", "title": f"News {i}", "text": "text " * 500,
+                 "url": f"https://example.com/{i}", "keyword": "Health", "similarity": 0.5} for i in range(rng.randint(2, 6))]
+    return records
+
+
+def _dataframe_path(records):
+    import pandas as pd
+    cluster_df = pd.DataFrame.from_records(records)
+    queries = [str(title) for title in cluster_df['title']]
+    primary = cluster_df[cluster_df['type'] == 'primary'].iloc[0]
+    secondary = [doc for _, doc in cluster_df[cluster_df['type'] == 'secondary'].iterrows()]
+    news = [(row['title'], row['url']) for _, row in cluster_df[cluster_df['type'] == 'news'].iterrows()]
+    topics = cluster_df['keyword'].unique().tolist()
+    sources = [(row['type'], row['url'], row['source'], row['title']) for _, row in cluster_df.iterrows()]
+    return queries, primary['title'], len(secondary), news, topics, sources
+
+
+def _records_path(records):
+    import logic.cluster_documents as cluster_documents
+    documents = cluster_documents.from_records(records)
+    queries = [str(doc.title) for doc in documents]
+    primary = cluster_documents.of_type(documents, 'primary')[0]
+    secondary = cluster_documents.of_type(documents, 'secondary')
+    news = [(doc.title, doc.url) for doc in cluster_documents.of_type(documents, 'news')]
+    topics = cluster_documents.keywords(documents)
+    sources = [(doc.type, doc.url, doc.source, doc.title) for doc in documents]
+    return queries, primary.title, len(secondary), news, topics, sources
+
+
+def benchmark():
+    print(f"Cold import of the handler modules, median of {RUNS} fresh interpreters")
+    for label, imports in (("with pandas", f"import pandas\n{_HANDLER_MODULES}"), ("without", _HANDLER_MODULES)):
+        seconds, rss_mb, pandas_loaded = _cold_import(imports)
+        print(f"  {label:<12} {seconds * 1000:7.0f} ms  peak RSS {rss_mb:6.1f} MB  (pandas loaded: {pandas_loaded})")
+
+    sys.path.insert(0, CONTENT_LAMBDA)
+    rng = random.Random(0)
+    clusters = [_records(rng) for _ in range(200)]
+    assert [_dataframe_path(records)[2:] for records in clusters] == [_records_path(records)[2:] for records in clusters]
+
+    print(f"\nDocument handling per cluster, {len(clusters)} clusters")
+    for label, fn in (("DataFrame", _dataframe_path), ("records", _records_path)):
+        started = time.perf_counter()
+        for records in clusters:
+            fn(records)
+        print(f"  {label:<12} {(time.perf_counter() - started) / len(clusters) * 1000:7.3f} ms")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,106 @@
+"""
+Newsletter Render Benchmark
+
+Gemini calls and render time per thousand e_email invocations, for the per-user path (episode
+title call and templates read from disk for every user) against ses.py's render cache keyed
+by the recommendation set. Users draw their recommendations from a fixed number of distinct
+sets, the way the recommender hands the same top clusters to users with similar interests.
+
+The database, SES and Gemini are stand-ins: articles come from memory, emails are dropped and
+the fake Gemini provider answers with FAKE_LLM_LATENCY.
+
+    python test_stuff/newsletter_render/benchmark.py [--emails 1000] [--sets 40]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from string import Template
+
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.02,0.1")
+CONTENT_LAMBDA = os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda")
+sys.path.insert(0, CONTENT_LAMBDA)
+
+import logic.ses as ses
+
+_WORDS = "senate passes bill to expand rural broadband grants and tighten port security rules".split()
+
+
+class _Meter:
+    """
+    Wraps the title model to count its calls and the time spent in them
+    """
+    def __init__(self, model):
+        self.model = model
+        self.model_name = model.model_name
+        self.calls = 0
+        self.seconds = 0.0
+
+    def generate_content(self, prompt, **kwargs):
+        started = time.perf_counter()
+        response = self.model.generate_content(prompt, **kwargs)
+        self.calls += 1
+        self.seconds += time.perf_counter() - started
+        return response
+
+
+def _per_user_handler(payload):
+    # ses.handler before the render cache: a title call and template reads for every user
+    def _load_template(file_path):
+        with open(file_path, 'r') as file:
+            return Template(file.read())
+
+    articles = ses.get_articles_by_ids(payload["recommendations"])
+    name = payload["user_name"].split()[0]
+    ep_title = ses.episode_title([article['title'] for article in articles])
+
+    articles_html = ''
+    for article in articles:
+        articles_template = _load_template(os.path.join(ses.TEMPLATE_DIR, 'article.html'))
+        articles_html += articles_template.substitute(title=article['title'], description=article['summary'],
+                                                      url=f"https://auxiomai.com/article/{article['id']}")
+    html = _load_template(os.path.join(ses.TEMPLATE_DIR, 'index.html')).substitute(
+        episode_title=ep_title, episode_number=payload["episode"], articles=articles_html, user=name)
+
+    ses.send_email(payload["user_email"], ep_title, html)
+
+
+def benchmark(emails, sets):
+    rng = random.Random(3)
+    articles = {article_id: {"id": article_id, "title": " ".join(rng.choice(_WORDS) for _ in range(9)),
+                             "summary": " ".join(rng.choice(_WORDS) for _ in range(45))}
+                for article_id in range(1, 201)}
+    recommendation_sets = [rng.sample(list(articles), 5) for _ in range(sets)]
+    payloads = [{"user_id": i, "user_email": f"user{i}@example.com", "user_name": "Test User", "episode": "4",
+                 "recommendations": rng.sample(rng.choice(recommendation_sets), 5)} for i in range(emails)]
+
+    ses.get_articles_by_ids = lambda ids: [articles[article_id] for article_id in ids if article_id in articles]
+    ses.send_email = lambda recipient, subject, body: None
+    ses.update_user_delivered = lambda user_id, episode: None
+
+    model = ses.summary_model
+    print(f"{emails} emails, {sets} distinct recommendation sets, LLM latency {os.environ['FAKE_LLM_LATENCY']}")
+    print(f"{'mode':<10} {'total':>8} {'Gemini calls/1k':>16} {'render/1k':>10}")
+    for label, fn in (("per user", _per_user_handler), ("cached", ses.handler)):
+        meter = _Meter(model)
+        ses.summary_model = meter
+        started = time.perf_counter()
+        for payload in payloads:
+            fn(payload)
+        total = time.perf_counter() - started
+
+        # The database and SES are in memory, so everything outside the title calls is rendering
+        render = (total - meter.seconds) * 1000 / emails
+        print(f"{label:<10} {total:>7.2f}s {meter.calls * 1000 / emails:>16.0f} {render * 1000:>8.1f}ms")
+    ses.summary_model = model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Newsletter render benchmark")
+    parser.add_argument("--emails", type=int, default=1000)
+    parser.add_argument("--sets", type=int, default=40)
+    args = parser.parse_args()
+    benchmark(args.emails, args.sets)
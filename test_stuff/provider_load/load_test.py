@@ -0,0 +1,241 @@
+"""
+Offline Load Test
+
+Runs article_publisher.handler and nlp.handler end to end with the fake Gemini and TTS
+providers (logic/providers.py), local storage in a temporary directory, and the database
+functions replaced by in-memory tables. Reports per-invocation latency so changes to the
+content Lambda's concurrency can be compared on a laptop.
+
+    python test_stuff/provider_load/load_test.py --clusters 20 --podcasts 10 --concurrency 4
+
+Time one e_publish chunk of 10 clusters with clusters and research calls run one at a time
+against the concurrent defaults, under a fake Gemini quota of 8 calls in flight per model:
+    FAKE_LLM_QUOTA=8 python test_stuff/provider_load/load_test.py --chunk 10
+
+Publish 10 clusters a day for 3 days, where 60% of each day's clusters are anchored by
+documents already researched on an earlier day (the research notes cache's case):
+    python test_stuff/provider_load/load_test.py --days 3 --clusters 10
+
+Latency and error distributions are the providers' own settings, e.g.
+    FAKE_LLM_LATENCY=1.5,0.4 FAKE_TTS_ERROR_RATE=0.05 python test_stuff/provider_load/load_test.py
+    FAKE_LLM_LATENCY=replay:latencies.jsonl python test_stuff/provider_load/load_test.py
+where latencies.jsonl was recorded from the real APIs with PROVIDER_LATENCY_LOG=latencies.jsonl.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKDIR = tempfile.mkdtemp(prefix="load-test-")
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["TTS_PROVIDER"] = "fake"
+os.environ["ASTRA_STORAGE"] = "local"
+os.environ["ASTRA_LOCAL_STORAGE_DIR"] = os.path.join(WORKDIR, "bucket")
+os.environ["TTS_CACHE_DIR"] = os.path.join(WORKDIR, "tts-cache")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.5,0.3")
+os.environ.setdefault("FAKE_TTS_LATENCY", "0.1,0.25,0.0005")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import common.s3
+import logic.article_publisher as article_publisher
+import logic.nlp as nlp
+import logic.providers
+import logic.shared_episodes
+
+_WORDS = "the agency announced a rule that would expand funding for rural clinics and broadband programs".split()
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+class _Database:
+    """
+    In-memory articles and podcasts tables behind the handlers' database functions
+    """
+    def __init__(self, clusters, seed=0):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.clusters = {}
+        self.articles = {}
+        self.podcasts = []
+        for cluster_id in range(1, clusters + 1):
+            docs = [{"source": "congress", "type": "primary", "title": _text(rng, 8), "text": _text(rng, 8000),
+                     "url": f"https://example.gov/{cluster_id}/0", "keyword": "Health"}]
+            docs += [{"source": "federal register", "type": "secondary", "title": _text(rng, 8), "text": _text(rng, 4000),
+                      "url": f"https://example.gov/{cluster_id}/{i}", "keyword": "Energy"} for i in range(1, rng.randint(1, 3))]
+            docs += [{"source": "news", "type": "news", "title": _text(rng, 8), "text": _text(rng, 600),
+                      "url": f"https://example.com/{cluster_id}/{i}", "keyword": "Health"} for i in range(rng.randint(0, 3))]
+            self.clusters[cluster_id] = docs
+
+    def next_day(self, clusters, repeat=0.6, seed=0):
+        """
+        Add `clusters` new clusters, `repeat` of them built on the documents of existing ones
+        :return: The new cluster ids
+        """
+        rng = random.Random(seed)
+        earlier = list(self.clusters)
+        new_ids = []
+        for i in range(clusters):
+            cluster_id = max(self.clusters) + 1
+            if i < clusters * repeat:
+                self.clusters[cluster_id] = [dict(doc) for doc in self.clusters[rng.choice(earlier)]]
+            else:
+                self.clusters[cluster_id] = _Database(1, seed=rng.random()).clusters[1]
+            new_ids.append(cluster_id)
+        return new_ids
+
+    def get_cluster_metadata(self, cluster_ids):
+        return {cluster_id: [dict(doc) for doc in self.clusters[cluster_id]] for cluster_id in cluster_ids}
+
+    def update_articles(self, articles):
+        with self.lock:
+            for article in articles:
+                cluster_id = article["cluster_id"]
+                self.articles[cluster_id] = {"id": cluster_id, "title": article["title"], "content": article["content"],
+                                             "summary": article["summary"], "topics": article["topics"], "tags": article["tags"],
+                                             "url": f"https://auxiomai.com/article/{cluster_id}"}
+        return True
+
+    def get_articles(self, article_ids):
+        with self.lock:
+            return [dict(self.articles[article_id]) for article_id in article_ids if article_id in self.articles]
+
+    def insert_podcast(self, user_id, episode_title, topics, episode_number, s3_url, script):
+        with self.lock:
+            self.podcasts.append((user_id, episode_number))
+        return True
+
+
+def _run(label, fn, payloads, concurrency):
+    latencies = []
+    failures = 0
+
+    def _timed(payload):
+        started = time.perf_counter()
+        fn(payload)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(_timed, payload) for payload in payloads]:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                failures += 1
+                print(f"{label} invocation failed: {e}")
+    elapsed = time.perf_counter() - started
+
+    if latencies:
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        summary = f"p50 {statistics.median(ordered):6.2f}s  p95 {p95:6.2f}s  max {ordered[-1]:6.2f}s"
+    else:
+        summary = "no successful invocations"
+    return f"{label:<18} {len(payloads):>4} invocations in {elapsed:7.2f}s  {summary}  ({failures} failed)"
+
+
+def _chunk(db, size):
+    """
+    One article_publisher.handler invocation over `size` clusters, serial and then concurrent
+    """
+    payload = {"clusters": list(db.clusters)[:size]}
+    defaults = (article_publisher.PUBLISH_WORKERS, article_publisher.RESEARCH_WORKERS)
+    results = []
+    for label, (publish_workers, research_workers) in (("serial", (1, 1)), ("concurrent", defaults)):
+        article_publisher.PUBLISH_WORKERS, article_publisher.RESEARCH_WORKERS = publish_workers, research_workers
+        db.articles.clear()
+        # Every run starts over, the ledger would otherwise skip the clusters already published
+        shutil.rmtree(os.path.join(os.environ["ASTRA_LOCAL_STORAGE_DIR"], "ledger"), ignore_errors=True)
+        throttled = sum(limit.throttled for limit in logic.providers._limits.values())
+
+        started = time.perf_counter()
+        article_publisher.handler(payload)
+        elapsed = time.perf_counter() - started
+
+        throttled = sum(limit.throttled for limit in logic.providers._limits.values()) - throttled
+        results.append(f"{label:<11} {elapsed:7.2f}s  {len(db.articles)}/{size} published  "
+                       f"{throttled} calls rate limited (PUBLISH_WORKERS={publish_workers}, RESEARCH_WORKERS={research_workers})")
+    return results
+
+
+def _days(db, days, clusters):
+    """
+    One publishing run per day, each with `clusters` clusters
+    """
+    cluster_ids = list(db.clusters)[:clusters]
+    for day in range(1, days + 1):
+        if day > 1:
+            cluster_ids = db.next_day(clusters, seed=day)
+        print(f"\nDay {day}")
+        article_publisher.handler({"clusters": cluster_ids})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the content Lambda handlers")
+    parser.add_argument("--clusters", type=int, default=10, help="article_publisher invocations, one cluster each")
+    parser.add_argument("--podcasts", type=int, default=5, help="nlp invocations, one user each")
+    parser.add_argument("--concurrency", type=int, default=4, help="invocations running at once")
+    parser.add_argument("--chunk", type=int, help="time one e_publish chunk of this many clusters instead")
+    parser.add_argument("--days", type=int, help="publishing runs of --clusters clusters on this many days instead")
+    args = parser.parse_args()
+
+    db = _Database(max(args.clusters, args.chunk or 0))
+    article_publisher.get_cluster_metadata = db.get_cluster_metadata
+    article_publisher.update_db = db.update_articles
+    nlp.get_articles_from_db = db.get_articles
+    nlp.update_db = db.insert_podcast
+    # Users with the same recommendations wait on one generation, check on it more often than the Lambda does
+    logic.shared_episodes.POLL_SECONDS = 0.1
+
+    # The intro crossfade needs ffmpeg/ffprobe, skip it where they aren't installed
+    if shutil.which("ffprobe") and shutil.which("ffmpeg"):
+        common.s3.storage.put_bytes(common.s3.SYSTEM_ASSETS["INTRO"], logic.providers.SILENT_FRAME * 400)
+    else:
+        print("ffprobe not found, episodes are assembled without the intro music")
+        nlp.load_intro_music = lambda: None
+
+    if args.days:
+        _days(db, args.days, args.clusters)
+        return
+
+    if args.chunk:
+        print(f"LLM latency {logic.providers.FAKE_LLM_LATENCY}, quota {logic.providers.FAKE_LLM_QUOTA or 'none'}")
+        results = _chunk(db, args.chunk)
+        print()
+        for line in results:
+            print(line)
+        return
+
+    rng = random.Random(1)
+    cluster_ids = list(db.clusters)
+    publish_payloads = [{"clusters": [cluster_id]} for cluster_id in cluster_ids]
+    podcast_payloads = [{"user_id": user_id, "plan": rng.choice(["pro", "premium"]), "episode": 1,
+                         "recommendations": rng.sample(cluster_ids, min(5, len(cluster_ids)))}
+                        for user_id in range(1, args.podcasts + 1)]
+
+    print(f"LLM latency {logic.providers.FAKE_LLM_LATENCY} (error rate {logic.providers.FAKE_LLM_ERROR_RATE}), "
+          f"TTS latency {logic.providers.FAKE_TTS_LATENCY} (error rate {logic.providers.FAKE_TTS_ERROR_RATE})")
+    results = [
+        _run("article_publisher", article_publisher.handler, publish_payloads, args.concurrency),
+        _run("nlp", nlp.handler, podcast_payloads, args.concurrency),
+    ]
+
+    print()
+    for line in results:
+        print(line)
+    print(f"{len(db.articles)}/{args.clusters} articles published, {len(db.podcasts)}/{args.podcasts} podcasts delivered")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(WORKDIR)
@@ -0,0 +1,95 @@
+"""
+Publish Failure Check
+
+An e_publish chunk whose database write fails has to come back from the dispatcher as a
+batch item failure, so SQS redelivers it instead of dropping the researched articles. The
+redelivery then writes the chunk without repeating any Gemini step, from the ledger.
+
+Runs service_dispatcher.handler on a synthetic SQS record with the fake Gemini provider,
+local storage in a temporary directory and the database functions replaced by stand-ins.
+
+    python test_stuff/publish_failures/check.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix="publish-failures-")
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["ASTRA_STORAGE"] = "local"
+os.environ["ASTRA_LOCAL_STORAGE_DIR"] = WORKDIR
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.01,0.1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import psycopg2
+
+import logic.article_publisher as article_publisher
+import service_dispatcher
+
+CLUSTERS = [1, 2, 3]
+
+
+def _documents(cluster_id):
+    return [
+        {"source": "congress", "type": "primary", "title": f"Bill {cluster_id}", "url": f"https://example.gov/{cluster_id}",
+         "text": "The bill would expand funding for rural clinics and broadband programs. " * 40, "keyword": "Health"},
+        {"source": "news", "type": "news", "title": f"Coverage of bill {cluster_id}", "url": f"https://example.com/{cluster_id}",
+         "text": "Lawmakers debated the funding bill on Tuesday. " * 10, "keyword": "Health"},
+    ]
+
+
+def _event():
+    body = {"action": "e_publish", "payload": {"clusters": CLUSTERS}}
+    return {"Records": [{"messageId": "publish-1", "eventSource": "aws:sqs", "body": json.dumps(body),
+                         "eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:contentSQSQueue"}]}
+
+
+def main():
+    written = {}
+    articles_written = []
+
+    def _failing_update_db(articles):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def _update_db(articles):
+        articles_written.extend(articles)
+        for article in articles:
+            written[article["cluster_id"]] = article
+
+    calls = {"article": 0}
+    create_cluster_article = article_publisher.create_cluster_article
+
+    def _counted_create_cluster_article(research_notes):
+        calls["article"] += 1
+        return create_cluster_article(research_notes)
+
+    article_publisher.get_cluster_metadata = lambda cluster_ids: {cluster_id: _documents(cluster_id) for cluster_id in cluster_ids}
+    article_publisher.create_cluster_article = _counted_create_cluster_article
+
+    # First delivery, the chunk's database write fails
+    article_publisher.update_db = _failing_update_db
+    result = service_dispatcher.handler(_event(), None)
+    print(result)
+    assert result == {"batchItemFailures": [{"itemIdentifier": "publish-1"}]}, result
+    assert calls["article"] == len(CLUSTERS)
+
+    # Redelivery, the articles come from the ledger and are written
+    article_publisher.update_db = _update_db
+    result = service_dispatcher.handler(_event(), None)
+    print(result)
+    assert result == {"batchItemFailures": []}, result
+    assert sorted(written) == CLUSTERS
+    assert calls["article"] == len(CLUSTERS), "the redelivery repeated Gemini steps"
+
+    # A third delivery finds every cluster published
+    result = service_dispatcher.handler(_event(), None)
+    assert result == {"batchItemFailures": []}, result
+    assert len(articles_written) == len(CLUSTERS)
+
+    print("update_db failure is reported as a batch item failure and retried from the ledger")
+
+
+if __name__ == "__main__":
+    main()
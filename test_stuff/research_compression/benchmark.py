@@ -0,0 +1,155 @@
+"""
+Research Compression Benchmark
+
+Compares the underwriter's old fixed window (text[1000:50000]) with extractive compression
+(logic/compression.py) on a fixed, seeded sample set of clusters. Each primary and
+secondary document is long legislative boilerplate with a few passages about the cluster's
+subject planted at random positions. Every planted passage carries a fact (an amount and a
+date) that the research notes should cover.
+
+For each cluster it reports input tokens, underwriter latency with the fake Gemini provider
+(latency modelled per input character, FAKE_LLM_LATENCY) and the share of planted facts
+that reached the prompt.
+
+    python test_stuff/research_compression/benchmark.py
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix="research-benchmark-")
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["ASTRA_STORAGE"] = "local"
+os.environ["ASTRA_LOCAL_STORAGE_DIR"] = WORKDIR
+# Every run writes its notes from scratch, the research notes cache would serve the second mode
+os.environ["RESEARCH_CACHE_TTL_DAYS"] = "0"
+# ~0.3s per call plus prefill time per input character
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.3,0.1,0.00004")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import logic.article_publisher as article_publisher
+import logic.cluster_documents
+import logic.compression
+
+SUBJECTS = [
+    ("rural broadband", "grants for rural broadband deployment in unserved counties"),
+    ("veterans health", "mental health services at veterans affairs medical centers"),
+    ("wildfire", "wildfire mitigation funding for forest service fuel reduction"),
+    ("semiconductor", "semiconductor manufacturing tax credits for domestic fabs"),
+    ("child care", "child care subsidies for low income working families"),
+    ("drinking water", "lead pipe replacement in municipal drinking water systems"),
+    ("student loans", "income driven repayment of federal student loans"),
+    ("port security", "cargo screening and port security at coastal terminals"),
+]
+
+BOILERPLATE = ("the secretary shall prescribe such regulations as may be necessary to carry out this "
+               "subsection including definitions of terms used herein and procedures for administrative "
+               "review consistent with title five united states code except as otherwise provided the "
+               "amendments made by this section shall take effect on the date of enactment").split()
+
+
+def _boilerplate(rng, words):
+    return " ".join(rng.choice(BOILERPLATE) for _ in range(words)) + "."
+
+
+def _document(rng, subject, description, chars, planted):
+    """
+    Sections of boilerplate with `planted` passages about the subject at random positions.
+    :return: (text, list of fact strings)
+    """
+    sections = []
+    while sum(len(section) for section in sections) < chars:
+        sections.append(f"SEC. {len(sections) + 1}. {_boilerplate(rng, rng.randint(60, 140))}")
+
+    facts = []
+    for _ in range(planted):
+        amount = f"${rng.randint(1, 99)}.{rng.randint(1, 9)} billion"
+        date = f"{rng.choice(['March', 'June', 'September', 'December'])} {rng.randint(1, 28)}, {rng.randint(2026, 2030)}"
+        facts.append(amount)
+        position = rng.randrange(len(sections))
+        sections[position] += (f"\n\nThe program for {description} shall receive {amount} through {date}, "
+                               f"and the agency shall report on {subject} outcomes each year.")
+    return "\n\n".join(sections), facts
+
+
+def sample_set(seed=42):
+    rng = random.Random(seed)
+    clusters = []
+    for subject, description in SUBJECTS:
+        rows = []
+        facts = []
+        primary, primary_facts = _document(rng, subject, description, rng.randint(30000, 200000), 4)
+        facts += primary_facts
+        rows.append({"source": "congress", "type": "primary", "title": f"A bill to provide {description}",
+                     "text": primary, "url": "", "keyword": subject})
+        for _ in range(rng.randint(1, 2)):
+            secondary, secondary_facts = _document(rng, subject, description, rng.randint(20000, 120000), 2)
+            facts += secondary_facts
+            rows.append({"source": "federal register", "type": "secondary", "title": f"Notice on {subject} program funding",
+                         "text": secondary, "url": "", "keyword": subject})
+        for headline in (f"Congress moves on {subject}", f"What the {subject} bill means for you"):
+            rows.append({"source": "news", "type": "news", "title": headline, "text": "", "url": "", "keyword": subject})
+        clusters.append((subject, logic.cluster_documents.from_records(rows), facts))
+    return clusters
+
+
+class _RecordingModel:
+    """
+    Wraps the underwriter's model to keep the prompts it was sent
+    """
+    def __init__(self, model):
+        self.model = model
+        self.model_name = model.model_name
+        self.prompts = []
+
+    def generate_content(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return self.model.generate_content(prompt, **kwargs)
+
+
+def _run(documents, facts):
+    model = _RecordingModel(article_publisher.summary_model)
+    article_publisher.summary_model = model
+    try:
+        started = time.perf_counter()
+        article_publisher.underwriter_research(documents)
+        elapsed = time.perf_counter() - started
+    finally:
+        article_publisher.summary_model = model.model
+
+    sent = "\n".join(model.prompts)
+    found = sum(1 for fact in facts if fact in sent)
+    return logic.compression.estimate_tokens(sent), elapsed, found
+
+
+def benchmark():
+    compress = logic.compression.compress
+    modes = [("window", lambda text, queries, budget: text[1000:50000]), ("compressed", compress)]
+    totals = {label: [0, 0.0, 0, 0] for label, _ in modes}
+
+    print(f"{'cluster':<16} {'mode':<11} {'tokens':>8} {'latency':>8} {'facts':>7}")
+    for subject, documents, facts in sample_set():
+        for label, fn in modes:
+            logic.compression.compress = fn
+            tokens, elapsed, found = _run(documents, facts)
+            totals[label][0] += tokens
+            totals[label][1] += elapsed
+            totals[label][2] += found
+            totals[label][3] += len(facts)
+            print(f"{subject:<16} {label:<11} {tokens:>8} {elapsed:>7.2f}s {found:>3}/{len(facts):<3}")
+    logic.compression.compress = compress
+
+    print()
+    for label, (tokens, elapsed, found, total) in totals.items():
+        print(f"{label:<11} {tokens:>8} tokens  {elapsed:6.2f}s  {found}/{total} facts ({found / total:.0%})")
+
+
+if __name__ == "__main__":
+    try:
+        benchmark()
+    finally:
+        shutil.rmtree(WORKDIR)
@@ -0,0 +1,152 @@
+"""
+SES Sender Benchmark
+
+Delivers a day's newsletters through a local SES stand-in that answers after SES_LATENCY and
+throttles (like SES's "Maximum sending rate exceeded") once more than MAX_SEND_RATE recipients
+were sent in the last second. Every email counts as two recipients, the user and the copy.
+Addresses starting with "rejected" get MessageRejected, the batch handlers must not retry them.
+
+  per message - ses.handler one SQS message at a time, with a new SES client per email and
+                throttled emails dropped, as ses.send_email did before common.mailer
+  bulk        - ses.batch_handler per SQS batch, BulkSender threads under the token bucket
+  templated   - as bulk, users of a batch who got the same recommendations share one
+                SendBulkTemplatedEmail call
+
+The database and Gemini are stand-ins, the newsletter render cache is warmed first.
+
+    python test_stuff/ses_sender/benchmark.py [--emails 300] [--batch 5] [--sets 20]
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import threading
+import time
+
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.01,0.1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import boto3
+from botocore.exceptions import ClientError
+
+import common.mailer
+import logic.ses as ses
+
+MAX_SEND_RATE = 50
+SES_LATENCY = 0.08
+
+
+class _SESStandIn:
+    """
+    The SES client calls common.mailer makes, with SES's send rate enforced over a sliding second
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = collections.deque()
+        self.delivered = 0
+        self.throttled = 0
+        self.calls = 0
+        self.templates = {}
+
+    def _admit(self, recipients, operation, rejected=0):
+        time.sleep(SES_LATENCY)
+        with self.lock:
+            self.calls += 1
+            now = time.monotonic()
+            while self.sent and now - self.sent[0][0] > 1.0:
+                self.sent.popleft()
+            if sum(count for _, count in self.sent) + recipients > MAX_SEND_RATE:
+                self.throttled += 1
+                raise ClientError({"Error": {"Code": "Throttling", "Message": "Maximum sending rate exceeded."}}, operation)
+            self.sent.append((now, recipients))
+            self.delivered += recipients // 2 - rejected
+
+    def get_send_quota(self):
+        return {"MaxSendRate": float(MAX_SEND_RATE), "Max24HourSend": 50000.0, "SentLast24Hours": 0.0}
+
+    def send_raw_email(self, Source, Destinations, RawMessage):
+        rejected = Destinations[0].startswith("rejected")
+        self._admit(len(Destinations), "SendRawEmail", rejected)
+        if rejected:
+            raise ClientError({"Error": {"Code": "MessageRejected", "Message": "Email address is not verified."}}, "SendRawEmail")
+        return {"MessageId": f"raw-{self.calls}"}
+
+    def create_template(self, Template):
+        self.templates[Template["TemplateName"]] = Template
+
+    def delete_template(self, TemplateName):
+        del self.templates[TemplateName]
+
+    def send_bulk_templated_email(self, Source, Template, DefaultTemplateData, Destinations):
+        assert Template in self.templates
+        rejected = [destination["Destination"]["ToAddresses"][0].startswith("rejected") for destination in Destinations]
+        self._admit(2 * len(Destinations), "SendBulkTemplatedEmail", sum(rejected))
+        return {"Status": [{"Status": "MessageRejected", "Error": "Email address is not verified."} if reject
+                           else {"Status": "Success", "MessageId": f"bulk-{self.calls}-{i}"}
+                           for i, reject in enumerate(rejected)]}
+
+
+def _per_message_send(stand_in):
+    # ses.send_email before common.mailer: a new client per email, throttled emails only logged
+    def _send_email(recipient, subject, html):
+        boto3.client('ses', region_name="us-east-1", aws_access_key_id="stand-in", aws_secret_access_key="stand-in")
+        try:
+            response = stand_in.send_raw_email(Source=common.mailer.SOURCE, Destinations=[recipient, common.mailer.COPY_TO],
+                                               RawMessage={"Data": common.mailer.build_message(recipient, subject, html)})
+            return response["MessageId"]
+        except ClientError as e:
+            return None
+    return _send_email
+
+
+def benchmark(emails, batch, sets):
+    rng = random.Random(5)
+    articles = {article_id: {"id": article_id, "title": f"Article {article_id}", "summary": "A summary of the article."}
+                for article_id in range(1, 101)}
+    recommendation_sets = [rng.sample(list(articles), 5) for _ in range(sets)]
+    payloads = [{"user_id": i, "user_email": f"user{i}@example.com", "user_name": "Test User", "episode": "7",
+                 "recommendations": rng.choice(recommendation_sets)} for i in range(emails)]
+    # One permanently undeliverable address, acknowledged rather than retried
+    payloads[len(payloads) // 2]["user_email"] = "rejected@example.com"
+
+    ses.get_articles_by_ids = lambda ids: [articles[article_id] for article_id in ids]
+    ses.update_user_delivered = lambda user_id, episode: None
+    for recommendations in recommendation_sets:
+        ses.newsletter(recommendations)
+    send_email = ses.send_email
+
+    print(f"{emails} emails in SQS batches of {batch}, {sets} recommendation sets, "
+          f"SES stand-in at {MAX_SEND_RATE} recipients/s, {SES_LATENCY * 1000:.0f}ms per call")
+    print(f"{'mode':<12} {'time':>7} {'emails/s':>9} {'delivered':>10} {'SES calls':>10} {'throttled':>10}")
+    for label, templated_min in (("per message", None), ("bulk", 0), ("templated", 2)):
+        stand_in = _SESStandIn()
+        common.mailer._client, common.mailer._bucket = stand_in, None
+        common.mailer.SES_TEMPLATED_MIN_RECIPIENTS = templated_min or 0
+
+        started = time.perf_counter()
+        if templated_min is None:
+            ses.send_email = _per_message_send(stand_in)
+            for payload in payloads:
+                ses.handler(payload)
+            ses.send_email = send_email
+        else:
+            failed = []
+            for start in range(0, emails, batch):
+                failed += ses.batch_handler(payloads[start:start + batch])
+            assert not failed, failed
+        elapsed = time.perf_counter() - started
+
+        print(f"{label:<12} {elapsed:>6.2f}s {emails / elapsed:>9.1f} {stand_in.delivered:>6}/{emails:<3} "
+              f"{stand_in.calls:>10} {stand_in.throttled:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SES sender benchmark")
+    parser.add_argument("--emails", type=int, default=300)
+    parser.add_argument("--batch", type=int, default=5, help="SQS messages per invocation (content queue batchSize)")
+    parser.add_argument("--sets", type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.emails, args.batch, args.sets)
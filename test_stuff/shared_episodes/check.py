@@ -0,0 +1,108 @@
+"""
+Shared Episode Check
+
+Users waiting on a shared episode only take over the claim when its owner stopped
+refreshing it, and otherwise fail with EpisodePending so their message is retried
+instead of paying for a second generation of the same episode.
+
+  live claim   - a waiter on a claim whose heartbeat keeps changing it raises EpisodePending
+  dead claim   - once the heartbeat stops, the waiter takes the claim over
+  published    - a waiter gets the owner's published episode
+  failures     - publish errors are raised, not reported as a missing share
+
+Runs against local storage in a temporary directory with the timings scaled down.
+
+    python test_stuff/shared_episodes/check.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+WORKDIR = tempfile.mkdtemp(prefix="shared-episodes-")
+os.environ["ASTRA_STORAGE"] = "local"
+os.environ["ASTRA_LOCAL_STORAGE_DIR"] = WORKDIR
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+
+import common.s3
+import logic.shared_episodes as shared_episodes
+
+shared_episodes.POLL_SECONDS = 0.05
+shared_episodes.HEARTBEAT_SECONDS = 0.1
+shared_episodes.STALE_CLAIM_SECONDS = 0.5
+shared_episodes.WAIT_SECONDS = 1.5
+
+
+def _episode(recommendations):
+    return shared_episodes.SharedEpisode(recommendations, "premium", week="2025-W01")
+
+
+def check_live_claim():
+    owner = _episode([1, 2, 3])
+    assert owner.acquire("owner") is None and owner.claimed
+    try:
+        _episode([3, 2, 1]).acquire("waiter")
+        raise AssertionError("the waiter took over a claim with a live heartbeat")
+    except shared_episodes.EpisodePending as e:
+        print(f"live claim: ok ({e})")
+    finally:
+        owner.release("owner")
+
+
+def check_dead_claim():
+    owner = _episode([4, 5])
+    owner.acquire("owner")
+    # The owner's Lambda dies, nothing refreshes or releases the claim
+    owner._end_heartbeat()
+    waiter = _episode([4, 5])
+    assert waiter.acquire("waiter") is None and waiter.claimed
+    entry = common.s3.get_json(waiter.path)
+    assert entry["owner"] == "waiter" and entry["status"] == "pending", entry
+    waiter.release("waiter")
+    print("dead claim: ok")
+
+
+def check_published():
+    owner = _episode([6])
+    owner.acquire("owner")
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(episode=_episode([6]).acquire("waiter")))
+    waiter.start()
+    owner.publish("owner", "Episode", [], "s3://bucket/owner/1.mp3", ["**HOST 1:** Hi"])
+    waiter.join()
+    assert result["episode"]["status"] == "ready" and result["episode"]["owner"] == "owner", result
+    print("published: ok")
+
+
+def check_failures():
+    owner = _episode([7])
+    owner.acquire("owner")
+    save_json = common.s3.save_json
+
+    def _failing_save_json(key, data):
+        raise OSError("bucket unavailable")
+
+    common.s3.save_json = _failing_save_json
+    try:
+        owner.publish("owner", "Episode", [], "s3://bucket/owner/1.mp3", [])
+        raise AssertionError("publish swallowed the error")
+    except OSError:
+        pass
+    finally:
+        common.s3.save_json = save_json
+    owner.release("owner")
+    # Released claims are taken over right away
+    assert _episode([7]).acquire("waiter") is None
+    print("failures: ok")
+
+
+if __name__ == "__main__":
+    try:
+        check_live_claim()
+        check_dead_claim()
+        check_published()
+        check_failures()
+    finally:
+        shutil.rmtree(WORKDIR)
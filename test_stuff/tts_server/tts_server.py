@@ -0,0 +1,321 @@
+"""
+Stand-in TTS Server
+
+Local stand-in for OpenAI's /v1/audio/speech endpoint, used to benchmark the content
+Lambda's TTS pipeline without spending API credits. Each request sleeps for a latency
+proportional to its input length and returns MP3 frames of random noise, as long as the
+text would take to speak. Requests above the concurrency limit get a 429 with Retry-After,
+like the real API's rate limiting.
+
+Run the benchmark (episode TTS latency at 1/4/8/16 workers, then a repeat served by the clip cache):
+    python test_stuff/tts_server/tts_server.py --benchmark
+
+Compare writing lines to /tmp, joining and then uploading against streaming the episode
+into a multipart upload (end to end latency and peak /tmp usage):
+    python test_stuff/tts_server/tts_server.py --benchmark-episode
+
+Or run the server on its own and point the Lambda at it:
+    python test_stuff/tts_server/tts_server.py --port 8765
+    export OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency model: fixed overhead + time per input character, with jitter
+BASE_LATENCY_SECONDS = 0.4
+SECONDS_PER_CHAR = 0.002
+JITTER = 0.25
+
+# Requests in flight above this are rejected with 429
+CONCURRENCY_LIMIT = 12
+RETRY_AFTER_SECONDS = 0.5
+
+# MPEG-2 Layer III, 24 kHz mono, 64 kbps frames (24 ms each), ~15 chars of speech per second
+FRAME_HEADER = bytes([0xFF, 0xF3, 0x84, 0xC4])
+FRAME_LENGTH = 192
+BYTES_PER_CHAR = 533
+
+# Upload bandwidth of the simulated bucket in --benchmark-episode
+UPLOAD_BYTES_PER_SECOND = 2 * 1024 * 1024
+
+
+class _State:
+    in_flight = 0
+    requests = 0
+    rate_limited = 0
+    lock = threading.Lock()
+
+
+class TTSHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.endswith("/audio/speech"):
+            self._reply(404, b'{"error": {"message": "not found"}}', "application/json")
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        text = request.get("input", "")
+
+        with _State.lock:
+            _State.requests += 1
+            if _State.in_flight >= CONCURRENCY_LIMIT:
+                _State.rate_limited += 1
+                limited = True
+            else:
+                _State.in_flight += 1
+                limited = False
+
+        if limited:
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}})
+            self._reply(429, body.encode(), "application/json", {"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return
+
+        try:
+            latency = (BASE_LATENCY_SECONDS + SECONDS_PER_CHAR * len(text)) * random.uniform(1 - JITTER, 1 + JITTER)
+            time.sleep(latency)
+            self._reply(200, _mp3_noise(BYTES_PER_CHAR * len(text)), "audio/mpeg")
+        finally:
+            with _State.lock:
+                _State.in_flight -= 1
+
+
+def _mp3_noise(size):
+    """
+    About `size` bytes of valid MP3 frames with random payloads
+    """
+    frames = max(1, size // FRAME_LENGTH)
+    return b"".join(FRAME_HEADER + os.urandom(FRAME_LENGTH - 4) for _ in range(frames))
+
+
+def start(port=0):
+    """
+    Start the server on a background thread, returns the server (server.server_port is the bound port)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), TTSHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _benchmark_script(turns=40, seed=0):
+    rng = random.Random(seed)
+    words = "the bill would expand funding for rural broadband and require annual reports to congress".split()
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(15, 60))) for _ in range(turns)]
+
+
+def _setup(workdir):
+    """
+    Start the server and point the content Lambda at it, with the TTS clip cache kept off the real bucket
+    """
+    server = start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    os.environ.setdefault("TTS_BACKOFF_SECONDS", "0.2")
+    os.environ["ASTRA_STORAGE"] = "local"
+    os.environ["ASTRA_LOCAL_STORAGE_DIR"] = os.path.join(workdir, "bucket")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts-cache")
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "content-lambda"))
+    return server
+
+
+def benchmark(worker_counts=(1, 4, 8, 16), turns=40):
+    workdir = tempfile.mkdtemp(prefix="tts-benchmark-")
+    server = _setup(workdir)
+    from openai import OpenAI
+    import logic.nlp as nlp
+
+    client = OpenAI(max_retries=0)
+    print(f"Episodes of {turns} turns, server concurrency limit {CONCURRENCY_LIMIT}")
+
+    # A new script per worker count so the clip cache doesn't help, then a repeat that it does
+    runs = [(workers, _benchmark_script(turns, seed=workers)) for workers in worker_counts]
+    runs.append((worker_counts[-1], runs[-1][1]))
+
+    for workers, script in runs:
+        _State.requests = _State.rate_limited = 0
+        started = time.perf_counter()
+        clips = list(nlp.synthesize_lines(client, script, workers=workers))
+        elapsed = time.perf_counter() - started
+
+        assert [index for index, _ in clips] == list(range(turns))
+        print(f"{workers:>3} workers: {elapsed:6.2f}s  ({_State.requests} requests, {_State.rate_limited} rate limited)")
+
+    server.shutdown()
+    shutil.rmtree(workdir)
+
+
+class _SlowBucket:
+    """
+    In-memory stand-in for the boto3 S3 client calls used to store an episode. Uploads share
+    one link of UPLOAD_BYTES_PER_SECOND, parallel parts don't make it any faster.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.link = threading.Lock()
+
+    def _send(self, size):
+        with self.link:
+            time.sleep(size / UPLOAD_BYTES_PER_SECOND)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._send(len(Body))
+        self.objects[Key] = bytes(Body)
+
+    def upload_file(self, f_path, bucket, key, Config=None):
+        with open(f_path, 'rb') as f:
+            self.put_object(bucket, key, f.read())
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._send(len(Body))
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+
+class _DiskUsage:
+    """
+    Samples the size of a directory tree on a background thread and keeps the peak
+    """
+    def __init__(self, root, interval=0.01):
+        self.root = root
+        self.interval = interval
+        self.peak = 0
+
+    def _size(self):
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def _run(self):
+        while not self.done.is_set():
+            self.peak = max(self.peak, self._size())
+            self.done.wait(self.interval)
+
+    def __enter__(self):
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, self._size())
+        return False
+
+
+def benchmark_episode(turns=120, workers=8):
+    """
+    End to end latency and peak /tmp usage of synthesizing, joining and storing one episode:
+      serial    - lines written to a /tmp workspace, joined into podcast.mp3, then uploaded
+      streaming - clips joined in memory and streamed into a multipart upload as parts fill up
+    Both run against a fresh script (no clip cache hits) and leave out the intro crossfade.
+    """
+    workdir = tempfile.mkdtemp(prefix="episode-benchmark-")
+    os.environ.setdefault("S3_MULTIPART_CHUNKSIZE_MB", "5")
+    server = _setup(workdir)
+    from openai import OpenAI
+    import common.s3
+    import logic.audio
+    import logic.nlp as nlp
+
+    client = OpenAI(max_retries=0)
+    bucket = _SlowBucket()
+    storage = common.s3.S3Storage("benchmark")
+    storage._client = bucket
+
+    def _serial(script, workspace):
+        line_files = []
+        for index, audio_bytes in nlp.synthesize_lines(client, script, workers=workers):
+            f_path = os.path.join(workspace, "conversation", str(1 if index % 2 == 0 else 2), f"line_{len(line_files)}.mp3")
+            os.makedirs(os.path.dirname(f_path), exist_ok=True)
+            with open(f_path, 'wb') as f:
+                f.write(audio_bytes)
+            line_files.append(f_path)
+
+        def _read_clips():
+            for f_path in line_files:
+                with open(f_path, 'rb') as f:
+                    yield f.read()
+
+        with open(os.path.join(workspace, "podcast.mp3"), 'wb') as out:
+            logic.audio.assemble_episode(_read_clips(), out)
+        storage.upload_file(os.path.join(workspace, "podcast.mp3"), "serial/podcast.mp3")
+
+    def _streaming(script, workspace):
+        clips = (audio_bytes for _, audio_bytes in nlp.synthesize_lines(client, script, workers=workers))
+        with storage.open_writer("streaming/podcast.mp3", content_type='audio/mpeg') as out:
+            logic.audio.assemble_episode(clips, out)
+
+    results = []
+    for seed, (label, run) in enumerate((("serial", _serial), ("streaming", _streaming))):
+        workspace = os.path.join(workdir, label)
+        os.makedirs(workspace)
+        script = _benchmark_script(turns, seed=100 + seed)
+        with _DiskUsage(workspace) as usage:
+            started = time.perf_counter()
+            run(script, workspace)
+            elapsed = time.perf_counter() - started
+        size = len(bucket.objects[f"{label}/podcast.mp3"])
+        results.append((label, elapsed, usage.peak, size))
+
+    print(f"\nEpisodes of {turns} turns, {workers} TTS workers, upload at {UPLOAD_BYTES_PER_SECOND / 1024 / 1024:.0f} MB/s")
+    for label, elapsed, peak, size in results:
+        print(f"  {label:<10} {elapsed:6.2f}s end to end  peak /tmp {peak / 1024 / 1024:6.1f} MB  episode {size / 1024 / 1024:.1f} MB")
+
+    server.shutdown()
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in OpenAI TTS server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--benchmark", action="store_true", help="benchmark nlp.synthesize_lines at 1/4/8/16 workers")
+    parser.add_argument("--benchmark-episode", action="store_true", help="benchmark serial vs streaming episode upload")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+    elif args.benchmark_episode:
+        benchmark_episode()
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), TTSHandler)
+        print(f"Stand-in TTS server on http://127.0.0.1:{args.port}/v1")
+        server.serve_forever()